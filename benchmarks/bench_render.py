@@ -0,0 +1,87 @@
+"""
+Benchmark streamed-token rendering: tokens per second and CPU time per token
+for the old per-chunk console.print path versus StreamRenderer (plain and
+Markdown). Output goes to a terminal-like rich Console writing to /dev/null,
+so terminal speed doesn't enter the numbers.
+
+    python benchmarks/bench_render.py --tokens 20000
+    python benchmarks/bench_render.py --compare old.json new.json
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from rich.console import Console
+
+from common import environment, write_results, compare_results, random_text
+
+from localrag.render import StreamRenderer
+
+
+def per_chunk_print(console, tokens):
+    """The pre-StreamRenderer path: one rich print and one flush per chunk."""
+    for token in tokens:
+        console.print(token, end="", highlight=False)
+        sys.stdout.flush()
+    console.print()
+
+
+def stream_renderer(console, tokens, fps, markdown):
+    renderer = StreamRenderer(console, fps=fps, markdown=markdown, spinner=False).start()
+    for token in tokens:
+        renderer.feed(token)
+    renderer.close()
+    return renderer.frames
+
+
+def bench(name, fn, tokens):
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    frames = fn(tokens)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    result = {
+        "tokens": len(tokens),
+        "seconds": wall,
+        "tokens_per_s": len(tokens) / wall if wall else 0.0,
+        "cpu_us_per_token": 1e6 * cpu / len(tokens),
+    }
+    if frames is not None:
+        result["frames"] = frames
+    print(f"  {name:<12} {result['tokens_per_s']:>12,.0f} tok/s  {result['cpu_us_per_token']:>8.1f} us CPU/token", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=20000, help="Tokens streamed per renderer")
+    parser.add_argument("--fps", type=int, default=30, help="StreamRenderer frame rate")
+    parser.add_argument("--markdown-tokens", type=int, default=2000, help="Tokens for the Markdown renderer (re-renders the whole text per frame)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Result JSON path (default: benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    tokens = []
+    while len(tokens) < args.tokens:
+        tokens += [word + " " for word in random_text(rng, 5000).split()]
+    tokens = tokens[:args.tokens]
+    results = {"environment": environment(), "params": vars(args), "results": {}}
+    with open(os.devnull, "w") as devnull:
+        console = Console(file=devnull, force_terminal=True, width=100)
+        results["results"]["per_chunk_print"] = bench(
+            "per-chunk", lambda t: per_chunk_print(console, t), tokens)
+        results["results"]["buffered"] = bench(
+            "buffered", lambda t: stream_renderer(console, t, args.fps, False), tokens)
+        results["results"]["markdown"] = bench(
+            "markdown", lambda t: stream_renderer(console, t, args.fps, True), tokens[:args.markdown_tokens])
+    print(write_results("render", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
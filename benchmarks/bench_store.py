@@ -0,0 +1,195 @@
+"""
+Benchmark the vector store, chat store and a full (stubbed) chat turn on
+synthetic corpora. Each corpus size runs in its own subprocess so RSS numbers
+are not polluted by earlier sizes. Runs offline: embeddings come from
+HashingEmbedder and the LLM is the built-in "local-stub" runtime.
+
+    python benchmarks/bench_store.py --sizes 1k,10k,100k,1m
+    python benchmarks/bench_store.py --sizes 100k --index-type sq8 --rerank 4
+    python benchmarks/bench_store.py --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import datetime
+import subprocess
+
+import numpy as np
+
+from common import (
+    HashingEmbedder, parse_size, write_corpus, timed, percentiles,
+    rss_bytes, peak_rss_bytes, environment, write_results, compare_results, random_text,
+)
+
+from localrag.vectorstore import VectorStore, INDEX_TYPES
+from localrag.chatstore import load_chat, save_chat, get_all_chats
+
+DEFAULT_SIZES = "1k,10k,100k,1m"
+
+
+def bench_size(n_messages, workdir, queries, adds, seed, stub_config, index_type="flat", rerank=0):
+    chats_dir = os.path.join(workdir, "chats")
+    store_path = os.path.join(workdir, "vector_store")
+    os.makedirs(store_path, exist_ok=True)
+    embedder = HashingEmbedder(seed=seed)
+    rng = random.Random(seed)
+    text_rng = np.random.default_rng(seed + 1)
+    query_texts = [random_text(text_rng, 5000) for _ in range(queries)]
+    result = {"messages": n_messages}
+
+    build_s, _ = timed(write_corpus, chats_dir, VectorStore(store_path, None, embedding_model=embedder), n_messages, seed)
+    result["build_s"] = build_s
+    if index_type != "flat":
+        migrate_s, report = timed(VectorStore(store_path, None, embedding_model=embedder).migrate, index_type, rerank, seed=seed)
+        result["compression"] = {"migrate_s": migrate_s, **report}
+
+    # Cold load: opening the store, then forcing every partition into memory
+    rss_before = rss_bytes()
+    open_s, store = timed(VectorStore, store_path, None, embedding_model=embedder)
+    start = time.perf_counter()
+    for partition in store.partitions.values():
+        partition.load()
+    result["load"] = {
+        "open_s": open_s,
+        "load_all_s": open_s + time.perf_counter() - start,
+        "partitions": len(store.partitions),
+    }
+    result["rss"] = {"store_bytes": rss_bytes() - rss_before}
+
+    samples = [timed(store.search, q)[0] for q in query_texts]
+    result["search"] = percentiles(samples)
+
+    chat_ids = sorted({m.split(":", 1)[0] for p in store.partitions.values() for m in p.ids[:50]})
+    samples = [timed(store.search, q, chat_id=rng.choice(chat_ids))[0] for q in query_texts]
+    result["search_chat_filter"] = percentiles(samples)
+
+    since = (datetime.datetime(2024, 1, 1) + datetime.timedelta(days=700)).isoformat()
+    samples = [timed(store.search, q, since=since)[0] for q in query_texts]
+    result["search_recent_filter"] = percentiles(samples)
+
+    samples = [timed(store.add, f"bench-add:{i}", query_texts[i % len(query_texts)], "gpt-4.1")[0] for i in range(adds)]
+    result["add"] = percentiles(samples)
+
+    for partition in store.partitions.values():
+        partition.dirty = True
+    result["save_all_s"], _ = timed(store.save)
+
+    listing_s, chats = timed(get_all_chats, chats_dir)
+    result["list_chats"] = {"seconds": listing_s, "chats": len(chats)}
+
+    sample_chat = load_chat(chats_dir, chats[0]["id"])
+    samples = [timed(save_chat, chats_dir, sample_chat)[0] for _ in range(adds)]
+    result["save_chat"] = percentiles(samples)
+
+    result["turn"] = bench_turns(store, chats_dir, query_texts[:adds], stub_config)
+    result["rss"]["current_bytes"] = rss_bytes()
+    result["rss"]["peak_bytes"] = peak_rss_bytes()
+    return result
+
+
+def bench_turns(store, chats_dir, prompts, stub_config):
+    """Time the chat-turn pipeline: retrieval, stub LLM, store adds, chat save."""
+    from localrag.chatstore import create_new_chat
+    from localrag.cli import get_relevant_context
+    from localrag.llm import send_message_to_llm
+
+    chat = create_new_chat("local-stub")
+    stages = {"context": [], "llm": [], "vector_add": [], "save_chat": [], "total": []}
+    for prompt in prompts:
+        turn_start = time.perf_counter()
+        chat["messages"].append({"role": "user", "content": prompt, "context": "", "image": None})
+        elapsed, context = timed(get_relevant_context, store, prompt, chats_dir=chats_dir)
+        chat["messages"][-1]["context"] = context
+        stages["context"].append(elapsed)
+        elapsed, response = timed(send_message_to_llm, chat["model"], chat["messages"], stub_config, context)
+        stages["llm"].append(elapsed)
+        chat["messages"].append({"role": "assistant", "content": response})
+        start = time.perf_counter()
+        store.add(f"{chat['id']}:{len(chat['messages']) - 2}", prompt, model=chat["model"])
+        store.add(f"{chat['id']}:{len(chat['messages']) - 1}", response, model=chat["model"])
+        stages["vector_add"].append(time.perf_counter() - start)
+        elapsed, _ = timed(save_chat, chats_dir, chat)
+        stages["save_chat"].append(elapsed)
+        stages["total"].append(time.perf_counter() - turn_start)
+    return {stage: percentiles(samples) for stage, samples in stages.items()}
+
+
+def run_worker(args):
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="localrag-bench-", dir=args.workdir)
+    try:
+        stub_config = {
+            "stub_first_token_delay": args.stub_first_token_delay,
+            "stub_tokens_per_second": args.stub_tokens_per_second,
+            "stub_response_tokens": args.stub_response_tokens,
+        }
+        result = bench_size(args.worker, workdir, args.queries, args.adds, args.seed, stub_config,
+                            args.index_type, args.rerank)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    json.dump(result, sys.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated corpus sizes in messages (e.g. 1k,10k)")
+    parser.add_argument("--queries", type=int, default=200, help="Search queries per size")
+    parser.add_argument("--adds", type=int, default=50, help="Single adds, chat saves and turns per size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-first-token-delay", type=float, default=0.0, help="Stub LLM delay before the first token (s)")
+    parser.add_argument("--stub-tokens-per-second", type=float, default=0.0, help="Stub LLM token rate (0 = unthrottled)")
+    parser.add_argument("--stub-response-tokens", type=int, default=64, help="Stub LLM response length in tokens")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="Convert the store to this index type before measuring")
+    parser.add_argument("--rerank", type=int, default=0, help="Re-rank factor over full vectors for sq16/sq8 (0 = off)")
+    parser.add_argument("--workdir", default=None, help="Where to build corpora (default: system temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep generated corpora")
+    parser.add_argument("--output", default=None, help="Result JSON path (default: benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two result files")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+    if args.worker is not None:
+        run_worker(args)
+        return
+
+    results = {"environment": environment(), "params": vars(args), "results": {}}
+    for size in args.sizes.split(","):
+        n_messages = parse_size(size)
+        print(f"[bench_store] {size} ({n_messages:,} messages)...", file=sys.stderr)
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", str(n_messages),
+               "--queries", str(args.queries), "--adds", str(args.adds), "--seed", str(args.seed),
+               "--stub-first-token-delay", str(args.stub_first_token_delay),
+               "--stub-tokens-per-second", str(args.stub_tokens_per_second),
+               "--stub-response-tokens", str(args.stub_response_tokens),
+               "--index-type", args.index_type, "--rerank", str(args.rerank)]
+        if args.workdir:
+            cmd += ["--workdir", args.workdir]
+        if args.keep:
+            cmd.append("--keep")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            results["results"][size] = {"error": proc.stderr.strip().splitlines()[-1:]}
+            continue
+        results["results"][size] = json.loads(proc.stdout)
+        summary = results["results"][size]
+        print(
+            f"  load {summary['load']['load_all_s']:.3f}s  search p50 {summary['search']['p50_ms']:.2f}ms  "
+            f"add p50 {summary['add']['p50_ms']:.2f}ms  list {summary['list_chats']['seconds']:.3f}s",
+            file=sys.stderr,
+        )
+    print(write_results("store", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
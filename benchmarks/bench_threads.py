@@ -0,0 +1,208 @@
+"""
+Find the thread settings (config.json: embedding_threads, faiss_threads,
+search_workers, index_workers) that suit this machine. Sweeps each setting
+over 1..cores, applying the thread counts through ResourceGovernor the way
+the CLI does, and reports:
+
+  faiss     batch search throughput on one flat index per faiss_threads
+  search    single-query latency over monthly partitions per search_workers
+  embed     embedding throughput per embedding_threads (needs
+            sentence-transformers; skipped otherwise). When torch shares
+            FAISS's OpenMP runtime the two counts are one setting, so the
+            sweep sets both and a single value is recommended
+  turn      a stubbed chat turn with its two vector-store adds run inline
+            after streaming versus on the BackgroundIndexer during streaming
+
+    python benchmarks/bench_threads.py
+    python benchmarks/bench_threads.py --vectors 200k --model all-MiniLM-L6-v2
+    python benchmarks/bench_threads.py --compare old.json new.json
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import faiss
+
+from common import HashingEmbedder, environment, write_results, compare_results, parse_size, percentiles, random_text
+
+from localrag.vectorstore import VectorStore
+from localrag.resources import ResourceGovernor, BackgroundIndexer
+from localrag.llm import send_message_to_llm
+from localrag.chatstore import create_new_chat
+
+
+def thread_counts(cores):
+    counts, n = [], 1
+    while n < cores:
+        counts.append(n)
+        n *= 2
+    return counts + [cores]
+
+
+def bench_faiss(vectors, queries, counts):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    results = {}
+    for threads in counts:
+        applied = ResourceGovernor({"faiss_threads": threads}).apply().applied()
+        index.search(queries[:8], 10)
+        start = time.perf_counter()
+        index.search(queries, 10)
+        elapsed = time.perf_counter() - start
+        results[threads] = {"queries_per_s": len(queries) / elapsed, "applied": applied["faiss_threads"]}
+        print(f"  faiss_threads={threads:<3} {results[threads]['queries_per_s']:>10,.0f} queries/s", file=sys.stderr)
+    return results
+
+
+def bench_search(store, query_texts, counts):
+    embeddings = store.embed(query_texts)
+    results = {}
+    for workers in counts:
+        store.search_workers = workers
+        samples = []
+        for row in range(len(query_texts)):
+            start = time.perf_counter()
+            store.search_many([query_texts[row]], top_k=5, embeddings=embeddings[row:row + 1])
+            samples.append(time.perf_counter() - start)
+        results[workers] = percentiles(samples)
+        print(f"  search_workers={workers:<3} p50 {results[workers]['p50_ms']:.2f}ms  p95 {results[workers]['p95_ms']:.2f}ms", file=sys.stderr)
+    return results
+
+
+def shared_openmp():
+    """Whether torch and FAISS use one OpenMP runtime, so faiss_threads also sets torch's count."""
+    applied = ResourceGovernor({"embedding_threads": 1, "faiss_threads": 2}).apply().applied()
+    return applied["embedding_threads"] == 2
+
+
+def bench_embed(model_name, texts, counts):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("  embed: sentence-transformers not installed, skipped", file=sys.stderr)
+        return None, None
+    model = SentenceTransformer(model_name)
+    model.encode(texts[:8])
+    shared = shared_openmp()
+    if shared:
+        print("  embed: torch shares FAISS's OpenMP runtime; faiss_threads sets both", file=sys.stderr)
+    results = {}
+    for threads in counts:
+        # With a shared runtime, faiss_threads (applied last) would override embedding_threads
+        config = {"embedding_threads": threads, "faiss_threads": threads if shared else None}
+        applied = ResourceGovernor(config).apply().applied()
+        start = time.perf_counter()
+        model.encode(texts)
+        elapsed = time.perf_counter() - start
+        results[threads] = {"texts_per_s": len(texts) / elapsed, "applied": applied["embedding_threads"]}
+        print(f"  embedding_threads={threads:<3} {results[threads]['texts_per_s']:>8,.0f} texts/s", file=sys.stderr)
+    return results, shared
+
+
+def bench_turn(store, prompts, stub_config, indexer):
+    """Stub LLM reply plus indexing of both messages, the way run_chat_turn does it."""
+    chat = create_new_chat("local-stub")
+    samples = []
+    for prompt in prompts:
+        if indexer is not None:
+            indexer.wait()
+        start = time.perf_counter()
+        query_embedding = store.embed([prompt])
+        chat["messages"].append({"role": "user", "content": prompt})
+        user_id = f"{chat['id']}:{len(chat['messages']) - 1}"
+        if indexer is not None:
+            indexer.add(store, user_id, prompt, embeddings=query_embedding)
+        reply = send_message_to_llm("local-stub", chat["messages"], stub_config)
+        chat["messages"].append({"role": "assistant", "content": reply})
+        reply_id = f"{chat['id']}:{len(chat['messages']) - 1}"
+        if indexer is not None:
+            indexer.add(store, reply_id, reply)
+        else:
+            store.add_many([(user_id, prompt, None, None)], embeddings=query_embedding)
+            store.add(reply_id, reply)
+        samples.append(time.perf_counter() - start)
+    if indexer is not None:
+        indexer.close()
+    return percentiles(samples)
+
+
+def best(results, key, lowest=False):
+    if not results:
+        return None
+    pick = min if lowest else max
+    return pick(results, key=lambda n: results[n][key])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 1, help="Largest thread count to try")
+    parser.add_argument("--vectors", default="100k", help="Vectors in the FAISS index and the store (e.g. 100k)")
+    parser.add_argument("--queries", type=int, default=256, help="Queries per measurement")
+    parser.add_argument("--partitions", type=int, default=24, help="Monthly partitions the store's vectors are spread over")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="sentence-transformers model for the embed sweep")
+    parser.add_argument("--embed-texts", type=int, default=512, help="Texts per embedding measurement")
+    parser.add_argument("--turns", type=int, default=20, help="Stubbed chat turns per indexing mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Result JSON path (default: benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    counts = thread_counts(args.cores)
+    n_vectors = parse_size(args.vectors)
+    texts = [random_text(rng, 5000) for _ in range(max(args.queries, args.embed_texts, args.turns))]
+    embedder = HashingEmbedder()
+    results = {"environment": environment(), "params": vars(args), "results": {}}
+
+    print(f"{args.cores} cores, thread counts {counts}", file=sys.stderr)
+    vectors = rng.standard_normal((n_vectors, embedder.dim)).astype('float32')
+    results["results"]["faiss"] = bench_faiss(vectors, vectors[:args.queries], counts)
+
+    workdir = tempfile.mkdtemp(prefix="localrag-threads-")
+    try:
+        store = VectorStore(os.path.join(workdir, "vector_store"), None, embedding_model=embedder, dedup=False)
+        months = [i % args.partitions for i in range(n_vectors)]
+        entries = [(f"bench-{i // 20:08d}:{i % 20}", f"message {i}", None,
+                    f"{2024 + month // 12}-{1 + month % 12:02d}-01T00:00:00")
+                   for i, month in enumerate(months)]
+        store.add_many(entries, batch_size=10_000, embeddings=vectors)
+        results["results"]["search"] = bench_search(store, texts[:args.queries], counts)
+        results["results"]["embed"], results["shared_openmp"] = bench_embed(args.model, texts[:args.embed_texts], counts)
+
+        stub_config = {"stub_first_token_delay": 0.05, "stub_tokens_per_second": 400, "stub_response_tokens": 40}
+        store.search_workers = best(results["results"]["search"], "p50_ms", lowest=True)
+        store.embed(texts[:1])
+        send_message_to_llm("local-stub", [{"role": "user", "content": "warm up"}], stub_config)
+        results["results"]["turn"] = {
+            "inline": bench_turn(store, texts[:args.turns], stub_config, None),
+            "background": bench_turn(store, texts[:args.turns], stub_config, BackgroundIndexer(1)),
+        }
+        for mode, stats in results["results"]["turn"].items():
+            print(f"  turn {mode:<10} p50 {stats['p50_ms']:.1f}ms  p95 {stats['p95_ms']:.1f}ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    recommended = {
+        "faiss_threads": best(results["results"]["faiss"], "queries_per_s"),
+        "search_workers": best(results["results"]["search"], "p50_ms", lowest=True),
+        "embedding_threads": best(results["results"]["embed"], "texts_per_s"),
+    }
+    if results["shared_openmp"]:
+        # One OpenMP pool: the value in effect is faiss_threads, for both libraries
+        recommended["embedding_threads"] = recommended["faiss_threads"]
+    results["recommended"] = recommended
+    print("Recommended config.json settings: " + ", ".join(
+        f'"{key}": {value}' for key, value in recommended.items() if value is not None), file=sys.stderr)
+    print(write_results("threads", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
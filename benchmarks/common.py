@@ -0,0 +1,223 @@
+"""
+Shared helpers for the LocalRAG benchmarks: a deterministic offline embedder,
+synthetic chat corpora, timing/percentile helpers and result files.
+Benchmarks are plain scripts; run them from the repository root, e.g.
+
+    python benchmarks/bench_store.py --sizes 1k,10k
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import platform
+import datetime
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from localrag.chatstore import save_chat  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+MODELS = ["gpt-4.1", "claude-3-7-sonnet-latest", "gemini-2.0-flash", "llama3.3"]
+MESSAGES_PER_CHAT = 20
+CORPUS_START = datetime.datetime(2024, 1, 1)
+CORPUS_DAYS = 730
+
+
+class HashingEmbedder:
+    """
+    Offline stand-in for SentenceTransformer: every vocabulary word gets a fixed
+    random vector and a text embeds to the normalized sum of its word vectors,
+    so texts sharing words land near each other like real embeddings do.
+    """
+
+    def __init__(self, dim=384, vocab_size=5000, seed=0):
+        self.dim = dim
+        rng = np.random.default_rng(seed)
+        self.word_vectors = rng.standard_normal((vocab_size, dim)).astype('float32')
+        self.vocab = {word(i): i for i in range(vocab_size)}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            ids = [self.vocab.get(w, zlib.crc32(w.encode()) % len(self.vocab)) for w in text.split()]
+            if ids:
+                out[row] = self.word_vectors[ids].sum(axis=0)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+def word(i):
+    return f"w{i}"
+
+
+def parse_size(value):
+    """Parse "1k", "10k", "1m" or a plain integer into a message count."""
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith("k"):
+        multiplier, value = 1_000, value[:-1]
+    elif value.endswith("m"):
+        multiplier, value = 1_000_000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def random_text(rng, vocab_size, min_words=8, max_words=60):
+    # Zipf-like word frequencies so some words are common across messages
+    n = int(rng.integers(min_words, max_words + 1))
+    ids = np.minimum(rng.zipf(1.3, n) - 1, vocab_size - 1)
+    return " ".join(word(int(i)) for i in ids)
+
+
+def generate_corpus(n_messages, seed=0, vocab_size=5000):
+    """
+    Yield synthetic chats (the chatstore dict format) totalling ``n_messages``
+    messages, spread evenly over two years and across a few models.
+    """
+    rng = np.random.default_rng(seed)
+    n_chats = max(1, (n_messages + MESSAGES_PER_CHAT - 1) // MESSAGES_PER_CHAT)
+    remaining = n_messages
+    for c in range(n_chats):
+        count = min(MESSAGES_PER_CHAT, remaining)
+        remaining -= count
+        created = CORPUS_START + datetime.timedelta(days=CORPUS_DAYS * c / n_chats)
+        messages = []
+        for m in range(count):
+            if m % 2 == 0:
+                messages.append({"role": "user", "content": random_text(rng, vocab_size), "context": "", "image": None})
+            else:
+                messages.append({"role": "assistant", "content": random_text(rng, vocab_size)})
+        yield {
+            "id": f"bench-{c:08d}",
+            "title": f"Bench chat {c}",
+            "model": MODELS[c % len(MODELS)],
+            "created_at": created.isoformat(),
+            "updated_at": (created + datetime.timedelta(minutes=count)).isoformat(),
+            "favorite": c % 10 == 0,
+            "messages": messages,
+        }
+
+
+def write_corpus(chats_dir, vector_store, n_messages, seed=0, batch_size=10_000):
+    """Write chat files and bulk-load their messages into ``vector_store``."""
+    os.makedirs(chats_dir, exist_ok=True)
+    entries = []
+    for chat in generate_corpus(n_messages, seed):
+        save_chat(chats_dir, chat)
+        created = datetime.datetime.fromisoformat(chat["created_at"])
+        for i, msg in enumerate(chat["messages"]):
+            ts = (created + datetime.timedelta(minutes=i)).isoformat()
+            entries.append((f"{chat['id']}:{i}", msg["content"], chat["model"], ts))
+        if len(entries) >= batch_size:
+            vector_store.add_many(entries)
+            entries = []
+    if entries:
+        vector_store.add_many(entries)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def percentiles(samples_s):
+    """p50/p95/p99/mean/max in milliseconds for a list of durations in seconds."""
+    if not samples_s:
+        return {}
+    ms = np.array(samples_s) * 1000.0
+    return {
+        "n": len(samples_s),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "max_ms": float(ms.max()),
+    }
+
+
+def rss_bytes():
+    """Current resident set size, falling back to peak RSS where /proc is missing."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def environment():
+    """Version and machine details recorded alongside every result file."""
+    try:
+        from importlib.metadata import version
+        localrag_version = version("localrag")
+    except Exception:
+        localrag_version = "unknown"
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "localrag_version": localrag_version,
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": datetime.datetime.now().isoformat(),
+    }
+
+
+def write_results(name, results, output=None):
+    env = results["environment"]
+    if output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{name}-{env['git_commit'] or env['localrag_version']}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    return output
+
+
+def flatten(results, prefix=""):
+    """Flatten nested result dicts into {"a.b.c": number} for comparisons."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(baseline_path, current_path):
+    """Print metric-by-metric ratios between two result files."""
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f)["results"])
+    with open(current_path) as f:
+        current = flatten(json.load(f)["results"])
+    print(f"{'metric':<60} {'baseline':>14} {'current':>14} {'ratio':>8}")
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name], current[name]
+        ratio = f"{new / old:.2f}x" if old else "-"
+        print(f"{name:<60} {old:>14.3f} {new:>14.3f} {ratio:>8}")
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+from .utils import checksum, file_lock
+
+ARCHIVE_DIR = "archive"
+INDEX_FILE = "index.db"
+PACK_MAGIC = b"LRPACK1\n"
+# New packs roll over at this size; packs whose live records fill less than
+# COMPACT_BELOW of the file are rewritten by the next archive run
+PACK_MAX_BYTES = 64 * 1024 * 1024
+COMPACT_BELOW = 0.5
+
+
+class ChatArchive:
+    """
+    Cold tier for chats nobody has touched in a while. Each chat is stored as
+    one zlib-compressed JSON record appended to a pack file under
+    ``chats_dir``/archive, and a SQLite index maps chat ids to (pack, offset,
+    length, checksum), so reading one chat is a single seek and read. A chat
+    file in ``chats_dir`` always wins over an archived copy.
+    """
+
+    def __init__(self, chats_dir):
+        self.chats_dir = chats_dir
+        self.dir = os.path.join(chats_dir, ARCHIVE_DIR)
+        self.db = None
+
+    @property
+    def index_path(self):
+        return os.path.join(self.dir, INDEX_FILE)
+
+    def _open(self, create=False):
+        """The index connection; None when there is no archive and ``create`` is False."""
+        if self.db is None:
+            if not create and not os.path.exists(self.index_path):
+                return None
+            os.makedirs(self.dir, exist_ok=True)
+            self.db = sqlite3.connect(self.index_path)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY, pack TEXT, offset INTEGER, length INTEGER,
+                    crc32 TEXT, mtime REAL, updated_at TEXT
+                )""")
+        return self.db
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _read(self, pack, offset, length, crc32):
+        with open(os.path.join(self.dir, pack), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length or checksum(data) != crc32:
+            raise ValueError(f"Archived chat record in {pack} at offset {offset} is damaged")
+        return data
+
+    def _decode(self, data):
+        try:
+            return json.loads(zlib.decompress(data))
+        except zlib.error as e:
+            raise ValueError(f"Archived chat record could not be decompressed: {e}") from e
+
+    def load(self, chat_id):
+        """The archived chat, or None if it isn't archived."""
+        db = self._open()
+        row = db.execute("SELECT pack, offset, length, crc32 FROM chats WHERE id = ?", (chat_id,)).fetchone() if db else None
+        if row is None:
+            return None
+        return self._decode(self._read(*row))
+
+    def entries(self):
+        """Archived chat id -> mtime of the chat file when it was archived."""
+        db = self._open()
+        return dict(db.execute("SELECT id, mtime FROM chats")) if db else {}
+
+    def chats(self, exclude=()):
+        """Every archived chat not in ``exclude``, reading each pack front to back."""
+        db = self._open()
+        if db is None:
+            return
+        rows = db.execute("SELECT id, pack, offset, length, crc32 FROM chats ORDER BY pack, offset").fetchall()
+        for chat_id, *record in rows:
+            if chat_id not in exclude:
+                yield self._decode(self._read(*record))
+
+    def remove(self, chat_id):
+        db = self._open()
+        if db is not None:
+            db.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            db.commit()
+
+    def stats(self):
+        """Archived chats, packs, their bytes on disk and the bytes taken by records no longer in the index."""
+        db = self._open()
+        live = dict(db.execute("SELECT pack, SUM(length) FROM chats GROUP BY pack")) if db else {}
+        packs = self._packs()
+        size = sum(os.path.getsize(os.path.join(self.dir, p)) for p in packs)
+        return {
+            "chats": db.execute("SELECT COUNT(*) FROM chats").fetchone()[0] if db else 0,
+            "packs": len(packs),
+            "bytes": size,
+            "dead_bytes": size - sum(live.values()) - len(PACK_MAGIC) * len(packs),
+        }
+
+    def _packs(self):
+        if not os.path.isdir(self.dir):
+            return []
+        return sorted(name for name in os.listdir(self.dir) if name.endswith(".lrp"))
+
+    def archive(self, older_than_days, now=None):
+        """
+        Pack chat files untouched for ``older_than_days`` into a new pack,
+        together with the live records of packs that are mostly dead space,
+        then delete the packed files. The index commit is the switch-over: a
+        crash before it leaves the chat files in place, one after it leaves
+        files that still win over their archived copies until the next run.
+        """
+        cutoff = (now or time.time()) - older_than_days * 86400
+        os.makedirs(self.dir, exist_ok=True)
+        with file_lock(os.path.join(self.dir, "archive.lock")):
+            db = self._open(create=True)
+            hot = {}
+            candidates = []
+            for entry in os.scandir(self.chats_dir):
+                if not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                mtime = stat.st_mtime
+                hot[entry.name[:-len(".json")]] = (stat.st_mtime_ns, stat.st_size)
+                if mtime < cutoff:
+                    candidates.append((entry.name[:-len(".json")], entry.path, mtime))
+            # Archived chats that were resumed since have a file again; their records are dead
+            db.executemany("DELETE FROM chats WHERE id = ?", [(i,) for i in self.entries() if i in hot])
+
+            live = dict(db.execute("SELECT pack, SUM(length) FROM chats GROUP BY pack"))
+            sparse = [p for p in self._packs()
+                      if live.get(p, 0) < COMPACT_BELOW * os.path.getsize(os.path.join(self.dir, p))]
+            moved = db.execute(
+                f"SELECT id, pack, offset, length, crc32, mtime, updated_at FROM chats WHERE pack IN ({','.join('?' * len(sparse))})",
+                sparse,
+            ).fetchall()
+            bytes_before = sum(os.path.getsize(path) for _, path, _ in candidates)
+
+            def records():
+                for chat_id, path, mtime in candidates:
+                    try:
+                        with open(path, 'r') as f:
+                            chat = json.load(f)
+                    except (OSError, ValueError):
+                        continue  # Unreadable or mid-write; left for a later run
+                    data = zlib.compress(json.dumps(chat, separators=(",", ":")).encode("utf-8"), 6)
+                    yield chat_id, data, mtime, chat.get("updated_at")
+                for chat_id, pack, offset, length, crc32, mtime, updated_at in moved:
+                    yield chat_id, self._read(pack, offset, length, crc32), mtime, updated_at
+
+            rows = self._write_packs(records())
+            db.executemany("INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            db.commit()
+
+            archived = 0
+            moved_ids = {row[0] for row in moved}
+            for chat_id, pack, *_ in rows:
+                if chat_id in moved_ids:
+                    continue
+                path = os.path.join(self.chats_dir, f"{chat_id}.json")
+                if self._remove_unchanged(path, hot[chat_id]):
+                    archived += 1
+                else:
+                    # Saved (or deleted) while being packed: the file wins, drop the record
+                    db.execute("DELETE FROM chats WHERE id = ? AND pack = ?", (chat_id, pack))
+            db.commit()
+            referenced = {row[0] for row in db.execute("SELECT DISTINCT pack FROM chats")}
+            for pack in sparse:
+                if pack not in referenced:
+                    os.remove(os.path.join(self.dir, pack))
+        return {
+            "archived": archived,
+            "compacted": len(sparse),
+            "bytes_before": bytes_before,
+            "bytes_after": sum(length for chat_id, _, _, length, *_ in rows if chat_id not in moved_ids),
+            "packs": len({row[1] for row in rows}),
+        }
+
+    def _remove_unchanged(self, path, seen):
+        """
+        Delete the chat file at ``path`` if its (mtime_ns, size) is still
+        ``seen``. Holds the chat's lock, which save_chat takes too, so a save
+        can't land between the check and the removal.
+        """
+        try:
+            with file_lock(f"{path}.lock"):
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_size) != seen:
+                    return False
+                os.remove(path)
+                return True
+        except (OSError, TimeoutError):
+            return False  # Gone, or busy being saved
+
+    def _write_packs(self, records):
+        """Write (chat_id, data, mtime, updated_at) records into new packs; returns their index rows."""
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        rows = []
+        f = None
+        try:
+            for chat_id, data, mtime, updated_at in records:
+                if f is None or (size + len(data) > PACK_MAX_BYTES and size > len(PACK_MAGIC)):
+                    if f is not None:
+                        self._finish_pack(f, name)
+                    name = f"pack-{stamp}-{os.getpid()}-{len({r[1] for r in rows}):03d}.lrp"
+                    f = open(os.path.join(self.dir, f"{name}.tmp"), 'wb')
+                    f.write(PACK_MAGIC)
+                    size = len(PACK_MAGIC)
+                rows.append((chat_id, name, size, len(data), checksum(data), mtime, updated_at))
+                f.write(data)
+                size += len(data)
+            if f is not None:
+                self._finish_pack(f, name)
+                f = None
+        finally:
+            if f is not None:
+                f.close()
+                os.remove(f.name)
+        return rows
+
+    def _finish_pack(self, f, name):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(f.name, os.path.join(self.dir, name))
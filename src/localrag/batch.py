@@ -0,0 +1,108 @@
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .models import get_model_metadata
+from .llm import format_messages, routed_stream, Route, LLMError, observe_request, generation_stats
+
+
+class RateLimiter:
+    """Spaces request starts so no more than ``per_minute`` begin per minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ProviderLimits:
+    """
+    Per-runtime concurrency and rate limits. Defaults come from
+    ``provider_concurrency``/``provider_requests_per_minute`` and can be
+    overridden per runtime in ``provider_limits``, e.g.
+    {"Ollama": {"concurrency": 1}, "OpenAI": {"requests_per_minute": 500}}.
+    """
+
+    def __init__(self, config, concurrency=None, requests_per_minute=None):
+        self.default_concurrency = concurrency or config.get("provider_concurrency") or 4
+        self.default_rpm = requests_per_minute if requests_per_minute is not None else config.get("provider_requests_per_minute", 0)
+        self.overrides = config.get("provider_limits") or {}
+        self.semaphores = {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def _get(self, runtime):
+        with self.lock:
+            if runtime not in self.semaphores:
+                override = self.overrides.get(runtime, {})
+                self.semaphores[runtime] = threading.Semaphore(override.get("concurrency", self.default_concurrency))
+                self.limiters[runtime] = RateLimiter(override.get("requests_per_minute", self.default_rpm))
+            return self.semaphores[runtime], self.limiters[runtime]
+
+    @contextlib.contextmanager
+    def slot(self, runtime):
+        semaphore, limiter = self._get(runtime)
+        with semaphore:
+            limiter.wait()
+            yield
+
+
+def _ask_one(request, config, limits):
+    result = {"id": request["id"], "model": request["model"], "prompt": request["prompt"]}
+    start = time.perf_counter()
+    route, request_start, first_token_at = None, None, None
+    try:
+        model_meta = get_model_metadata(request["model"])
+        result["model"] = model_meta["full_name"]
+        runtime = model_meta.get("runtime", model_meta.get("provider"))
+        messages = format_messages([{"role": "user", "content": request["prompt"], "context": request.get("context", "")}])
+        route = Route(result["model"])
+        with limits.slot(runtime):
+            request_start = time.perf_counter()
+            parts = []
+            for chunk in routed_stream(result["model"], messages, config, route):
+                if chunk:
+                    first_token_at = first_token_at or time.perf_counter()
+                    parts.append(chunk)
+            result["response"] = "".join(parts)
+        result["model"] = route.model
+        if route.events:
+            result["route"] = route.events
+        if route.usage:
+            result["usage"] = route.usage
+        result["error"] = None
+    except (LLMError, ValueError) as e:
+        result["response"] = None
+        result["error"] = str(e)
+    except Exception as e:
+        result["response"] = None
+        result["error"] = f"Error during LLM call: {str(e)}"
+    end = time.perf_counter()
+    result["latency_s"] = round(end - start, 4)
+    if request_start is not None:
+        # Time in the request itself, not waiting for a concurrency slot
+        stats = generation_stats(request_start, first_token_at, end, result["response"] or "", route.usage)
+        result.update(ttft_s=stats["ttft_s"], tokens_per_s=stats["tokens_per_s"], output_tokens=stats["output_tokens"])
+        observe_request(route, "error" if result["error"] else "ok", end - request_start, stats["ttft_s"])
+    return result
+
+
+def ask_many(requests, config, limits, max_workers=8):
+    """
+    Send each request ({"id", "model", "prompt", "context"}) as a single-turn
+    chat and yield (request, result) pairs in completion order.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(_ask_one, request, config, limits): request for request in requests}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
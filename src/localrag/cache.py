@@ -0,0 +1,161 @@
+import io
+import os
+import json
+import time
+import threading
+import numpy as np
+from .tracing import span
+from . import metrics
+from .utils import atomic_write, atomic_write_json
+
+
+class ResponseCache:
+    """
+    Semantic cache of LLM answers keyed by model and query embedding.
+    A lookup hits when a cached query for the same model has cosine similarity
+    of at least ``threshold`` and is younger than ``ttl_seconds``. Beyond
+    ``max_entries`` the least recently used entries are evicted.
+    Stored under ``cache_dir`` as entries.json + vectors.npy + stats.json.
+    """
+
+    def __init__(self, cache_dir, threshold=0.95, ttl_seconds=7 * 86400, max_entries=1000):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = []
+        self.vectors = None
+        self.stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+        self.lock = threading.Lock()
+        self._load()
+
+    @property
+    def entries_path(self):
+        return os.path.join(self.cache_dir, "entries.json")
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.cache_dir, "vectors.npy")
+
+    @property
+    def stats_path(self):
+        return os.path.join(self.cache_dir, "stats.json")
+
+    def _load(self):
+        if os.path.exists(self.entries_path) and os.path.exists(self.vectors_path):
+            with open(self.entries_path, 'r') as f:
+                self.entries = json.load(f)
+            self.vectors = np.load(self.vectors_path)
+            if len(self.vectors) != len(self.entries):
+                # Torn write; start over rather than serve mismatched answers
+                self.entries, self.vectors = [], None
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, 'r') as f:
+                self.stats.update(json.load(f))
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self.vectors is None:
+            for path in (self.entries_path, self.vectors_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        else:
+            buffer = io.BytesIO()
+            np.save(buffer, self.vectors)
+            atomic_write(self.vectors_path, buffer.getvalue())
+            atomic_write_json(self.entries_path, self.entries)
+        self._save_stats()
+
+    def _save_stats(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write_json(self.stats_path, self.stats)
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def lookup(self, model, embedding):
+        """Return the cached response for a similar query, or None."""
+        with span("cache.lookup"), self.lock:
+            best = None
+            if self.vectors is not None:
+                now = time.time()
+                similarities = self.vectors @ self._normalize(embedding)
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    entry = self.entries[i]
+                    if entry["model"] == model and now - entry["created_at"] <= self.ttl_seconds:
+                        best = entry
+                        break
+            metrics.inc("response_cache_lookups_total", result="miss" if best is None else "hit")
+            if best is None:
+                self.stats["misses"] += 1
+                self._save_stats()
+                return None
+            best["last_hit_at"] = time.time()
+            best["hits"] += 1
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += best["latency_s"]
+            # A hit only changes entry counters; the vectors stay as they are on disk
+            atomic_write_json(self.entries_path, self.entries)
+            self._save_stats()
+            return best["response"]
+
+    def store(self, model, query, embedding, response, latency_s):
+        """Cache ``response`` for ``query``; ``latency_s`` is what a hit saves."""
+        with span("cache.store"), self.lock:
+            now = time.time()
+            self.entries.append({
+                "model": model,
+                "query": query,
+                "response": response,
+                "latency_s": latency_s,
+                "created_at": now,
+                "last_hit_at": now,
+                "hits": 0,
+            })
+            vector = self._normalize(embedding).reshape(1, -1)
+            self.vectors = vector if self.vectors is None else np.vstack([self.vectors, vector])
+            self._evict(now)
+            self._save()
+
+    def _evict(self, now):
+        keep = [i for i, e in enumerate(self.entries) if now - e["created_at"] <= self.ttl_seconds]
+        if len(keep) > self.max_entries:
+            keep = sorted(keep, key=lambda i: self.entries[i]["last_hit_at"])[-self.max_entries:]
+            keep.sort()
+        if len(keep) == len(self.entries):
+            return
+        self.entries = [self.entries[i] for i in keep]
+        self.vectors = self.vectors[keep] if keep else None
+
+    def clear(self):
+        with self.lock:
+            self.entries, self.vectors = [], None
+            self.stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+            self._save()
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self.entries),
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "saved_seconds": self.stats["saved_seconds"],
+        }
+
+
+def open_response_cache(config, cache_dir):
+    """The configured ResponseCache, or None when ``response_cache`` is off."""
+    if not config.get("response_cache"):
+        return None
+    return ResponseCache(
+        cache_dir,
+        threshold=config.get("response_cache_threshold", 0.95),
+        ttl_seconds=config.get("response_cache_ttl_seconds", 7 * 86400),
+        max_entries=config.get("response_cache_max_entries", 1000),
+    )
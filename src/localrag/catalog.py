@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import sqlite3
+from .utils import checksum
+from .tracing import span
+from .archive import ChatArchive
+
+CATALOG_FILE = "catalog.db"
+# Message rowids are (chat rowid << POSITION_BITS) | position, so one chat's
+# messages are a contiguous rowid range
+POSITION_BITS = 20
+
+
+def _message_hash(message):
+    return checksum(message.get("content", "").encode("utf-8"))
+
+
+def query_terms(query):
+    """Words of a search query, lowercased."""
+    return [t.lower() for t in re.findall(r"\w+", query)]
+
+
+def snippet(text, terms, width=160):
+    """About ``width`` characters of ``text`` around the first of ``terms`` found."""
+    text = " ".join(text.split())
+    if len(text) <= width:
+        return text
+    lower = text.lower()
+    found = [i for i in (lower.find(t) for t in terms) if i >= 0]
+    start = max(0, min(found) - width // 4) if found else 0
+    end = min(len(text), start + width)
+    start = max(0, end - width)
+    return ("…" if start else "") + text[start:end].strip() + ("…" if end < len(text) else "")
+
+
+class ChatCatalog:
+    """
+    SQLite index of chat metadata and message text kept next to the chat
+    files, so chats can be listed and searched without parsing them.
+    sync() brings it up to date, re-reading only chat files whose mtime
+    changed. Message text is indexed with FTS5 when SQLite provides it;
+    without FTS5, ``lexical`` is False and search() returns nothing.
+    """
+
+    def __init__(self, chats_dir, path=None):
+        self.chats_dir = chats_dir
+        self.path = path or os.path.join(chats_dir, CATALOG_FILE)
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS chats (
+                rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, title TEXT, model TEXT,
+                favorite INTEGER, created_at TEXT, updated_at TEXT,
+                mtime REAL, indexed INTEGER, last_hash TEXT
+            )""")
+        try:
+            columns = [row["name"] for row in self.db.execute("PRAGMA table_info(message_text)")]
+            if columns and "timestamp" not in columns:
+                # Catalogs from before messages had timestamps: index them again
+                self.db.execute("DROP TABLE message_text")
+                self.db.execute("UPDATE chats SET mtime = NULL, indexed = 0, last_hash = NULL")
+            self.db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(
+                    content, role UNINDEXED, model UNINDEXED, timestamp UNINDEXED, tokenize = 'porter unicode61'
+                )""")
+            self.lexical = True
+        except sqlite3.OperationalError:
+            self.lexical = False
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def sync(self):
+        """Index chats added or changed since the last sync and drop deleted ones. Returns chats re-read."""
+        with span("catalog.sync"):
+            known = {row["id"]: row["mtime"] for row in self.db.execute("SELECT id, mtime FROM chats")}
+            seen = set()
+            changed = 0
+            if os.path.isdir(self.chats_dir):
+                for entry in os.scandir(self.chats_dir):
+                    if not entry.name.endswith(".json"):
+                        continue
+                    chat_id = entry.name[:-len(".json")]
+                    seen.add(chat_id)
+                    mtime = entry.stat().st_mtime
+                    if known.get(chat_id) == mtime:
+                        continue
+                    try:
+                        with open(entry.path, 'r') as f:
+                            chat = json.load(f)
+                    except (OSError, ValueError):
+                        continue  # Unreadable for now; picked up by a later sync
+                    self._index_chat(chat_id, chat, mtime)
+                    changed += 1
+            archive = ChatArchive(self.chats_dir)
+            try:
+                # Archived chats keep the mtime of the file they were packed from
+                for chat_id, mtime in archive.entries().items():
+                    if chat_id in seen:
+                        continue  # Resumed since; the file wins
+                    seen.add(chat_id)
+                    if known.get(chat_id) == mtime:
+                        continue
+                    try:
+                        chat = archive.load(chat_id)
+                    except (OSError, ValueError):
+                        continue
+                    self._index_chat(chat_id, chat, mtime)
+                    changed += 1
+            finally:
+                archive.close()
+            for chat_id in known.keys() - seen:
+                self._remove_chat(chat_id)
+            self.db.commit()
+        return changed
+
+    def _message_rows(self, rowid):
+        return rowid << POSITION_BITS, ((rowid + 1) << POSITION_BITS) - 1
+
+    def _index_chat(self, chat_id, chat, mtime):
+        messages = chat.get("messages", [])
+        fields = (chat.get("title"), chat.get("model"), int(bool(chat.get("favorite"))),
+                  chat.get("created_at"), chat.get("updated_at"), mtime)
+        row = self.db.execute("SELECT rowid, indexed, last_hash FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        if row is None:
+            rowid = self.db.execute(
+                "INSERT INTO chats (id, title, model, favorite, created_at, updated_at, mtime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, *fields),
+            ).lastrowid
+            start = 0
+        else:
+            rowid, start = row["rowid"], row["indexed"] or 0
+            # Chats only grow, except when cleared; then index them again from scratch
+            if start > len(messages) or (start and _message_hash(messages[start - 1]) != row["last_hash"]):
+                if self.lexical:
+                    self.db.execute("DELETE FROM message_text WHERE rowid BETWEEN ? AND ?", self._message_rows(rowid))
+                start = 0
+            self.db.execute(
+                "UPDATE chats SET title = ?, model = ?, favorite = ?, created_at = ?, updated_at = ?, mtime = ? WHERE rowid = ?",
+                (*fields, rowid),
+            )
+        if self.lexical:
+            first, _ = self._message_rows(rowid)
+            self.db.executemany(
+                "INSERT INTO message_text (rowid, content, role, model, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(first + i, m.get("content", ""), m.get("role"), m.get("model") or chat.get("model"), m.get("timestamp"))
+                 for i, m in enumerate(messages[start:], start)],
+            )
+        self.db.execute("UPDATE chats SET indexed = ?, last_hash = ? WHERE rowid = ?",
+                        (len(messages), _message_hash(messages[-1]) if messages else None, rowid))
+
+    def _remove_chat(self, chat_id):
+        row = self.db.execute("SELECT rowid FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return
+        if self.lexical:
+            self.db.execute("DELETE FROM message_text WHERE rowid BETWEEN ? AND ?", self._message_rows(row["rowid"]))
+        self.db.execute("DELETE FROM chats WHERE rowid = ?", (row["rowid"],))
+
+    def chats(self, chat_ids=None, favorite=None):
+        """Chat metadata rows by id, optionally only ``chat_ids`` and/or favorites."""
+        sql, params = "SELECT id, title, model, favorite, created_at, updated_at, indexed AS messages FROM chats WHERE 1", []
+        if chat_ids is not None:
+            chat_ids = list(chat_ids)
+            sql += f" AND id IN ({','.join('?' * len(chat_ids))})"
+            params += chat_ids
+        if favorite is not None:
+            sql += " AND favorite = ?"
+            params.append(int(favorite))
+        return {row["id"]: dict(row) for row in self.db.execute(sql, params)}
+
+    def search(self, query, limit=10, favorite=None, model=None, since=None, until=None):
+        """
+        Best ``limit`` keyword matches as (message_id, text) tuples, by BM25.
+        A message matches any query term; ``since``/``until`` compare against
+        its timestamp, or for messages saved before messages had one, against
+        the chat's last update and creation times.
+        """
+        terms = query_terms(query)
+        if not self.lexical or not terms:
+            return []
+        sql = (
+            "SELECT c.id AS chat_id, m.rowid AS rowid, m.content AS content FROM message_text m "
+            f"JOIN chats c ON c.rowid = (m.rowid >> {POSITION_BITS}) WHERE message_text MATCH ?"
+        )
+        params = [" OR ".join(f'"{t}"' for t in terms)]
+        if favorite is not None:
+            sql += " AND c.favorite = ?"
+            params.append(int(favorite))
+        if model is not None:
+            sql += " AND m.model = ?"
+            params.append(model)
+        if since is not None:
+            sql += " AND COALESCE(m.timestamp, c.updated_at) >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND COALESCE(m.timestamp, c.created_at) <= ?"
+            params.append(until)
+        sql += " ORDER BY bm25(message_text) LIMIT ?"
+        params.append(limit)
+        mask = (1 << POSITION_BITS) - 1
+        with span("catalog.search"):
+            return [(f"{row['chat_id']}:{row['rowid'] & mask}", row["content"]) for row in self.db.execute(sql, params)]
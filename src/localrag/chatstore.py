@@ -2,6 +2,10 @@ import os
 import uuid
 import datetime
 import json
+from .tracing import span
+from .metrics import timer
+from .utils import atomic_write_json, file_lock
+from .archive import ChatArchive
 
 # Optionally import from a config or define expected key names
 
@@ -9,18 +13,39 @@ def get_chat_path(chats_dir, chat_id):
     return os.path.join(chats_dir, f"{chat_id}.json")
 
 def load_chat(chats_dir, chat_id):
-    """Load a chat from disk."""
+    """Load a chat from disk, from its own file or else from the archive."""
     chat_path = get_chat_path(chats_dir, chat_id)
     if os.path.exists(chat_path):
-        with open(chat_path, 'r') as f:
+        with span("chat.load"), timer("chat_load_seconds"), open(chat_path, 'r') as f:
             return json.load(f)
-    return None
+    archive = ChatArchive(chats_dir)
+    try:
+        with span("chat.load", tier="archive"), timer("chat_archive_load_seconds"):
+            return archive.load(chat_id)
+    finally:
+        archive.close()
+
+def promote_chat(chats_dir, chat):
+    """Move an archived chat back to its own file, e.g. when it is resumed."""
+    if os.path.exists(get_chat_path(chats_dir, chat["id"])):
+        return
+    archive = ChatArchive(chats_dir)
+    try:
+        if chat["id"] in archive.entries():
+            save_chat(chats_dir, chat)
+            archive.remove(chat["id"])
+    finally:
+        archive.close()
 
 def save_chat(chats_dir, chat):
-    """Save a chat to disk."""
+    """
+    Save a chat to disk, replacing the previous file atomically. Holds the
+    chat's lock, so 'localrag archive' can't remove the file mid-save.
+    """
     chat_path = get_chat_path(chats_dir, chat['id'])
-    with open(chat_path, 'w') as f:
-        json.dump(chat, f, indent=2)
+    with span("chat.save", messages=len(chat["messages"])), timer("chat_save_seconds"):
+        with file_lock(f"{chat_path}.lock"):
+            atomic_write_json(chat_path, chat, indent=2)
 
 def create_new_chat(model):
     """Create a new chat."""
@@ -36,13 +61,19 @@ def create_new_chat(model):
     }
 
 def get_all_chats(chats_dir):
-    """Get all chats."""
+    """Get all chats, archived ones included."""
     chats = []
     if not os.path.exists(chats_dir):
         return []
-    for filename in os.listdir(chats_dir):
-        if filename.endswith(".json"):
-            with open(os.path.join(chats_dir, filename), 'r') as f:
-                chat = json.load(f)
-                chats.append(chat)
+    with span("chat.list"), timer("chat_list_seconds"):
+        for filename in os.listdir(chats_dir):
+            if filename.endswith(".json"):
+                with open(os.path.join(chats_dir, filename), 'r') as f:
+                    chat = json.load(f)
+                    chats.append(chat)
+        archive = ChatArchive(chats_dir)
+        try:
+            chats.extend(archive.chats(exclude={chat["id"] for chat in chats}))
+        finally:
+            archive.close()
     return sorted(chats, key=lambda x: x.get("updated_at", ""), reverse=True)
\ No newline at end of file
@@ -1,19 +1,38 @@
 import os
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
-
+import re
 import sys
+import json
+import time
+import atexit
 import datetime
+import contextlib
 import click
 from rich.console import Console
 from rich.prompt import Prompt
 from rich.panel import Panel
+from rich.progress import Progress
+from rich.table import Table
+from rich.markup import escape
 
 from .config import ensure_config_exists, load_config, configure_api_keys
-from .vectorstore import VectorStore
-from .chatstore import load_chat, save_chat, create_new_chat, get_all_chats
-from .llm import send_message_to_llm, get_chat_title
+from .vectorstore import VectorStore, INDEX_TYPES, DEFAULT_RERANK_FACTOR, text_hash, message_chat_id, read_manifest
+from .chatstore import load_chat, save_chat, create_new_chat, get_all_chats, promote_chat
+from .archive import ChatArchive
+from .catalog import ChatCatalog, query_terms, snippet
+from .llm import send_message_to_llm, get_chat_title, is_error_response, Route, fan_out, runtime_configured
+from .cache import open_response_cache
+from .indexes import IndexRegistry, ActiveIndex, run_migration
+from .summary import Summarizer
+from .resources import ResourceGovernor, BackgroundIndexer
+from .embeddings import remote_embedder, EmbeddingError
+from .snapshot import export_snapshot, SnapshotImport, SnapshotError
+from .prompt import prompt_messages, window_message_ids, window_context_ids, window_text_hashes
+from .batch import ProviderLimits, ask_many
 from .models import get_model_metadata, list_supported_models
-from .utils import ensure_ollama_model
+from .utils import ensure_ollama_model, format_bytes, directory_bytes
+from . import tracing
+from . import metrics
+from .tracing import span
 
 DEFAULT_MODEL = "gpt-4.1"
 LOCALRAG_DIR = os.path.expanduser("~/.localrag")
@@ -21,8 +40,14 @@ CHATS_DIR = os.path.join(LOCALRAG_DIR, "chats")
 VECTOR_STORE_PATH = os.path.join(LOCALRAG_DIR, "vector_store")
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 CONFIG_PATH = os.path.join(LOCALRAG_DIR, "config.json")
+RESPONSE_CACHE_DIR = os.path.join(LOCALRAG_DIR, "response_cache")
+METRICS_PATH = os.path.join(LOCALRAG_DIR, metrics.METRICS_FILE)
+SIMILARITY_THRESHOLD = 0.7
+# Reciprocal rank fusion constant for merging semantic and keyword rankings
+RRF_K = 60
 
 console = Console()
+err_console = Console(stderr=True)
 
 def init_localrag():
     """Initializes the necessary directories and config file for LocalRAG."""
@@ -35,12 +60,18 @@ def init_localrag():
 def cli():
     """LocalRAG - A local LLM interface with conversation memory."""
     init_localrag()
+    metrics.configure(load_config(CONFIG_PATH).get("metrics", True))
+    atexit.register(flush_metrics)
 
 @cli.command()
 @click.argument("model", default="")
-def run(model):
+@click.option("--profile", is_flag=True, help="Print a timing breakdown after every turn.")
+@click.option("--trace-file", type=click.Path(dir_okay=False), help="Append per-turn spans to this JSONL file.")
+def run(model, profile, trace_file):
     """Start an interactive chat with the specified model."""
     config = load_config(CONFIG_PATH)
+    if profile or trace_file:
+        tracing.enable(trace_file)
     if not model:
         model = config.get("default_model", "gpt-4.1")
 
@@ -73,15 +104,20 @@ def run(model):
         if not ensure_ollama_model(model, console):
             return
 
-    vector_store = VectorStore(VECTOR_STORE_PATH, EMBEDDING_MODEL)
+    vector_store = open_vector_store(config)
+    response_cache = open_response_cache(config, RESPONSE_CACHE_DIR)
+    summarizer = Summarizer(config)
+    indexer = BackgroundIndexer(config.get("index_workers", 1))
     chat = create_new_chat(model)
     title_generated = False
 
     image_buffer = None
+    scope = "all"
+    compare_models = []
 
     console.print(Panel.fit(f"Chat with {model}", style="bold blue"))
     console.print("Type your message below. Use [bold]\\commands[/bold] for special actions.")
-    console.print("Available commands: [bold]\\save[/bold], [bold]\\clear[/bold], [bold]\\switch <model>[/bold], [bold]\\quit[/bold], [bold]\\help[/bold]\n")
+    console.print("Available commands: [bold]\\save[/bold], [bold]\\clear[/bold], [bold]\\switch <model>[/bold], [bold]\\scope[/bold], [bold]\\compare <models>[/bold], [bold]\\quit[/bold], [bold]\\help[/bold]\n")
 
     while True:
         user_input = Prompt.ask("\n[bold cyan]user[/bold cyan] >")
@@ -106,6 +142,8 @@ def run(model):
                 console.print("[green]Chat saved as favorite![/green]")
             elif command == "clear":
                 if chat["messages"]: # Only clear if there are messages
+                     summarizer.finish(chat)
+                     save_chat(CHATS_DIR, chat) # Keep a summary that finished after the last save
                      chat = create_new_chat(model) # Create a *new* chat to truly clear state
                      title_generated = False
                      console.print("[yellow]Chat cleared. Starting new conversation.[/yellow]")
@@ -130,10 +168,39 @@ def run(model):
                 else:
                      console.print("[red]Usage: \\switch <model>[/red]")
 
+            elif command == "scope":
+                if arg:
+                    try:
+                        parse_scope(arg, chat)
+                        scope = arg
+                        console.print(f"[green]Context scope: {scope}[/green]")
+                    except ValueError as e:
+                        console.print(f"[red]{e}[/red]")
+                else:
+                    console.print(f"Context scope: {scope}. Usage: \\scope <all|chat|model|Nd>")
+
+            elif command == "compare":
+                if arg == "off":
+                    compare_models = []
+                    console.print(f"[green]Comparison off; answers come from {model} only.[/green]")
+                elif arg:
+                    try:
+                        compare_models = resolve_models(arg.split(), config)
+                        console.print(f"[green]Messages also go to {', '.join(compare_models)}; {model}'s answer continues the chat. Use \\compare off to stop.[/green]")
+                    except ValueError as e:
+                        console.print(f"[red]{e}[/red]")
+                else:
+                    console.print("Usage: \\compare <model> [<model> ...] | off")
+
             elif command == "quit":
                 if chat["messages"]: # Save the chat if there was any interaction
+                    summarizer.finish(chat)
                     chat["updated_at"] = datetime.datetime.now().isoformat()
                     save_chat(CHATS_DIR, chat)
+                try:
+                    indexer.close()
+                except (EmbeddingError, ValueError) as e:
+                    console.print(f"[red]The last reply was not indexed: {e}[/red]")
                 console.print("[yellow]Goodbye![/yellow]")
                 return # Exit the run function, ending the chat session
 
@@ -144,6 +211,8 @@ def run(model):
                     "\\save - Save chat as favorite\n"
                     "\\clear - Clear current chat and start fresh\n"
                     "\\switch <model> - Switch to a different LLM model (only on an empty chat)\n"
+                    "\\scope <all|chat|model|Nd> - Limit retrieved context (e.g. \\scope 30d)\n"
+                    "\\compare <model> ... - Also send each message to these models, side by side (\\compare off to stop)\n"
                     "\\quit - Exit the application\n"
                     "\\help - Show this help information",
                     title="Help",
@@ -154,54 +223,38 @@ def run(model):
 
         else:
             # Normal chat turn
-            # chat["messages"].append({"role": "user", "content": user_input})
-            chat["messages"].append({
-                "role": "user",
-                "content": user_input,
-                "context": "",  # will be filled later
-                "image": image_buffer  # None if no image buffered
-            })
-            image_buffer = None  # reset
-
-
-            # Retrieve context
-            context = get_relevant_context(vector_store, user_input)
-
-            for i in range(len(chat["messages"]) - 1, -1, -1):
-                if chat["messages"][i]["role"] == "user":
-                    chat["messages"][i]["context"] = context
-                    break
-
-            console.print("\n[bold green]assistant[/bold green] >", end=" ") # Use end=" " to keep the cursor on the same line
-            assistant_response = send_message_to_llm(model, chat["messages"], config, context, console)
-
-            # Add assistant response to messages
-            chat["messages"].append({"role": "assistant", "content": assistant_response})
-
-            # Add user input and assistant response to vector store for context retrieval
-            # Ensure unique IDs for each message entry in the vector store
-            user_message_id = f"{chat['id']}:{len(chat['messages']) - 2}" # ID for the user message just added
-            assistant_message_id = f"{chat['id']}:{len(chat['messages']) - 1}" # ID for the assistant message just added
-
-            vector_store.add(user_message_id, user_input)
-            vector_store.add(assistant_message_id, assistant_response)
-
-            # Generate title after the first exchange (user + assistant message)
-            if not title_generated and len(chat["messages"]) >= 2:
-                # Pass only the first user/assistant exchange for title generation
-                chat["title"] = get_chat_title(chat["messages"][:2], config, CONFIG_PATH)
-                title_generated = True
-                console.print(f"\n[dim]Chat title: {chat['title']}[/dim]") # Print the title once generated
-
-            # Update timestamp and save chat after each turn
-            chat["updated_at"] = datetime.datetime.now().isoformat()
-            save_chat(CHATS_DIR, chat)
+            with profiled_turn(chat, profile):
+                summarizer.apply(chat)  # A summary finished while the user typed
+                if compare_models:
+                    run_compare_turn(chat, [model] + [m for m in compare_models if m != model], user_input,
+                                     image_buffer, vector_store, config, scope, indexer)
+                else:
+                    run_chat_turn(chat, model, user_input, image_buffer, vector_store, config, scope, response_cache, indexer)
+                image_buffer = None  # reset
+
+                # Generate title after the first exchange (user + assistant message)
+                if not title_generated and len(chat["messages"]) >= 2:
+                    # Pass only the first user/assistant exchange for title generation
+                    with span("llm.title"):
+                        chat["title"] = get_chat_title(chat["messages"][:2], config, CONFIG_PATH)
+                    title_generated = True
+                    console.print(f"\n[dim]Chat title: {chat['title']}[/dim]") # Print the title once generated
+
+                # Update timestamp and save chat after each turn
+                chat["updated_at"] = datetime.datetime.now().isoformat()
+                save_chat(CHATS_DIR, chat)
+            # Fold older turns into the running summary while the user types
+            summarizer.maybe_start(chat)
 
 
 @cli.command()
 @click.option("-c", "--continue-chat", type=int, help="Continue the chat with the given number from the saved list.")
-def saved(continue_chat):
+@click.option("--profile", is_flag=True, help="Print a timing breakdown after every turn.")
+@click.option("--trace-file", type=click.Path(dir_okay=False), help="Append per-turn spans to this JSONL file.")
+def saved(continue_chat, profile, trace_file):
     """List saved chats or continue a specific chat."""
+    if profile or trace_file:
+        tracing.enable(trace_file)
     chats = get_all_chats(CHATS_DIR)
     favorite_chats = [chat for chat in chats if chat.get("favorite", False)]
 
@@ -212,180 +265,478 @@ def saved(continue_chat):
     if continue_chat is not None:
         chat_index = continue_chat - 1
         if 0 <= chat_index < len(favorite_chats):
-            chat = favorite_chats[chat_index]
-            model = chat["model"]
-            config = load_config(CONFIG_PATH)
+            resume_chat(favorite_chats[chat_index], profile)
+    else:
+        console.print(Panel.fit("Saved Chats", style="bold green"))
+        if not favorite_chats:
+            console.print("[yellow]No saved chats found.[/yellow]")
+        else:
+            for i, chat in enumerate(favorite_chats, 1):
+                console.print(f"[bold]{i}.[/bold] {chat['title']} [dim]({chat['model']})[/dim]")
+
 
+@cli.command()
+@click.argument("query", nargs=-1, required=True)
+@click.option("--favorite", is_flag=True, help="Only search saved (favorite) chats.")
+@click.option("-m", "--model", default=None, help="Only messages from this model.")
+@click.option("--since", help="Only messages from this date on (YYYY-MM-DD), or the last N days (e.g. 30d).")
+@click.option("--until", help="Only messages up to this date (YYYY-MM-DD).")
+@click.option("--page", type=int, default=1, help="Page of results to show.")
+@click.option("--per-page", type=int, default=10, help="Results per page.")
+@click.option("--lexical", is_flag=True, help="Keyword matches only; answers without loading the embedding model.")
+@click.option("-c", "--continue-chat", type=int, help="Continue the chat of result N.")
+@click.option("--profile", is_flag=True, help="Print a timing breakdown after every turn of a continued chat.")
+def search(query, favorite, model, since, until, page, per_page, lexical, continue_chat, profile):
+    """Search all past chats by meaning and keywords."""
+    query = " ".join(query)
+    try:
+        since, until = parse_date(since), parse_date(until, end_of_day=True)
+        # Messages record the full model name
+        model = get_model_metadata(model)["full_name"] if model else None
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    page, per_page = max(1, page), max(1, per_page)
+    catalog = ChatCatalog(CHATS_DIR)
+    catalog.sync()
+    if lexical and not catalog.lexical:
+        console.print("[red]Keyword search needs SQLite with FTS5, which this Python lacks. Drop --lexical.[/red]")
+        return
+    vector_store = None if lexical else open_vector_store(load_config(CONFIG_PATH))
+    # One extra hit tells whether there is a next page
+    limit = max(page * per_page, continue_chat or 0) + 1
+    hits = search_chats(catalog, vector_store, query, limit, favorite=favorite or None,
+                        model=model, since=since, until=until)
+    catalog.close()
+
+    if continue_chat is not None:
+        if not 1 <= continue_chat <= len(hits):
+            console.print(f"[red]No result {continue_chat}.[/red]")
+            return
+        chat = load_chat(CHATS_DIR, hits[continue_chat - 1]["chat_id"])
+        resume_chat(chat, profile)
+        return
+
+    shown = hits[(page - 1) * per_page:page * per_page]
+    if not shown:
+        console.print("[yellow]No matches.[/yellow]" if page == 1 else "[yellow]No more matches.[/yellow]")
+        return
+    terms = query_terms(query)
+    highlight = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE) if terms else None
+    for n, hit in enumerate(shown, (page - 1) * per_page + 1):
+        chat = hit["chat"]
+        favorite_mark = " [yellow]★[/yellow]" if chat["favorite"] else ""
+        console.print(
+            f"[bold]{n}.[/bold] {escape(chat['title'] or 'Untitled Chat')}{favorite_mark} "
+            f"[dim]({chat['model']}, {(chat['updated_at'] or '')[:10]}, message {hit['position'] + 1} of {chat['messages']})[/dim]"
+        )
+        text = escape(snippet(hit["text"], terms))
+        if highlight:
+            text = highlight.sub(lambda m: f"[bold yellow]{m.group(0)}[/bold yellow]", text)
+        console.print(f"   {text}", highlight=False)
+    if len(hits) > page * per_page:
+        console.print(f"\n[dim]More results with --page {page + 1}.[/dim]", end=" ")
+    console.print("[dim]Continue a chat with -c N.[/dim]")
+
+
+@cli.command()
+@click.argument("prompts", nargs=-1)
+@click.option("-m", "--model", default="", help="Model for prompts that don't name one (default: configured default).")
+@click.option("-f", "--file", "jsonl_file", type=click.File("r"), help='JSONL file of {"prompt": ..., "id": ..., "model": ...} objects ("-" for stdin).')
+@click.option("--concurrency", type=int, help="Max requests in flight across all providers.")
+@click.option("--provider-concurrency", type=int, help="Max requests in flight per provider runtime.")
+@click.option("--rpm", type=int, help="Max requests started per minute per provider runtime.")
+@click.option("--no-context", is_flag=True, help="Don't retrieve context from chat memory.")
+@click.option("--compare", help="Send every prompt to each of these comma-separated models, reusing one retrieval per prompt.")
+def ask(prompts, model, jsonl_file, concurrency, provider_concurrency, rpm, no_context, compare):
+    """
+    Answer prompts non-interactively, printing one JSON result per line.
+
+    Prompts come from arguments, a JSONL file, or stdin (one prompt per line,
+    or pass "-" as a prompt). Results are printed as they complete. With
+    --compare each prompt gets one result per model, all sharing its id.
+    """
+    config = load_config(CONFIG_PATH)
+    default_model = model or config.get("default_model", DEFAULT_MODEL)
+
+    requests = []
+    for prompt in prompts:
+        if prompt == "-":
+            requests.extend({"prompt": line.rstrip("\n")} for line in sys.stdin if line.strip())
+        else:
+            requests.append({"prompt": prompt})
+    if jsonl_file:
+        for line_no, line in enumerate(jsonl_file, 1):
+            if not line.strip():
+                continue
             try:
-                model_metadata = get_model_metadata(model)
-                runtime = model_metadata.get("runtime", model_metadata.get("provider"))
-                
-                if runtime == "OpenAI" and not config.get("OPENAI_API_KEY"):
-                    console.print("[red]Error: OpenAI API key not set. Run 'localrag config' to set your API keys.[/red]")
-                    return
-                elif runtime == "Anthropic" and not config.get("ANTHROPIC_API_KEY"):
-                    console.print("[red]Error: Anthropic API key not set. Run 'localrag config' to set your API keys.[/red]")
-                    return
-                elif runtime == "Google" and not config.get("GOOGLE_API_KEY"):
-                    console.print("[red]Error: Gemini API key not set. Run 'localrag config' to set your API keys.[/red]")
-                    return
-                elif runtime == "xAI" and not config.get("XAI_API_KEY"):
-                    console.print("[red]Error: xAI API key not set. Run 'localrag config' to set your API keys.[/red]")
-                    return
-                elif runtime == "Ollama":
-                    if not config.get("OLLAMA_BASE_URL"):
-                        console.print("[red]Error: Ollama is not installed. Please install Ollama from https://ollama.com/[/red]")
-                        return
-                    if not ensure_ollama_model(model, console):
-                        return
-            except ValueError as e:
-                console.print(f"[red]{e}[/red]")
-                console.print("Supported models are:\n" + list_supported_models())
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                err_console.print(f"[red]Invalid JSON on line {line_no}: {e}[/red]")
                 return
+            if not isinstance(item, dict) or "prompt" not in item:
+                err_console.print(f'[red]Line {line_no} has no "prompt" field.[/red]')
+                return
+            requests.append(item)
+    if not prompts and not jsonl_file and not sys.stdin.isatty():
+        requests.extend({"prompt": line.rstrip("\n")} for line in sys.stdin if line.strip())
+    if not requests:
+        err_console.print("[red]No prompts given. Pass prompts as arguments, --file, or on stdin.[/red]")
+        return
 
-            console.print(Panel.fit(f"Continuing chat: {chat.get('title', 'Untitled Chat')}", style="bold blue"))
+    for i, request in enumerate(requests):
+        request.setdefault("id", i)
+        request.setdefault("model", default_model)
+        request["context"] = ""
+
+    response_cache = open_response_cache(config, RESPONSE_CACHE_DIR)
+    embeddings = None
+    if not no_context or response_cache:
+        vector_store = open_vector_store(config)
+        prompts = [r["prompt"] for r in requests]
+        try:
+            embeddings = vector_store.embed(prompts)
+        except (EmbeddingError, ValueError) as e:
+            err_console.print(f"[red]Could not embed the prompts, answering without context or cache: {e}[/red]")
+            no_context, response_cache = True, None
+    if not no_context:
+        contexts = get_relevant_contexts(vector_store, prompts, embeddings=embeddings)
+        for request, context in zip(requests, contexts):
+            request["context"] = context
+
+    for i, request in enumerate(requests):
+        request["embedding"] = embeddings[i] if embeddings is not None else None
+    if compare:
+        models = [name.strip() for name in compare.split(",") if name.strip()]
+        requests = [{**request, "model": name} for request in requests for name in models]
+
+    pending = []
+    for request in requests:
+        cached = None
+        if response_cache:
+            try:
+                request["model"] = get_model_metadata(request["model"])["full_name"]
+                cached = response_cache.lookup(request["model"], request["embedding"])
+            except ValueError:
+                pass  # reported by ask_many
+        if cached is not None:
+            click.echo(json.dumps({
+                "id": request["id"], "model": request["model"], "prompt": request["prompt"],
+                "response": cached, "error": None, "latency_s": 0.0, "cached": True,
+            }))
+        else:
+            pending.append(request)
+
+    limits = ProviderLimits(config, provider_concurrency, rpm)
+    for request, result in ask_many(pending, config, limits, concurrency or config.get("ask_concurrency", 8)):
+        if response_cache and result["error"] is None:
+            response_cache.store(result["model"], request["prompt"], request["embedding"], result["response"], result["latency_s"])
+        click.echo(json.dumps(result))
+        sys.stdout.flush()
+
+
+@cli.command()
+@click.option("--clear", is_flag=True, help="Delete all cached responses and reset the statistics.")
+def cache(clear):
+    """Show response cache statistics (hit rate, latency saved)."""
+    config = load_config(CONFIG_PATH)
+    response_cache = open_response_cache({**config, "response_cache": True}, RESPONSE_CACHE_DIR)
+    if clear:
+        response_cache.clear()
+        console.print("[green]Response cache cleared.[/green]")
+        return
+    summary = response_cache.summary()
+    state = "enabled" if config.get("response_cache") else "disabled (set \"response_cache\": true in config.json)"
+    console.print(Panel.fit("Response Cache", style="bold green"))
+    console.print(f"Status: {state}")
+    console.print(f"Entries: {summary['entries']} / {config.get('response_cache_max_entries')}")
+    console.print(f"Hits: {summary['hits']}  Misses: {summary['misses']}  Hit rate: {summary['hit_rate']:.1%}")
+    console.print(f"Latency saved: {summary['saved_seconds']:.1f}s")
+
+
+@cli.command()
+@click.option("--reset", is_flag=True, help="Delete the metrics recorded so far.")
+@click.option("--prometheus", "textfile", type=click.Path(dir_okay=False), help="Also write the metrics to this Prometheus textfile (.prom).")
+def stats(reset, textfile):
+    """Show store health and the latency, cache and error metrics of past runs."""
+    if reset:
+        metrics.reset(METRICS_PATH)
+        console.print("[green]Metrics reset.[/green]")
+        return
+    totals = metrics.flush(METRICS_PATH)  # Only reads them when "metrics" is false
+    gauges = store_gauges()
+    if textfile:
+        metrics.write_textfile(textfile, totals, gauges)
+
+    def gauge(name, **labels):
+        return sum(value for gauge_name, gauge_labels, value in gauges
+                   if gauge_name == name and all(gauge_labels.get(k) == v for k, v in labels.items()))
+
+    def ms(seconds, digits=1):
+        return "-" if seconds is None else f"{seconds * 1000:,.{digits}f}"
+
+    name, entry = index_registry().active()
+    index_labels = next(labels for gauge_name, labels, _ in gauges if gauge_name == "vectors")
+    console.print(Panel.fit("LocalRAG Stats", style="bold green"))
+    console.print(f"Vector index: {name} ({entry['embedding_model']}, {index_labels['index_type']}), "
+                  f"{gauge('vectors'):,} vectors in {gauge('vector_partitions')} partitions")
+    console.print(f"Chats: {gauge('chats'):,} ({gauge('chats', tier='archive'):,} archived)")
+    console.print("Disk: " + ", ".join(
+        f"{'index ' + labels['index'] if 'index' in labels else labels['component'].replace('_', ' ')} {format_bytes(value)}"
+        for gauge_name, labels, value in gauges if gauge_name == "disk_bytes"))
+    added = sum(value for _, value in metrics.series(totals, "counters", "vector_messages_added_total"))
+    duplicates = sum(value for _, value in metrics.series(totals, "counters", "vector_duplicates_total"))
+    recovered = sum(value for _, value in metrics.series(totals, "counters", "vector_partitions_recovered_total"))
+    console.print(f"Messages indexed: {added:,} ({duplicates:,} duplicates stored as aliases), partitions recovered: {recovered}")
+    lookups = {labels["result"]: value for labels, value in metrics.series(totals, "counters", "response_cache_lookups_total")}
+    if lookups:
+        hit_rate = lookups.get("hit", 0) / sum(lookups.values())
+        console.print(f"Response cache: {lookups.get('hit', 0):,} hits, {lookups.get('miss', 0):,} misses ({hit_rate:.1%} hit rate)")
+    if not metrics.enabled():
+        console.print("[yellow]Metrics are off (\"metrics\": false in config.json); nothing new is recorded.[/yellow]")
+    if not totals["since"]:
+        console.print("[dim]No metrics recorded yet.[/dim]")
+        return
+    since = datetime.datetime.fromtimestamp(totals["since"]).strftime("%Y-%m-%d %H:%M")
+    console.print(f"[dim]Recorded since {since}[/dim]")
+
+    latency = Table(title="Latency (ms)", title_justify="left", show_edge=False)
+    for column in ("operation", "count", "mean", "p50", "p95", "p99"):
+        latency.add_column(column, justify="left" if column == "operation" else "right")
+    for metric in metrics.HELP:
+        if not metric.endswith("_seconds") or metric.startswith("llm_"):
+            continue
+        for _, histogram in metrics.series(totals, "histograms", metric):
+            latency.add_row(metric[:-len("_seconds")].replace("_", " "), f"{histogram['count']:,}",
+                            ms(histogram["sum"] / histogram["count"]),
+                            *(ms(metrics.quantile(histogram, q)) for q in (0.5, 0.95, 0.99)))
+    console.print(latency)
+
+    requests = {}
+    for labels, value in metrics.series(totals, "counters", "llm_requests_total"):
+        key = (labels["provider"], labels["model"])
+        requests.setdefault(key, {"ok": 0, "error": 0})[labels["outcome"]] = value
+    if requests:
+        first_token = {(l["provider"], l["model"]): h for l, h in metrics.series(totals, "histograms", "llm_first_token_seconds")}
+        request_time = {(l["provider"], l["model"]): h for l, h in metrics.series(totals, "histograms", "llm_request_seconds")}
+        providers = Table(title="LLM requests (ms)", title_justify="left", show_edge=False)
+        for column in ("provider", "model", "requests", "errors", "first token p50/p95", "total p50/p95"):
+            providers.add_column(column, justify="left" if column in ("provider", "model") else "right")
+        for key, counts in sorted(requests.items()):
+            total = counts["ok"] + counts["error"]
+            latencies = ["/".join(ms(metrics.quantile(h, q), 0) for q in (0.5, 0.95)) if h else "-"
+                         for h in (first_token.get(key), request_time.get(key))]
+            providers.add_row(*key, f"{total:,}", f"{counts['error']:,} ({counts['error'] / total:.0%})", *latencies)
+        console.print(providers)
+
+
+@cli.command()
+@click.option("--type", "index_type", type=click.Choice(INDEX_TYPES), help="Rebuild every partition with this index type.")
+@click.option("--rerank", type=int, default=None, help=f"Re-rank N x top_k compressed hits over full vectors kept on disk (0 = off, default {DEFAULT_RERANK_FACTOR} for sq16/sq8).")
+@click.option("--sample", type=int, default=200, help="Stored vectors used as queries to measure recall.")
+def index(index_type, rerank, sample):
+    """Show vector index memory use, or convert it (flat, sq16, sq8)."""
+    config = load_config(CONFIG_PATH)
+    vector_store = open_vector_store(config)
+    if index_type:
+        if rerank is None:
+            rerank = DEFAULT_RERANK_FACTOR if index_type != "flat" else 0
+        with console.status(f"Rebuilding {vector_store.ntotal:,} vectors as {index_type}..."):
+            report = vector_store.migrate(index_type, rerank, sample=sample)
+        saved_bytes = report["before_bytes"] - report["after_bytes"]
+        console.print(Panel.fit(f"Vector index: {index_type}", style="bold green"))
+        console.print(f"Vectors: {report['vectors']:,}")
+        console.print(f"Index memory: {format_bytes(report['before_bytes'])} -> {format_bytes(report['after_bytes'])} "
+                      f"({format_bytes(saved_bytes)} saved)")
+        console.print(f"Recall@{report['top_k']}: {report['recall']:.3f}")
+        if report["rerank_factor"] and index_type != "flat":
+            console.print(f"Recall@{report['top_k']} with re-rank (x{report['rerank_factor']}): {report['recall_reranked']:.3f}")
+            console.print(f"Full vectors on disk (memory-mapped): {format_bytes(report['full_vector_bytes'])}")
+        if report["lossy_partitions"]:
+            console.print(f"[yellow]Partitions rebuilt from already-compressed vectors: {', '.join(report['lossy_partitions'])}[/yellow]")
+        return
+
+    rows = vector_store.memory_report()
+    console.print(Panel.fit("Vector Index", style="bold green"))
+    for row in rows:
+        rerank_note = " + re-rank" if row["rerank"] else ""
+        console.print(f"{row['partition']}: {row['vectors']:,} vectors, {row['index_type']}{rerank_note}, {format_bytes(row['index_bytes'])}")
+    console.print(f"Total: {sum(r['vectors'] for r in rows):,} vectors, {format_bytes(sum(r['index_bytes'] for r in rows))}")
+
+
+@cli.command()
+@click.option("--older-than", "days", type=int, default=None, help="Archive chats untouched for this many days (default: archive_after_days in config.json).")
+@click.option("--status", is_flag=True, help="Only show what is archived.")
+def archive(days, status):
+    """Pack chats nobody has touched in a while into compressed archive files."""
+    chat_archive = ChatArchive(CHATS_DIR)
+    try:
+        if not status:
+            if days is None:
+                days = load_config(CONFIG_PATH).get("archive_after_days", 90)
+            with console.status(f"Archiving chats untouched for {days} days..."):
+                report = chat_archive.archive(days)
+            if report["archived"]:
+                console.print(f"[green]Archived {report['archived']:,} chats: {format_bytes(report['bytes_before'])} -> "
+                              f"{format_bytes(report['bytes_after'])}.[/green]")
+            else:
+                console.print(f"[yellow]No chats untouched for {days} days.[/yellow]")
+            if report["compacted"]:
+                console.print(f"Compacted {report['compacted']} packs holding chats resumed since they were archived.")
+        summary = chat_archive.stats()
+    finally:
+        chat_archive.close()
+    hot = sum(1 for f in os.listdir(CHATS_DIR) if f.endswith(".json"))
+    console.print(f"Chats: {hot:,} active, {summary['chats']:,} archived in {summary['packs']} packs "
+                  f"({format_bytes(summary['bytes'])}, {format_bytes(summary['dead_bytes'])} reclaimable)")
+
+
+@cli.command("export")
+@click.argument("path", required=False, type=click.Path(dir_okay=False, allow_dash=True))
+def export_state(path):
+    """Write every vector index and chat to one compressed snapshot file ('-' for stdout)."""
+    path = path or f"localrag-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.tar.gz"
+    out = err_console if path == "-" else console
+    registry = index_registry()
+    migration = registry.data.get("migration")
+    indexes = {name: entry for name, entry in registry.data["indexes"].items() if name != migration}
+
+    def progress(totals):
+        status.update(f"Exporting: {totals['vectors']:,} vectors, {totals['chats']:,} chats...")
+
+    try:
+        with out.status("Exporting...") as status:
+            if path == "-":
+                totals = export_snapshot(sys.stdout.buffer, indexes, CHATS_DIR, registry.data["active"], progress)
+            else:
+                # Written beside the target and renamed, so a failed export leaves no partial snapshot
+                tmp_path = f"{path}.tmp"
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        totals = export_snapshot(f, indexes, CHATS_DIR, registry.data["active"], progress)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+    except (SnapshotError, OSError) as e:
+        out.print(f"[red]Export failed: {e}[/red]")
+        sys.exit(1)
+    target = "stdout" if path == "-" else f"{path}, {format_bytes(os.path.getsize(path))}"
+    out.print(f"[green]Exported {totals['vectors']:,} vectors from {len(indexes)} index{'es' if len(indexes) != 1 else ''} and {totals['chats']:,} chats "
+              f"to {target}.[/green]")
+
+
+@cli.command("import")
+@click.argument("path", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("--check", is_flag=True, help="Only verify the snapshot's checksums and completeness.")
+def import_state(path, check):
+    """Merge a snapshot from 'localrag export' into this install, without re-embedding ('-' for stdin)."""
+    config = load_config(CONFIG_PATH)
+    importer = SnapshotImport(index_registry(), CHATS_DIR, dedup=config.get("dedup", True), check=check)
+
+    def progress(report):
+        status.update(f"{'Checking' if check else 'Importing'}: {report['vectors']:,} vectors, {report['chats']:,} chats...")
+
+    importer.progress = progress
+    try:
+        with console.status("Reading snapshot...") as status:
+            if path == "-":
+                report = importer.run(sys.stdin.buffer)
+            else:
+                with open(path, 'rb') as f:
+                    report = importer.run(f)
+    except (SnapshotError, OSError) as e:
+        console.print(f"[red]Import failed: {e}[/red]")
+        if not check and importer.header is not None:
+            console.print("[yellow]What was read before the error has been merged; importing again is safe.[/yellow]")
+        sys.exit(1)
+    if check:
+        console.print(f"[green]Snapshot OK: {report['vectors']:,} vectors and {report['chats']:,} chats, all checksums match.[/green]")
+        return
+    console.print(f"[green]Imported {report['vectors_imported']:,} vectors and {report['chats_imported']:,} chats.[/green]")
+    for name, added in report["indexes"].items():
+        console.print(f"  index {name}: {added:,} vectors added")
+    if report["vectors_skipped"] or report["chats_skipped"]:
+        console.print(f"Already here: {report['vectors_skipped']:,} vectors, {report['chats_skipped']:,} chats (kept the newer copy).")
 
-            for msg in chat["messages"]:
-                if msg["role"] == "user":
-                    console.print(f"\n[bold cyan]user[/bold cyan] > {msg['content']}")
-                else:
-                    console.print(f"\n[bold green]assistant[/bold green] > {msg['content']}")
-
-            console.print("\nContinue the conversation. Use [bold]\\commands[/bold] for special actions.")
-            vector_store = VectorStore(VECTOR_STORE_PATH, EMBEDDING_MODEL)
-
-            while True:
-                user_input = Prompt.ask("\n[bold cyan]user[/bold cyan] >")
-
-                if user_input.startswith("\\"):
-                    command_parts = user_input[1:].strip().lower().split(maxsplit=1)
-                    command = command_parts[0]
-                    arg = command_parts[1] if len(command_parts) > 1 else None
-
-                    if command == "image":
-                        image_path = arg
-                        if os.path.exists(image_path):
-                            image_buffer = os.path.abspath(image_path)
-                            console.print(f"[green]Image path '{image_path}' buffered. Now type your message to pair with it.[/green]")
-                        else:
-                            console.print(f"[red]Image file not found at '{image_path}'[/red]")
-                        continue
-
-                    if command == "save":
-                        # It's already a favorite chat, but ensure the flag is True
-                        chat["favorite"] = True
-                        save_chat(CHATS_DIR, chat)
-                        console.print("[green]Chat already saved as favorite![/green]")
-                    elif command == "clear":
-                        # Clearing means starting a new conversation within this chat ID
-                        chat["messages"] = []
-                        # Do NOT create a new chat object here, just clear messages
-                        console.print("[yellow]Chat history cleared. Continuing with the same chat ID.[/yellow]")
-                        # Note: Clearing history means previous context might not be directly available
-                        # for the LLM unless retrieved from the vector store.
-
-                    elif command == "switch":
-                        if arg:
-                            if chat["messages"]:
-                                console.print("[red]Can't switch model in the middle of a conversation. Use \\clear first.[/red]")
-                            else:
-                                try:
-                                    model_metadata = get_model_metadata(arg)
-                                    runtime = model_metadata.get("runtime", model_metadata.get("provider"))
-                                    
-                                    # Runtime checks for the new model
-                                    if runtime == "OpenAI" and not config.get("OPENAI_API_KEY"):
-                                        console.print("[red]Error: OpenAI API key not set. Run 'localrag config' to set your API keys.[/red]")
-                                        continue
-                                    elif runtime == "Anthropic" and not config.get("ANTHROPIC_API_KEY"):
-                                        console.print("[red]Error: Anthropic API key not set. Run 'localrag config' to set your API keys.[/red]")
-                                        continue
-                                    elif runtime == "Google" and not config.get("GOOGLE_API_KEY"):
-                                        console.print("[red]Error: Gemini API key not set. Run 'localrag config' to set your API keys.[/red]")
-                                        continue
-                                    elif runtime == "xAI" and not config.get("XAI_API_KEY"):
-                                        console.print("[red]Error: xAI API key not set. Run 'localrag config' to set your API keys.[/red]")
-                                        continue
-                                    elif runtime == "Ollama":
-                                        if not config.get("OLLAMA_BASE_URL"):
-                                            console.print("[red]Error: Ollama is not installed. Please install Ollama from https://ollama.com/[/red]")
-                                            continue
-                                        if not ensure_ollama_model(model_metadata["full_name"], console):
-                                            continue
-                                    
-                                    chat["model"] = model_metadata["full_name"]
-                                    model = model_metadata["full_name"]
-                                    console.print(f"[green]Switched to model: {model}[/green]")
-                                except ValueError as e:
-                                    console.print(f"[red]{e}[/red]")
-                                    console.print("Supported models are:\n" + list_supported_models())
-                        else:
-                            console.print("[red]Usage: \\switch <model>[/red]")
-
-                    elif command == "quit":
-                        # Save the chat before quitting
-                        chat["updated_at"] = datetime.datetime.now().isoformat()
-                        save_chat(CHATS_DIR, chat)
-                        console.print("[yellow]Goodbye![/yellow]")
-                        return # Exit the saved function
-
-                    elif command == "help":
-                         console.print(Panel.fit(
-                            "[bold]Available Commands:[/bold]\n"
-                            "\\save - Save chat as favorite\n"
-                            "\\clear - Clear current chat history\n" # Clarified help text
-                            "\\switch <model> - Switch to a different LLM model (only on an empty chat)\n"
-                            "\\quit - Exit the application\n"
-                            "\\help - Show this help information",
-                            title="Help",
-                            border_style="blue"
-                        ))
-                    else:
-                        console.print("[red]Unknown command. Type \\help for available commands.[/red]")
 
+@cli.command()
+@click.argument("model", required=False)
+@click.option("--status", is_flag=True, help="List indexes and any migration in progress.")
+@click.option("--activate", "activate_name", help="Make the named index active (e.g. switch back after a migration).")
+@click.option("--abort", is_flag=True, help="Abandon the migration in progress; the active index is unchanged.")
+@click.option("--batch-size", type=int, default=512, help="Messages embedded per batch.")
+def reindex(model, status, activate_name, abort, batch_size):
+    """Re-embed all messages with MODEL into a new index, then switch to it.
+
+    Chats keep working during the migration: new messages are written to both
+    indexes and the switch happens atomically once the new one has caught up.
+    Re-run to resume an interrupted migration.
+    """
+    config = load_config(CONFIG_PATH)
+    registry = index_registry()
+
+    if status:
+        active_name, _ = registry.active()
+        migration = registry.migration()
+        console.print(Panel.fit("Vector Indexes", style="bold green"))
+        for name, entry in registry.data["indexes"].items():
+            embedding = (read_manifest(entry["path"]) or {}).get("embedding") or {}
+            marker = " [green](active)[/green]" if name == active_name else ""
+            if migration and name == migration[0]:
+                marker = " [yellow](migration in progress)[/yellow]"
+            dims = f", {embedding['dim']} dims" if embedding.get("dim") else ""
+            normalized = ", normalized" if embedding.get("normalized") else ""
+            console.print(f"[bold]{name}[/bold]{marker}: {entry['embedding_model']}{dims}{normalized} [dim]{entry['path']}[/dim]")
+        return
+
+    if activate_name or abort:
+        with registry.lock():
+            registry.load()
+            try:
+                if activate_name:
+                    registry.activate(activate_name)
                 else:
-                    # Normal chat turn in a continued conversation
-                    # chat["messages"].append({"role": "user", "content": user_input})
-                    chat["messages"].append({
-                        "role": "user",
-                        "content": user_input,
-                        "context": "",  # will be filled later
-                        "image": image_buffer  # None if no image buffered
-                    })
-                    image_buffer = None  # reset
-
-                    # Retrieve context
-                    context = get_relevant_context(vector_store, user_input)
-
-                    for i in range(len(chat["messages"]) - 1, -1, -1):
-                        if chat["messages"][i]["role"] == "user":
-                            chat["messages"][i]["context"] = context
-                            break
-
-                    console.print("\n[bold green]assistant[/bold green] >", end=" ")
-                    # Pass the loaded config to send_message_to_llm
-                    assistant_response = send_message_to_llm(model, chat["messages"], config, context, console)
-
-                    chat["messages"].append({"role": "assistant", "content": assistant_response})
-
-                    # Add to vector store (even in continued chats)
-                    user_message_id = f"{chat['id']}:{len(chat['messages']) - 2}"
-                    assistant_message_id = f"{chat['id']}:{len(chat['messages']) - 1}"
-                    vector_store.add(user_message_id, user_input)
-                    vector_store.add(assistant_message_id, assistant_response)
-
-
-                    # Update timestamp and save chat
-                    chat["updated_at"] = datetime.datetime.now().isoformat()
-                    save_chat(CHATS_DIR, chat)
+                    registry.abort_migration()
+            except ValueError as e:
+                console.print(f"[red]{e}[/red]")
+                return
+        console.print(f"[green]Active index: {registry.active()[0]}[/green]" if activate_name else "[yellow]Migration aborted.[/yellow]")
+        return
 
-    else:
-        console.print(Panel.fit("Saved Chats", style="bold green"))
-        if not favorite_chats:
-            console.print("[yellow]No saved chats found.[/yellow]")
-        else:
-            for i, chat in enumerate(favorite_chats, 1):
-                console.print(f"[bold]{i}.[/bold] {chat['title']} [dim]({chat['model']})[/dim]")
+    model = model or config.get("embedding_model") or EMBEDDING_MODEL
+    active_name, active_entry = registry.active()
+    migration = registry.migration()
+    if migration and migration[1]["embedding_model"] != model:
+        console.print(f"[red]A migration to {migration[1]['embedding_model']} is in progress. "
+                      f"Resume it with 'localrag reindex {migration[1]['embedding_model']}' or run 'localrag reindex --abort'.[/red]")
+        return
+    if not migration:
+        if active_entry["embedding_model"] == model:
+            console.print(f"[yellow]The active index already uses {model}.[/yellow]")
+            return
+        with registry.lock():
+            registry.load()
+            migration = registry.start_migration(model)
+    target_name, target_entry = migration
+
+    try:
+        source = _open_store(config, active_entry)
+        target = _open_store(config, target_entry)
+    except (EmbeddingError, ValueError) as e:
+        console.print(f"[red]Could not open the vector index: {e}[/red]")
+        sys.exit(1)
+    console.print(f"Re-embedding {active_name} ({active_entry['embedding_model']}) into {target_name} ({model})")
+    with Progress(console=console) as progress:
+        task = progress.add_task("Re-embedding", total=None)
+        run_migration(
+            registry, source, target, lambda chat_id: load_chat(CHATS_DIR, chat_id),
+            batch_size=batch_size,
+            progress=lambda done, total: progress.update(task, completed=done, total=total),
+        )
+    console.print(f"[green]Switched to {target_name}. Switch back with 'localrag reindex --activate {active_name}'.[/green]")
 
 
 @cli.command()
@@ -460,36 +811,557 @@ def update():
         console.print(f"[red]An unexpected error occurred during update check: {e}[/red]")
 
 
-def get_relevant_context(vector_store: VectorStore, query: str):
+def resume_chat(chat, profile=False):
+    """Print a saved chat and continue it interactively ('saved -c', 'search -c')."""
+    promote_chat(CHATS_DIR, chat)
+    model = chat["model"]
+    config = load_config(CONFIG_PATH)
+
+    try:
+        model_metadata = get_model_metadata(model)
+        runtime = model_metadata.get("runtime", model_metadata.get("provider"))
+
+        if runtime == "OpenAI" and not config.get("OPENAI_API_KEY"):
+            console.print("[red]Error: OpenAI API key not set. Run 'localrag config' to set your API keys.[/red]")
+            return
+        elif runtime == "Anthropic" and not config.get("ANTHROPIC_API_KEY"):
+            console.print("[red]Error: Anthropic API key not set. Run 'localrag config' to set your API keys.[/red]")
+            return
+        elif runtime == "Google" and not config.get("GOOGLE_API_KEY"):
+            console.print("[red]Error: Gemini API key not set. Run 'localrag config' to set your API keys.[/red]")
+            return
+        elif runtime == "xAI" and not config.get("XAI_API_KEY"):
+            console.print("[red]Error: xAI API key not set. Run 'localrag config' to set your API keys.[/red]")
+            return
+        elif runtime == "Ollama":
+            if not config.get("OLLAMA_BASE_URL"):
+                console.print("[red]Error: Ollama is not installed. Please install Ollama from https://ollama.com/[/red]")
+                return
+            if not ensure_ollama_model(model, console):
+                return
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        console.print("Supported models are:\n" + list_supported_models())
+        return
+
+    console.print(Panel.fit(f"Continuing chat: {chat.get('title', 'Untitled Chat')}", style="bold blue"))
+
+    for msg in chat["messages"]:
+        if msg["role"] == "user":
+            console.print(f"\n[bold cyan]user[/bold cyan] > {msg['content']}")
+        else:
+            console.print(f"\n[bold green]assistant[/bold green] > {msg['content']}")
+
+    console.print("\nContinue the conversation. Use [bold]\\commands[/bold] for special actions.")
+    vector_store = open_vector_store(config)
+    response_cache = open_response_cache(config, RESPONSE_CACHE_DIR)
+    summarizer = Summarizer(config)
+    summarizer.maybe_start(chat)  # Long chats from before summaries existed catch up here
+    indexer = BackgroundIndexer(config.get("index_workers", 1))
+    scope = "all"
+    image_buffer = None
+    compare_models = []
+
+    while True:
+        user_input = Prompt.ask("\n[bold cyan]user[/bold cyan] >")
+
+        if user_input.startswith("\\"):
+            command_parts = user_input[1:].strip().lower().split(maxsplit=1)
+            command = command_parts[0]
+            arg = command_parts[1] if len(command_parts) > 1 else None
+
+            if command == "image":
+                image_path = arg
+                if os.path.exists(image_path):
+                    image_buffer = os.path.abspath(image_path)
+                    console.print(f"[green]Image path '{image_path}' buffered. Now type your message to pair with it.[/green]")
+                else:
+                    console.print(f"[red]Image file not found at '{image_path}'[/red]")
+                continue
+
+            if command == "save":
+                # It's already a favorite chat, but ensure the flag is True
+                chat["favorite"] = True
+                save_chat(CHATS_DIR, chat)
+                console.print("[green]Chat already saved as favorite![/green]")
+            elif command == "clear":
+                # Clearing means starting a new conversation within this chat ID
+                summarizer.wait()
+                chat["messages"] = []
+                chat.pop("summary", None)
+                # Do NOT create a new chat object here, just clear messages
+                console.print("[yellow]Chat history cleared. Continuing with the same chat ID.[/yellow]")
+                # Note: Clearing history means previous context might not be directly available
+                # for the LLM unless retrieved from the vector store.
+
+            elif command == "switch":
+                if arg:
+                    if chat["messages"]:
+                        console.print("[red]Can't switch model in the middle of a conversation. Use \\clear first.[/red]")
+                    else:
+                        try:
+                            model_metadata = get_model_metadata(arg)
+                            runtime = model_metadata.get("runtime", model_metadata.get("provider"))
+
+                            # Runtime checks for the new model
+                            if runtime == "OpenAI" and not config.get("OPENAI_API_KEY"):
+                                console.print("[red]Error: OpenAI API key not set. Run 'localrag config' to set your API keys.[/red]")
+                                continue
+                            elif runtime == "Anthropic" and not config.get("ANTHROPIC_API_KEY"):
+                                console.print("[red]Error: Anthropic API key not set. Run 'localrag config' to set your API keys.[/red]")
+                                continue
+                            elif runtime == "Google" and not config.get("GOOGLE_API_KEY"):
+                                console.print("[red]Error: Gemini API key not set. Run 'localrag config' to set your API keys.[/red]")
+                                continue
+                            elif runtime == "xAI" and not config.get("XAI_API_KEY"):
+                                console.print("[red]Error: xAI API key not set. Run 'localrag config' to set your API keys.[/red]")
+                                continue
+                            elif runtime == "Ollama":
+                                if not config.get("OLLAMA_BASE_URL"):
+                                    console.print("[red]Error: Ollama is not installed. Please install Ollama from https://ollama.com/[/red]")
+                                    continue
+                                if not ensure_ollama_model(model_metadata["full_name"], console):
+                                    continue
+
+                            chat["model"] = model_metadata["full_name"]
+                            model = model_metadata["full_name"]
+                            console.print(f"[green]Switched to model: {model}[/green]")
+                        except ValueError as e:
+                            console.print(f"[red]{e}[/red]")
+                            console.print("Supported models are:\n" + list_supported_models())
+                else:
+                    console.print("[red]Usage: \\switch <model>[/red]")
+
+            elif command == "scope":
+                if arg:
+                    try:
+                        parse_scope(arg, chat)
+                        scope = arg
+                        console.print(f"[green]Context scope: {scope}[/green]")
+                    except ValueError as e:
+                        console.print(f"[red]{e}[/red]")
+                else:
+                    console.print(f"Context scope: {scope}. Usage: \\scope <all|chat|model|Nd>")
+
+            elif command == "compare":
+                if arg == "off":
+                    compare_models = []
+                    console.print(f"[green]Comparison off; answers come from {model} only.[/green]")
+                elif arg:
+                    try:
+                        compare_models = resolve_models(arg.split(), config)
+                        console.print(f"[green]Messages also go to {', '.join(compare_models)}; {model}'s answer continues the chat. Use \\compare off to stop.[/green]")
+                    except ValueError as e:
+                        console.print(f"[red]{e}[/red]")
+                else:
+                    console.print("Usage: \\compare <model> [<model> ...] | off")
+
+            elif command == "quit":
+                # Save the chat before quitting
+                summarizer.finish(chat)
+                chat["updated_at"] = datetime.datetime.now().isoformat()
+                save_chat(CHATS_DIR, chat)
+                try:
+                    indexer.close()
+                except (EmbeddingError, ValueError) as e:
+                    console.print(f"[red]The last reply was not indexed: {e}[/red]")
+                console.print("[yellow]Goodbye![/yellow]")
+                return # Exit the saved function
+
+            elif command == "help":
+                 console.print(Panel.fit(
+                    "[bold]Available Commands:[/bold]\n"
+                    "\\save - Save chat as favorite\n"
+                    "\\clear - Clear current chat history\n" # Clarified help text
+                    "\\switch <model> - Switch to a different LLM model (only on an empty chat)\n"
+                    "\\scope <all|chat|model|Nd> - Limit retrieved context (e.g. \\scope 30d)\n"
+                    "\\compare <model> ... - Also send each message to these models, side by side (\\compare off to stop)\n"
+                    "\\quit - Exit the application\n"
+                    "\\help - Show this help information",
+                    title="Help",
+                    border_style="blue"
+                ))
+            else:
+                console.print("[red]Unknown command. Type \\help for available commands.[/red]")
+
+        else:
+            # Normal chat turn in a continued conversation
+            with profiled_turn(chat, profile):
+                summarizer.apply(chat)  # A summary finished while the user typed
+                if compare_models:
+                    run_compare_turn(chat, [model] + [m for m in compare_models if m != model], user_input,
+                                     image_buffer, vector_store, config, scope, indexer)
+                else:
+                    run_chat_turn(chat, model, user_input, image_buffer, vector_store, config, scope, response_cache, indexer)
+                image_buffer = None  # reset
+
+                # Update timestamp and save chat
+                chat["updated_at"] = datetime.datetime.now().isoformat()
+                save_chat(CHATS_DIR, chat)
+            summarizer.maybe_start(chat)
+
+
+def run_chat_turn(chat, model, user_input, image, vector_store, config, scope="all", response_cache=None, indexer=None):
+    """
+    One user/assistant exchange: retrieve context, stream the reply and index
+    both messages. With a BackgroundIndexer the user message is indexed while
+    the reply streams and the reply while the user types; otherwise inline.
+    The caller is responsible for saving the chat.
+    """
+    turn_start = time.perf_counter()
+    query_embedding, user_message_id = _begin_turn(chat, model, user_input, image, vector_store, scope, indexer)
+
+    console.print("\n[bold green]assistant[/bold green] >", end=" ") # Use end=" " to keep the cursor on the same line
+    # Only opening questions are cached; later answers depend on the conversation so far
+    cacheable = response_cache is not None and len(chat["messages"]) == 1 and not image and query_embedding is not None
+    assistant_response = response_cache.lookup(model, query_embedding[0]) if cacheable else None
+    route = Route(model)
+    if assistant_response is None:
+        request_start = time.perf_counter()
+        assistant_response = send_message_to_llm(model, prompt_messages(chat, config.get("system_prompt")), config, console=console, route=route)
+        if cacheable and not route.rerouted and not is_error_response(assistant_response):
+            response_cache.store(model, user_input, query_embedding[0], assistant_response, time.perf_counter() - request_start)
+    else:
+        console.print(assistant_response, highlight=False)
+        console.print("[dim](cached response)[/dim]")
+
+    # Add assistant response to messages, noting the substitute if hedging/fallback answered
+    assistant_message = {"role": "assistant", "content": assistant_response}
+    if route.rerouted:
+        assistant_message["model"] = route.model
+    if route.usage:
+        # Includes cached prompt tokens, to check provider prompt caching works
+        assistant_message["usage"] = route.usage
+    _finish_turn(chat, model, assistant_message, query_embedding, user_message_id, vector_store, indexer)
+    metrics.observe("turn_seconds", time.perf_counter() - turn_start)
+    return assistant_response
+
+
+def run_compare_turn(chat, models, user_input, image, vector_store, config, scope="all", indexer=None):
+    """
+    Like run_chat_turn, but the prompt and the context retrieved once for it
+    go to every model in ``models`` at once. The first model's answer
+    continues the chat; every answer, with its time to first token,
+    tokens/s and token count, is kept on the reply under "comparison".
+    """
+    turn_start = time.perf_counter()
+    query_embedding, user_message_id = _begin_turn(chat, models[0], user_input, image, vector_store, scope, indexer)
+    console.print()
+    with span("llm.compare", models=len(models)):
+        streams = fan_out(models, prompt_messages(chat, config.get("system_prompt")), config, console)
+    kept = streams[0]
+    assistant_message = {"role": "assistant", "content": kept.response()}
+    if kept.route.rerouted:
+        assistant_message["model"] = kept.route.model
+    if kept.route.usage:
+        assistant_message["usage"] = kept.route.usage
+    assistant_message["comparison"] = [
+        {"model": stream.route.model, **({} if stream is kept else {"content": stream.response()}),
+         "error": stream.error is not None, **stream.stats()}
+        for stream in streams
+    ]
+    _finish_turn(chat, models[0], assistant_message, query_embedding, user_message_id, vector_store, indexer)
+    metrics.observe("turn_seconds", time.perf_counter() - turn_start)
+    slowest = max(stream.end for stream in streams) - min(stream.start for stream in streams)
+    console.print(f"[dim]({len(streams)} models in {slowest:.1f}s; {kept.title}'s answer continues the chat)[/dim]")
+    return assistant_message["content"]
+
+
+def _begin_turn(chat, model, user_input, image, vector_store, scope, indexer):
+    """
+    Append the user message and retrieve its context. Returns the query
+    embedding and the message's vector store id, both None when the message
+    could not be embedded; the turn then goes ahead without retrieval.
+    """
+    if indexer is not None:
+        try:
+            indexer.wait()  # The previous turn's messages are searchable from here on
+        except (EmbeddingError, ValueError) as e:
+            console.print(f"[red]The previous reply was not indexed: {e}[/red]")
+    chat["messages"].append({
+        "role": "user",
+        "content": user_input,
+        "context_ids": [],  # will be filled later
+        "image": image,  # None if no image buffered
+        "timestamp": datetime.datetime.now().isoformat(),
+    })
+
+    # Retrieve context, skipping messages and blocks the prompt already carries.
+    # Blocks are stored once per chat; the message only references them.
+    # The query embedding is reused as the response cache key.
+    try:
+        query_embedding = vector_store.embed([user_input])
+    except (EmbeddingError, ValueError) as e:
+        console.print(f"[red]Could not embed your message, answering without retrieved context: {e}[/red]")
+        return None, None
+    blocks = get_context_blocks(
+        vector_store, user_input, embeddings=query_embedding,
+        exclude_ids=window_message_ids(chat) | window_context_ids(chat),
+        exclude_hashes=window_text_hashes(chat),
+        **parse_scope(scope, chat),
+    )
+    chat.setdefault("context_blocks", {}).update(blocks)
+    chat["messages"][-1]["context_ids"] = [block_id for block_id, _ in blocks]
+    user_message_id = f"{chat['id']}:{len(chat['messages']) - 1}"
+    if indexer is not None:
+        # Reuses the query embedding; overlaps the LLM request
+        indexer.add(vector_store, user_message_id, user_input, model, embeddings=query_embedding,
+                    timestamp=chat["messages"][-1]["timestamp"])
+    return query_embedding, user_message_id
+
+
+def _finish_turn(chat, model, assistant_message, query_embedding, user_message_id, vector_store, indexer):
+    """
+    Append the reply and index it, plus the user message when there is no
+    BackgroundIndexer. Neither is indexed when the user message could not be
+    embedded, as the embedding backend is down.
+    """
+    assistant_message["timestamp"] = datetime.datetime.now().isoformat()
+    chat["messages"].append(assistant_message)
+    if query_embedding is None:
+        return
+
+    # Add user input and assistant response to vector store for context retrieval
+    # Ensure unique IDs for each message entry in the vector store
+    assistant_message_id = f"{chat['id']}:{len(chat['messages']) - 1}" # ID for the assistant message just added
+    reply_model = assistant_message.get("model", model)
+    if indexer is not None:
+        indexer.add(vector_store, assistant_message_id, assistant_message["content"], reply_model,
+                    timestamp=assistant_message["timestamp"])
+    else:
+        user_message = chat["messages"][-2]
+        with span("vector.add"):
+            vector_store.add_many([(user_message_id, user_message["content"], model, user_message["timestamp"])],
+                                  embeddings=query_embedding)
+        vector_store.add(assistant_message_id, assistant_message["content"], model=reply_model,
+                         timestamp=assistant_message["timestamp"])
+
+
+def resolve_models(names, config):
+    """Full names of ``names``; ValueError for unsupported models or runtimes without keys."""
+    resolved = []
+    for name in names:
+        meta = get_model_metadata(name)
+        runtime = meta.get("runtime", meta["provider"])
+        if not runtime_configured(runtime, config):
+            raise ValueError(f"{meta['full_name']} runs on {runtime}, which is not set up. Run 'localrag config' to set your API keys.")
+        if meta["full_name"] not in resolved:
+            resolved.append(meta["full_name"])
+    return resolved
+
+
+def store_gauges():
+    """(name, labels, value) gauges of the stores on disk, for stats and the Prometheus textfile."""
+    registry = index_registry()
+    name, entry = registry.active()
+    manifest = read_manifest(entry["path"]) or {}
+    partitions = manifest.get("partitions", {})
+    labels = {"index": name, "index_type": manifest.get("index_type", "flat"), "embedding_model": entry["embedding_model"]}
+    chats = sum(1 for f in os.listdir(CHATS_DIR) if f.endswith(".json")) if os.path.isdir(CHATS_DIR) else 0
+    chat_archive = ChatArchive(CHATS_DIR)
+    try:
+        archived = chat_archive.stats()["chats"]
+    finally:
+        chat_archive.close()
+    gauges = [
+        ("vectors", labels, sum((summary or {}).get("count", 0) for summary in partitions.values())),
+        ("vector_partitions", labels, len(partitions)),
+        ("chats", {"tier": "active"}, chats),
+        ("chats", {"tier": "archive"}, archived),
+    ]
+    for index_name, index_entry in registry.data["indexes"].items():
+        gauges.append(("disk_bytes", {"component": "vector_index", "index": index_name}, directory_bytes(index_entry["path"])))
+    gauges.append(("disk_bytes", {"component": "chats"}, directory_bytes(CHATS_DIR)))
+    gauges.append(("disk_bytes", {"component": "response_cache"}, directory_bytes(RESPONSE_CACHE_DIR)))
+    return gauges
+
+
+def flush_metrics():
+    """At exit: add this run's metrics to the totals and refresh the Prometheus textfile if one is configured."""
+    try:
+        config = load_config(CONFIG_PATH)
+        if not config.get("metrics"):
+            return  # Nothing was recorded
+        totals = metrics.flush(METRICS_PATH)
+        if config.get("metrics_textfile"):
+            metrics.write_textfile(os.path.expanduser(config["metrics_textfile"]), totals, store_gauges())
+    except (OSError, ValueError) as e:
+        err_console.print(f"[yellow]Could not save metrics: {e}[/yellow]")
+
+
+def index_registry():
+    return IndexRegistry(LOCALRAG_DIR, VECTOR_STORE_PATH, EMBEDDING_MODEL).load()
+
+
+def _open_store(config, entry):
+    """
+    VectorStore for a registry entry, with its embedding backend, dedup,
+    diversification and thread settings from ``config``.
+    """
+    governor = ResourceGovernor(config)
+    store = VectorStore(
+        entry["path"],
+        entry["embedding_model"],
+        embedding_model=remote_embedder(entry["embedding_model"], config, entry["path"]),
+        dedup=config.get("dedup", True),
+        dedup_similarity=config.get("dedup_similarity"),
+        mmr_lambda=config.get("mmr_lambda"),
+        search_workers=governor.search_workers,
+    )
+    governor.apply()  # After the model load imported torch
+    return store
+
+
+def open_vector_store(config):
+    """
+    The active vector index; follows switches made by 'localrag reindex' in
+    another process. Exits with the reason when the index can't be used with
+    the configured embedding model or the embedding server can't be reached.
+    """
+    try:
+        return ActiveIndex(index_registry(), lambda entry: _open_store(config, entry))
+    except (EmbeddingError, ValueError) as e:
+        err_console.print(f"[red]Could not open the vector index: {e}[/red]")
+        sys.exit(1)
+
+
+@contextlib.contextmanager
+def profiled_turn(chat, show=False):
+    """Group the spans recorded inside the block into one turn when tracing is on."""
+    tracer = tracing.get_tracer()
+    if tracer is None:
+        yield
+        return
+    tracer.start_turn(chat_id=chat["id"], model=chat["model"])
+    try:
+        yield
+    finally:
+        spans, total_ms = tracer.end_turn()
+        if show:
+            console.print(tracing.profile_table(spans, total_ms, title=f"Turn {tracer.turn} profile"))
+
+
+def parse_date(value, end_of_day=False):
+    """ISO timestamp for a --since/--until value: YYYY-MM-DD, or "<N>d" for N days ago."""
+    if value is None:
+        return None
+    if value.endswith("d") and value[:-1].isdigit():
+        return (datetime.datetime.now() - datetime.timedelta(days=int(value[:-1]))).isoformat()
+    try:
+        day = datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}'. Use YYYY-MM-DD or a number of days like 30d.")
+    return f"{day}T23:59:59.999999" if end_of_day else day
+
+
+def search_chats(catalog, vector_store, query, limit, favorite=None, model=None, since=None, until=None):
+    """
+    Up to ``limit`` hits for ``query`` across all chats, fusing the keyword
+    ranking from ``catalog`` with the semantic one from ``vector_store``
+    (skipped when None) by reciprocal rank. Each hit is a dict with
+    message_id, chat_id, position, text and the chat's catalog row.
+    """
+    rankings = [catalog.search(query, limit, favorite=favorite, model=model, since=since, until=until)]
+    if vector_store is not None:
+        # Favorites are filtered afterwards, so fetch extra
+        top_k = limit * 4 if favorite else limit
+        try:
+            with span("search.semantic"):
+                results = vector_store.search(query, top_k=top_k, model=model, since=since, until=until)
+            rankings.append([(message_id, text) for message_id, text, _ in results])
+        except (EmbeddingError, ValueError) as e:
+            err_console.print(f"[red]Semantic search failed, showing keyword matches only: {e}[/red]")
+    scores, texts = {}, {}
+    for ranking in rankings:
+        for rank, (message_id, text) in enumerate(ranking):
+            scores[message_id] = scores.get(message_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            texts.setdefault(message_id, text)
+    chats = catalog.chats({message_chat_id(m) for m in scores}, favorite=favorite)
+    hits = []
+    for message_id in sorted(scores, key=scores.get, reverse=True):
+        chat_id, _, position = message_id.rpartition(":")
+        chat = chats.get(chat_id)
+        # Deleted chats, filtered-out chats and positions past a cleared chat's end
+        if chat is None or not position.isdigit() or int(position) >= (chat["messages"] or 0):
+            continue
+        hits.append({"message_id": message_id, "chat_id": chat_id, "position": int(position),
+                     "text": texts[message_id], "chat": chat})
+    return hits[:limit]
+
+
+def parse_scope(scope: str, chat: dict) -> dict:
+    """
+    Translate a \\scope argument into VectorStore.search filters.
+    "all" searches everything, "chat" only the current chat, "model" only
+    messages from the chat's model and "<N>d" only the last N days.
+    """
+    if scope == "all":
+        return {}
+    if scope == "chat":
+        return {"chat_id": chat["id"]}
+    if scope == "model":
+        return {"model": chat["model"]}
+    if scope.endswith("d") and scope[:-1].isdigit():
+        since = datetime.datetime.now() - datetime.timedelta(days=int(scope[:-1]))
+        return {"since": since.isoformat()}
+    raise ValueError(f"Unknown scope '{scope}'. Use all, chat, model or a number of days like 30d.")
+
+
+def get_relevant_context(vector_store: VectorStore, query: str, chats_dir: str = CHATS_DIR, **filters):
     """
     Searches the vector store for context relevant to the query.
     Returns a formatted string of relevant context.
     """
-    SIMILARITY_THRESHOLD = 0.7
+    return get_relevant_contexts(vector_store, [query], chats_dir, **filters)[0]
 
-    results = vector_store.search(query)
 
-    if not results:
-        return ""
+def get_relevant_contexts(vector_store: VectorStore, queries: list, chats_dir: str = CHATS_DIR, embeddings=None, **filters):
+    """
+    Batch version of get_relevant_context: all queries are embedded and searched
+    in one pass, and each referenced chat file is loaded once.
+    """
+    with span("context.retrieve", queries=len(queries)):
+        chat_cache = {}
+        return [
+            "\n\n".join(text for _, text in _context_blocks(results, chats_dir, SIMILARITY_THRESHOLD, chat_cache))
+            for results in vector_store.search_many(queries, embeddings=embeddings, **filters)
+        ]
+
+
+def get_context_blocks(vector_store: VectorStore, query: str, chats_dir: str = CHATS_DIR, embeddings=None,
+                       exclude_ids=None, exclude_hashes=None, **filters):
+    """
+    Context for one query as (message_id, formatted text) blocks, leaving out
+    ``exclude_ids`` and messages whose text hash is in ``exclude_hashes``.
+    """
+    with span("context.retrieve", queries=1):
+        results = vector_store.search_many([query], embeddings=embeddings, exclude_ids=exclude_ids, **filters)[0]
+        if exclude_hashes:
+            results = [r for r in results if text_hash(r[1]) not in exclude_hashes]
+        return _context_blocks(results, chats_dir, SIMILARITY_THRESHOLD, {})
+
 
+def _context_blocks(results, chats_dir, similarity_threshold, chat_cache):
     context_parts = []
 
     for message_id, text, score in results:
-        if score >= SIMILARITY_THRESHOLD:
+        if score >= similarity_threshold:
             try:
                 chat_id, msg_idx_str = message_id.split(":")
                 msg_idx = int(msg_idx_str)
 
-                chat = load_chat(CHATS_DIR, chat_id)
+                if chat_id not in chat_cache:
+                    chat_cache[chat_id] = load_chat(chats_dir, chat_id)
+                chat = chat_cache[chat_id]
 
                 if chat:
                     speaker = chat["messages"][msg_idx]["role"] if 0 <= msg_idx < len(chat["messages"]) else "unknown"
-                    context_parts.append(f"From chat '{chat.get('title', 'Untitled')}' ({speaker}): {text}")
+                    context_parts.append((message_id, f"From chat '{chat.get('title', 'Untitled')}' ({speaker}): {text}"))
 
             except (ValueError, IndexError) as e:
-                console.print(f"[yellow]Warning: Could not parse message_id '{message_id}' for context retrieval: {e}[/yellow]", file=sys.stderr)
-                context_parts.append(f"From historical context: {text}")
+                err_console.print(f"[yellow]Warning: Could not parse message_id '{message_id}' for context retrieval: {e}[/yellow]")
+                context_parts.append((message_id, f"From historical context: {text}"))
             except Exception as e:
-                 console.print(f"[red]Error retrieving context for message_id '{message_id}': {e}[/red]", file=sys.stderr)
+                 err_console.print(f"[red]Error retrieving context for message_id '{message_id}': {e}[/red]")
 
-    return "\n\n".join(context_parts)
\ No newline at end of file
+    return context_parts
\ No newline at end of file
@@ -4,6 +4,77 @@ import shutil
 from rich.panel import Panel
 from rich.prompt import Prompt
 from .models import list_supported_models
+from .utils import atomic_write_json
+
+# Non-credential settings and their defaults; LOCALRAG_<KEY> env vars override
+# values missing from config.json.
+DEFAULT_SETTINGS = {
+    # Offline "local-stub" runtime used for load tests and benchmarks
+    "stub_first_token_delay": 0.5,
+    "stub_tokens_per_second": 50,
+    "stub_response_tokens": 200,
+    # `localrag ask` batch limits; provider_limits overrides per runtime
+    "ask_concurrency": 8,
+    "provider_concurrency": 4,
+    "provider_requests_per_minute": 0,
+    "provider_limits": {},
+    # Opt-in semantic cache of first-turn answers (see localrag cache)
+    "response_cache": False,
+    "response_cache_threshold": 0.95,
+    "response_cache_ttl_seconds": 7 * 86400,
+    "response_cache_max_entries": 1000,
+    # Routing: hedge a second model when the first token is late (0 = off),
+    # retry on substitutes when a request fails transiently before streaming
+    "hedge_after_seconds": 0,
+    "fallback_on_error": False,
+    "fallback_models": [],
+    "max_fallbacks": 2,
+    # Rolling summary of older turns, built in the background once the
+    # unsummarized history passes the threshold; None = cheapest utility model
+    "summary_enabled": True,
+    "summary_threshold_tokens": 3000,
+    "summary_keep_recent_messages": 6,
+    "summary_max_tokens": 400,
+    "summary_model": None,
+    # Vector store: skip exact/near-duplicate messages at insert (stored as
+    # references) and diversify retrieved context with MMR (1.0 = off)
+    "dedup": True,
+    "dedup_similarity": 0.97,
+    "mmr_lambda": 0.7,
+    # Streaming output: frames per second, and live Markdown rendering
+    "render_fps": 30,
+    "render_markdown": False,
+    # Prompt: optional system instructions (sent first, so they are part of
+    # the provider-cached prefix) and the Anthropic output token limit
+    "system_prompt": "",
+    "max_output_tokens": 4096,
+    # Embedding model 'localrag reindex' migrates to when none is given;
+    # "ollama:<model>" names embed on the Ollama server
+    "embedding_model": "all-MiniLM-L6-v2",
+    # "ollama" serves sentence-transformers indexes from the Ollama server
+    # (ollama_embedding_model, default: its build of the same model) so the
+    # CLI never loads torch; texts per embedding request
+    "embedding_backend": "sentence-transformers",
+    "ollama_embedding_model": None,
+    "embedding_batch_size": 64,
+    # CPU budget (0 = one less than the core count): torch intra-op threads
+    # for embedding, FAISS OpenMP threads (which also set torch's when both
+    # use one OpenMP runtime), partitions searched in parallel, and
+    # background workers embedding/indexing messages during streaming
+    "embedding_threads": 0,
+    "faiss_threads": 0,
+    "search_workers": 0,
+    "index_workers": 1,
+    "tokenizers_parallelism": False,
+    # Latency, cache and error metrics saved to metrics.json at exit (see
+    # localrag stats), and an optional Prometheus textfile (.prom) refreshed
+    # with them for node_exporter's textfile collector
+    "metrics": True,
+    "metrics_textfile": None,
+    # Days a chat goes untouched before 'localrag archive' packs it into the
+    # compressed archive (resuming it moves it back)
+    "archive_after_days": 90,
+}
 
 def ensure_config_exists(config_path):
     if not os.path.exists(config_path):
@@ -18,9 +89,13 @@ def ensure_config_exists(config_path):
         with open(config_path, 'w') as f:
             json.dump(default_config, f, indent=2)
 
-def load_config(config_path):
+def read_config_file(config_path):
+    """The settings saved in config.json, without defaults or environment values."""
     with open(config_path, 'r') as f:
-        config = json.load(f)
+        return json.load(f)
+
+def load_config(config_path):
+    config = read_config_file(config_path)
     
     config["OPENAI_API_KEY"] = config.get("OPENAI_API_KEY") or os.environ.get("OPENAI_API_KEY")
     config["ANTHROPIC_API_KEY"] = config.get("ANTHROPIC_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
@@ -29,16 +104,38 @@ def load_config(config_path):
     config["OLLAMA_BASE_URL"] = config.get("OLLAMA_BASE_URL") or os.environ.get("OLLAMA_BASE_URL")
     if config["OLLAMA_BASE_URL"] and not shutil.which("ollama"):
         config["OLLAMA_BASE_URL"] = None
+
+    for key, default in DEFAULT_SETTINGS.items():
+        if config.get(key) is None:
+            env_value = os.environ.get(f"LOCALRAG_{key.upper()}")
+            config[key] = _parse_setting(env_value, default) if env_value is not None else default
     
     return config
 
 
+def _parse_setting(value, default):
+    """Convert an environment variable string to the type of the setting's default."""
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, (dict, list)):
+        return json.loads(value)
+    if default is None:
+        return value
+    return type(default)(value)
+
+
 def save_config(config_path, config):
-    with open(config_path, 'w') as f:
-        json.dump(config, f, indent=2)  
+    """
+    Save settings read with read_config_file(). Settings equal to their
+    default are left out, so later changes to the defaults still apply.
+    """
+    config = {key: value for key, value in config.items()
+              if key not in DEFAULT_SETTINGS or value != DEFAULT_SETTINGS[key]}
+    atomic_write_json(config_path, config, indent=2)
 
 def configure_api_keys(config_path, console):
-    config = load_config(config_path)
+    # Only what the user sets here is saved; defaults and environment values are applied by load_config
+    config = read_config_file(config_path)
     console.print(Panel.fit("LocalRAG Configuration", style="bold green"))
     console.print("Set your API keys for different LLM providers.")
     console.print("Leave blank to keep existing keys.\n")
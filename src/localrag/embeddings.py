@@ -0,0 +1,99 @@
+import numpy as np
+from .vectorstore import read_manifest
+
+OLLAMA_PREFIX = "ollama:"
+# Ollama builds of sentence-transformers models, used to serve an index built
+# in-process from Ollama instead (embedding_backend "ollama")
+OLLAMA_EQUIVALENTS = {
+    "all-MiniLM-L6-v2": "all-minilm:l6-v2",
+    "all-MiniLM-L12-v2": "all-minilm:l12-v2",
+}
+
+
+class EmbeddingError(Exception):
+    """The embedding server could not be reached or returned no embeddings."""
+
+
+class OllamaEmbedder:
+    """
+    Embeds texts with an Ollama server's /api/embed endpoint, ``batch_size``
+    texts per request over one pooled HTTP session, so the process never
+    loads torch. Has the SentenceTransformer ``encode`` /
+    ``get_sentence_embedding_dimension`` interface VectorStore uses.
+    """
+
+    def __init__(self, model, base_url, batch_size=64, timeout=120.0):
+        import requests
+        self.model = model
+        self.url = base_url.rstrip("/") + "/api/embed"
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.dimension = None
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        """Embed a list of texts into a (len(texts), dimension) float32 array."""
+        texts = list(texts)
+        batch_size = batch_size or self.batch_size
+        rows = []
+        for start in range(0, len(texts), batch_size):
+            rows.extend(self._embed(texts[start:start + batch_size]))
+        if not rows:
+            return np.zeros((0, self.dimension or 0), dtype='float32')
+        embeddings = np.asarray(rows, dtype='float32')
+        self.dimension = embeddings.shape[1]
+        return embeddings
+
+    def _embed(self, batch):
+        import requests
+        try:
+            response = self.session.post(self.url, json={"model": self.model, "input": batch}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise EmbeddingError(f"Could not reach Ollama at {self.url}: {e}") from e
+        if response.status_code == 404 and "not found" in response.text and "model" in response.text:
+            raise EmbeddingError(f"Ollama has no model '{self.model}'. Run 'ollama pull {self.model}'.")
+        if response.status_code != 200:
+            raise EmbeddingError(f"Ollama embedding with {self.model} failed ({response.status_code}): {response.text[:200]}")
+        embeddings = response.json().get("embeddings") or []
+        if len(embeddings) != len(batch):
+            raise EmbeddingError(f"Ollama returned {len(embeddings)} embeddings for {len(batch)} texts.")
+        return embeddings
+
+    def get_sentence_embedding_dimension(self):
+        if self.dimension is None:
+            self.encode(["dimension probe"])
+        return self.dimension
+
+
+def remote_embedder(model_name, config, vector_store_path=None):
+    """
+    The embedder for an index built with ``model_name`` when it does not run
+    in-process, else None (VectorStore then loads sentence-transformers).
+    "ollama:<model>" names always embed on Ollama; with ``embedding_backend``
+    "ollama", other models are served by ``ollama_embedding_model`` or
+    Ollama's build of the same model. The Ollama model's dimension is
+    checked against the index at ``vector_store_path``.
+    """
+    if model_name and model_name.startswith(OLLAMA_PREFIX):
+        ollama_model = model_name[len(OLLAMA_PREFIX):]
+    elif config.get("embedding_backend", "sentence-transformers") == "ollama":
+        ollama_model = config.get("ollama_embedding_model") or OLLAMA_EQUIVALENTS.get(model_name)
+        if not ollama_model:
+            raise ValueError(
+                f"No Ollama build of {model_name} is known. Set \"ollama_embedding_model\" in config.json, "
+                f"or run 'localrag reindex ollama:<model>' to re-embed with an Ollama model."
+            )
+    else:
+        return None
+    if not config.get("OLLAMA_BASE_URL"):
+        raise ValueError("Embedding with Ollama needs a running Ollama server. Install it from https://ollama.com/ and run 'localrag config'.")
+    embedder = OllamaEmbedder(ollama_model, config["OLLAMA_BASE_URL"], batch_size=config.get("embedding_batch_size", 64))
+    manifest = read_manifest(vector_store_path) if vector_store_path else None
+    dim = ((manifest or {}).get("embedding") or {}).get("dim")
+    if dim is not None and dim != embedder.get_sentence_embedding_dimension():
+        raise ValueError(
+            f"Vector store '{vector_store_path}' holds {dim}-dim vectors from {model_name}, but Ollama's "
+            f"{ollama_model} returns {embedder.dimension} dims. Set \"ollama_embedding_model\" to an Ollama build "
+            f"of {model_name}, or run 'localrag reindex {OLLAMA_PREFIX}{ollama_model}' to re-embed with it."
+        )
+    return embedder
@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import datetime
+from .utils import atomic_write_json, file_lock
+from .vectorstore import message_chat_id
+from .tracing import span
+
+REGISTRY_FILE = "indexes.json"
+DUAL_WRITE_LOG = "dual_write.jsonl"
+
+
+def index_name(model):
+    """Directory-safe index name for an embedding model, e.g. 'nomic-embed-text-20250101-120000'."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "-", model).strip("-")
+    return f"{slug}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+
+class IndexRegistry:
+    """
+    Side-by-side vector indexes under ``root``, one per embedding model, and
+    which one is active. While a re-embedding migration runs, ``migration``
+    names the index being built; chat sessions log new messages for it and
+    the migration switches ``active`` over once it has caught up.
+    """
+
+    def __init__(self, root, default_path, default_model):
+        self.root = root
+        self.default_path = default_path
+        self.default_model = default_model
+        self.data = None
+        self.mtime = None
+
+    @property
+    def path(self):
+        return os.path.join(self.root, REGISTRY_FILE)
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.root, REGISTRY_FILE + ".lock")
+
+    def lock(self):
+        return file_lock(self.lock_path)
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+            self.mtime = os.path.getmtime(self.path)
+        else:
+            # The store from before versioned indexes becomes the first entry
+            self.data = {"active": "default", "migration": None, "indexes": {
+                "default": {"path": self.default_path, "embedding_model": self.default_model,
+                            "created_at": datetime.datetime.now().isoformat()},
+            }}
+            self.mtime = None
+        return self
+
+    def changed(self):
+        """True when another process rewrote the registry since load()."""
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return False
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        atomic_write_json(self.path, self.data, indent=2)
+        self.mtime = os.path.getmtime(self.path)
+
+    def active(self):
+        name = self.data["active"]
+        return name, self.data["indexes"][name]
+
+    def migration(self):
+        """(name, entry) of the index being built, or None."""
+        name = self.data.get("migration")
+        return (name, self.data["indexes"][name]) if name else None
+
+    def start_migration(self, model):
+        """Register a new index for ``model`` and mark it as the migration target."""
+        name = index_name(model)
+        self.data["indexes"][name] = {
+            "path": os.path.join(self.root, "indexes", name),
+            "embedding_model": model,
+            "created_at": datetime.datetime.now().isoformat(),
+        }
+        self.data["migration"] = name
+        self.save()
+        return name, self.data["indexes"][name]
+
+    def finish_migration(self):
+        """Make the migration target the active index."""
+        name = self.data["migration"]
+        self.data["previous"] = self.data["active"]
+        self.data["active"] = name
+        self.data["migration"] = None
+        self.data["indexes"][name]["completed_at"] = datetime.datetime.now().isoformat()
+        self.save()
+
+    def abort_migration(self):
+        self.data["migration"] = None
+        self.save()
+
+    def activate(self, name):
+        if name not in self.data["indexes"]:
+            raise ValueError(f"Unknown index '{name}'")
+        self.data["active"] = name
+        self.save()
+
+
+def dual_write_log_path(entry):
+    return os.path.join(entry["path"], DUAL_WRITE_LOG)
+
+
+class ActiveIndex:
+    """
+    The active VectorStore, following registry changes made by other
+    processes. During a migration, every add is also appended to the target
+    index's dual-write log so the new index misses nothing.
+    ``open_store(entry)`` builds a VectorStore for a registry entry.
+    """
+
+    def __init__(self, registry, open_store):
+        self.registry = registry.load()
+        self.open_store = open_store
+        self.name = None
+        self.store = None
+        self._refresh(force=True)
+
+    def _refresh(self, force=False):
+        if not force and not self.registry.changed():
+            return
+        if not force:
+            self.registry.load()
+        name, entry = self.registry.active()
+        if name != self.name:
+            self.store = self.open_store(entry)
+            self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.store, attr)
+
+    def embed(self, texts):
+        # Switch at turn boundaries: a turn embeds first, then searches with that embedding
+        self._refresh()
+        return self.store.embed(texts)
+
+    def add(self, message_id, text, model=None, timestamp=None):
+        with span("vector.add"):
+            self.add_many([(message_id, text, model, timestamp)])
+
+    def add_many(self, entries, batch_size=256, embeddings=None):
+        now = datetime.datetime.now().isoformat()
+        entries = [(m, text, model, ts or now) for m, text, model, ts in entries]
+        os.makedirs(self.registry.root, exist_ok=True)
+        with self.registry.lock():
+            name = self.name
+            self._refresh()
+            if self.name != name:
+                embeddings = None  # Computed with the previous index's model
+            migration = self.registry.migration()
+            if migration:
+                path = dual_write_log_path(migration[1])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'a') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + "\n")
+        self.store.add_many(entries, batch_size, embeddings=embeddings)
+
+
+def known_ids(store):
+    """Every message id in ``store``, duplicates stored as aliases included."""
+    ids = set()
+    for partition in store.partitions.values():
+        partition.load()
+        ids.update(partition.ids)
+        ids.update(a for aliases in partition.aliases.values() for a in aliases)
+    return ids
+
+
+def source_entries(source, load_chat):
+    """
+    Every message in ``source`` as (message_id, text, model, timestamp),
+    including duplicates stored as aliases (their text comes from the chat).
+    """
+    for partition in source.partitions.values():
+        partition.load()
+        for i, message_id in enumerate(partition.ids):
+            model, timestamp = partition.models[i], partition.timestamps[i]
+            yield message_id, partition.texts[i], model, timestamp
+            for alias_id in partition.aliases.get(i, ()):
+                chat = load_chat(message_chat_id(alias_id))
+                try:
+                    text = chat["messages"][int(alias_id.rsplit(":", 1)[1])]["content"]
+                except (TypeError, ValueError, IndexError, KeyError):
+                    text = partition.texts[i]
+                yield alias_id, text, model, timestamp
+
+
+def run_migration(registry, source, target, load_chat, batch_size=512, progress=None):
+    """
+    Re-embed every message of ``source`` into ``target``, then drain the
+    dual-write log and switch the registry over under the registry lock.
+    Safe to re-run after an interruption: ids already in ``target`` are skipped.
+    ``progress(done, total)`` is called after each batch.
+    """
+    done_ids = known_ids(target)
+    log_path = dual_write_log_path(registry.migration()[1])
+    log_offset = 0
+
+    def drain_log():
+        nonlocal log_offset
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, 'rb') as f:
+            f.seek(log_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a line being appended right now waits for the next drain
+        log_offset += end
+        entries = [tuple(json.loads(line)) for line in data[:end].splitlines() if line.strip()]
+        add([e for e in entries if e[0] not in done_ids])
+
+    def add(entries):
+        for start in range(0, len(entries), batch_size):
+            chunk = entries[start:start + batch_size]
+            target.add_many(chunk, batch_size)
+            done_ids.update(e[0] for e in chunk)
+
+    total = 0
+    for partition in source.partitions.values():
+        partition.load()
+        total += partition.count + sum(len(a) for a in partition.aliases.values())
+    pending = []
+    done = 0
+    for entry in source_entries(source, load_chat):
+        done += 1
+        if entry[0] not in done_ids:
+            pending.append(entry)
+        if len(pending) >= batch_size:
+            add(pending)
+            pending = []
+            drain_log()
+            if progress:
+                progress(done, total)
+    add(pending)
+    drain_log()
+    with registry.lock():
+        registry.load()
+        drain_log()
+        registry.finish_migration()
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    if progress:
+        progress(done, total)
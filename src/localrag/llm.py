@@ -1,12 +1,13 @@
-import sys
+import queue
 import base64
 import threading
 import time
-from openai import OpenAI
 from rich.console import Console
-from ollama import chat as ollama_chat
-from .models import get_model_metadata
-from .utils import ensure_ollama_model
+from .models import get_model_metadata, get_substitute_models
+from .utils import ensure_ollama_model, estimate_tokens
+from .tracing import record
+from . import metrics
+from .render import StreamRenderer, ComparePanes
 
 def get_chat_title(messages, config, config_path):
     """
@@ -14,6 +15,8 @@ def get_chat_title(messages, config, config_path):
     Prioritizes Ollama for cost savings, then falls back to proprietary models.
     Falls back to first user message if all else fails.
     """
+    from openai import OpenAI
+    from ollama import chat as ollama_chat
     console = Console()
 
     if len(messages) < 2:
@@ -116,14 +119,65 @@ def get_chat_title(messages, config, config_path):
     first_message_content = messages[0]["content"]
     # return (first_message_content[:30] + "...") if len(first_message_content) > 30 else first_message_content
     return first_message_content
+
+def complete_with_utility_model(system_prompt, content, config, max_tokens=512, model=None):
+    """
+    Single-shot completion for housekeeping tasks (summaries). Uses ``model``
+    if given, otherwise the same cheap-model order as title generation:
+    local Ollama first, then the small proprietary models. Returns None if no
+    model is available or every attempt fails.
+    """
+    from openai import OpenAI
+    from ollama import chat as ollama_chat
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": content}]
+    if model:
+        try:
+            return "".join(open_stream(model, messages, config)).strip() or None
+        except Exception:
+            return None
+
+    candidates = []
+    if config.get("OLLAMA_BASE_URL"):
+        candidates.append(("ollama", "llama3.2:1b", None))
+    if config.get("OPENAI_API_KEY"):
+        candidates.append(("openai", "gpt-4o-mini", OpenAI(api_key=config["OPENAI_API_KEY"])))
+    if config.get("ANTHROPIC_API_KEY"):
+        candidates.append(("openai", "claude-3-5-haiku-latest", OpenAI(api_key=config["ANTHROPIC_API_KEY"], base_url="https://api.anthropic.com/v1/")))
+    if config.get("GOOGLE_API_KEY"):
+        candidates.append(("openai", "gemini-1.5-flash", OpenAI(api_key=config["GOOGLE_API_KEY"], base_url="https://generativelanguage.googleapis.com/v1beta/openai/")))
+    if config.get("XAI_API_KEY"):
+        candidates.append(("openai", "grok-3-mini-beta", OpenAI(api_key=config["XAI_API_KEY"], base_url="https://api.x.ai/v1/")))
+
+    for kind, candidate, client in candidates:
+        try:
+            if kind == "ollama":
+                if not ensure_ollama_model(candidate, Console(quiet=True)):
+                    continue
+                text = ollama_chat(model=candidate, messages=messages).message.content
+            else:
+                response = client.chat.completions.create(model=candidate, messages=messages, max_tokens=max_tokens)
+                text = response.choices[0].message.content
+            if text and text.strip():
+                return text.strip()
+        except Exception:
+            continue
+    return None
+
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
-def send_message_to_llm(model, messages, config, context="", console=None):
-    """
-    Send a message to the correct LLM (OpenAI or Anthropic) based on model.
-    """
+class LLMError(Exception):
+    """A request that cannot be sent (missing key, unsupported runtime)."""
+
+
+def is_error_response(response):
+    """True for the error strings send_message_to_llm returns instead of an answer."""
+    return response.startswith("Error: ") or response.startswith("Error during LLM call: ")
+
+
+def format_messages(messages):
+    """Convert chat messages to the OpenAI-style list sent to every runtime."""
     formatted_messages = []
     for msg in messages:
         if msg["role"] == "user":
@@ -137,114 +191,556 @@ def send_message_to_llm(model, messages, config, context="", console=None):
                     ]
                 })
             else:
-                content = f"(Relevant context: {msg.get('context', '')})\n\n{msg['content']}"
+                # Context goes after the question so each turn renders the same
+                # way when it is later part of the (cacheable) history
+                content = msg["content"]
+                if msg.get("context"):
+                    content = f"{content}\n\n(Relevant context: {msg['context']})"
                 formatted_messages.append({"role": "user", "content": content})
+        elif msg["role"] == "system":
+            formatted_messages.append({"role": "system", "content": msg["content"]})
         else:
             formatted_messages.append({"role": "assistant", "content": msg["content"]})
+    return formatted_messages
 
 
-    full_response = ""
-    spinner_thread = None
-    stop_spinner = threading.Event()
+def open_stream(model, formatted_messages, config, usage=None):
+    """
+    Return a generator of response text chunks from the model's runtime.
+    Raises LLMError when the runtime can't be used; the request itself is
+    only sent once the generator is iterated. Token counts the runtime
+    reports (input, cached, cache writes, output) are stored in ``usage``.
+    """
+    usage = {} if usage is None else usage
+    model_meta = get_model_metadata(model)
+    # provider = company that trained the model
+    provider = model_meta.get("provider")
+    # runtime: how to execute the model (SDK or service)
+    runtime = model_meta.get("runtime", provider)
 
-    def spinner_animation():
-        spinner = "|/-\\"
-        i = 0
-        while not stop_spinner.is_set():
-            sys.stdout.write("\r" + spinner[i % len(spinner)] + " Generating...")
-            sys.stdout.flush()
-            i += 1
-            time.sleep(0.1)
-        sys.stdout.write("\r")
-        sys.stdout.flush()
+    # OpenAI runtime via OpenAI Python SDK
+    if runtime == "OpenAI":
+        if not config.get("OPENAI_API_KEY"):
+            raise LLMError("Error: OpenAI API key not set. Run 'localrag config'.")
+        from openai import OpenAI
+        client = OpenAI(api_key=config["OPENAI_API_KEY"])
 
-    try:
-        model_meta = get_model_metadata(model)
-        # provider = company that trained the model
-        provider = model_meta.get("provider")
-        # runtime: how to execute the model (SDK or service)
-        runtime = model_meta.get("runtime", provider)
-        client = None
-
-        # OpenAI runtime via OpenAI Python SDK
-        if runtime == "OpenAI":
-            if not config.get("OPENAI_API_KEY"):
-                return "Error: OpenAI API key not set. Run 'localrag config'."
-            client = OpenAI(api_key=config["OPENAI_API_KEY"])
+    # Anthropic runtime via the Anthropic SDK, which supports cache_control markers
+    elif runtime == "Anthropic":
+        if not config.get("ANTHROPIC_API_KEY"):
+            raise LLMError("Error: Anthropic API key not set. Run 'localrag config'.")
+        from anthropic import Anthropic
+        client = Anthropic(api_key=config["ANTHROPIC_API_KEY"])
+        return _anthropic_stream(client, model, formatted_messages, config, usage)
 
-        # Anthropic runtime via OpenAI Python SDK with Anthropic endpoint
-        elif runtime == "Anthropic":
-            if not config.get("ANTHROPIC_API_KEY"):
-                return "Error: Anthropic API key not set. Run 'localrag config'."
-            client = OpenAI(api_key=config["ANTHROPIC_API_KEY"], base_url="https://api.anthropic.com/v1/")
-        
-        elif runtime == "Google":
-            if not config.get("GOOGLE_API_KEY"):
-                return "Error: Gemini API key not set. Run 'localrag config'."
-            client = OpenAI(api_key=config["GOOGLE_API_KEY"], base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
-        
-        elif runtime == "xAI":
-            if not config.get("XAI_API_KEY"):
-                return "Error: xAI API key not set. Run 'localrag config'."
-            client = OpenAI(api_key=config["XAI_API_KEY"], base_url="https://api.x.ai/v1/")
+    elif runtime == "Google":
+        if not config.get("GOOGLE_API_KEY"):
+            raise LLMError("Error: Gemini API key not set. Run 'localrag config'.")
+        from openai import OpenAI
+        client = OpenAI(api_key=config["GOOGLE_API_KEY"], base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
 
-        # Ollama runtime via Ollama Python SDK
-        elif runtime == "Ollama":
-            # Start streaming via Ollama
-            if console:
-                spinner_thread = threading.Thread(target=spinner_animation)
-                spinner_thread.start()
-            response = ollama_chat(model=model, messages=formatted_messages, stream=True)
-            for chunk in response:
-                content = chunk["message"]["content"]
-                if content:
-                    if not full_response and console:
-                        stop_spinner.set()
-                        if spinner_thread:
-                            spinner_thread.join()
-                        console.print("\r", end="")
-                    full_response += content
-                    if console:
-                        console.print(content, end="", highlight=False)
-                    sys.stdout.flush()
-            return full_response
+    elif runtime == "xAI":
+        if not config.get("XAI_API_KEY"):
+            raise LLMError("Error: xAI API key not set. Run 'localrag config'.")
+        from openai import OpenAI
+        client = OpenAI(api_key=config["XAI_API_KEY"], base_url="https://api.x.ai/v1/")
+
+    # Ollama runtime via Ollama Python SDK
+    elif runtime == "Ollama":
+        return _ollama_stream(model, formatted_messages)
+
+    # Built-in offline stub for load tests and benchmarks
+    elif runtime == "Stub":
+        return stub_stream(formatted_messages, config)
+
+    else:
+        raise LLMError(f"Error: Unsupported runtime '{runtime}' for model '{model}'.")
+
+    return _openai_stream(client, model, formatted_messages, usage, include_usage=runtime == "OpenAI")
+
+
+RUNTIME_KEYS = {
+    "OpenAI": "OPENAI_API_KEY",
+    "Anthropic": "ANTHROPIC_API_KEY",
+    "Google": "GOOGLE_API_KEY",
+    "xAI": "XAI_API_KEY",
+    "Ollama": "OLLAMA_BASE_URL",
+}
 
-        else:
-            return f"Error: Unsupported runtime '{runtime}' for model '{model}'."
 
-        # Send streaming request
-        response = client.chat.completions.create(
-            model=model,
-            messages=formatted_messages,
-            stream=True
+def runtime_configured(runtime, config):
+    """True when the runtime has the credentials/endpoint it needs."""
+    if runtime == "Stub":
+        return True
+    return bool(config.get(RUNTIME_KEYS.get(runtime, "")))
+
+
+def fallback_models(model, config, vision=False):
+    """
+    Ordered substitutes for ``model``: the configured ``fallback_models`` if
+    set, otherwise get_substitute_models(), limited to configured runtimes
+    and, with ``vision``, to models that accept images.
+    """
+    names = config.get("fallback_models") or get_substitute_models(model, vision)
+    substitutes = []
+    for name in names:
+        try:
+            meta = get_model_metadata(name)
+        except ValueError:
+            continue
+        if meta["full_name"] == get_model_metadata(model)["full_name"] or meta["full_name"] in substitutes:
+            continue
+        if vision and not meta["vision"]:
+            continue
+        if runtime_configured(meta.get("runtime", meta["provider"]), config):
+            substitutes.append(meta["full_name"])
+    return substitutes[:config.get("max_fallbacks", 2)]
+
+
+def is_transient_error(error):
+    """
+    True for failures another attempt may not hit: timeouts, connection
+    errors, rate limits (429) and server errors (5xx). Auth, bad-request and
+    other 4xx errors fail the same way on every model.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # SDK errors without a status: openai/anthropic APIConnectionError and
+    # APITimeoutError, httpx and requests timeouts and connection errors
+    return any(word in cls.__name__ for cls in type(error).__mro__ for word in ("Timeout", "Connection", "Connect"))
+
+
+def _has_images(formatted_messages):
+    return any(isinstance(m.get("content"), list) and any(part.get("type") == "image_url" for part in m["content"])
+               for m in formatted_messages)
+
+
+class Route:
+    """Which model ended up answering a routed request, and why."""
+
+    def __init__(self, model):
+        self.requested = model
+        self.model = model
+        self.events = []
+        self.usage = {}
+
+    @property
+    def rerouted(self):
+        return self.model != self.requested
+
+
+def routed_stream(model, formatted_messages, config, route=None):
+    """
+    Stream from ``model`` under the configured routing policy:
+    - ``hedge_after_seconds``: if no token arrives by then, also ask the first
+      substitute and stream whichever answers first, cancelling the other;
+    - ``fallback_on_error``: if a request fails transiently before its first
+      token, retry on the next substitute.
+    Substitutes must accept images when the messages carry any.
+    """
+    route = route or Route(model)
+    substitutes = []
+    if config.get("fallback_on_error") or config.get("hedge_after_seconds"):
+        substitutes = fallback_models(model, config, vision=_has_images(formatted_messages))
+    if config.get("hedge_after_seconds") and substitutes:
+        return _hedged_stream(model, formatted_messages, config, route, substitutes)
+    return _fallback_stream(model, formatted_messages, config, route, substitutes)
+
+
+def _fallback_stream(model, formatted_messages, config, route, substitutes):
+    candidates = [model] + (substitutes if config.get("fallback_on_error") else [])
+    for i, candidate in enumerate(candidates):
+        started = False
+        usage = {}
+        try:
+            for content in open_stream(candidate, formatted_messages, config, usage):
+                started = True
+                yield content
+            route.model = candidate
+            route.usage = usage
+            return
+        except Exception as e:
+            if started or i == len(candidates) - 1 or not is_transient_error(e):
+                raise
+            route.events.append(f"{candidate} failed ({e}); falling back to {candidates[i + 1]}")
+            route.model = candidates[i + 1]
+
+
+class _Attempt:
+    """One model request streaming chunks into a shared queue from its own thread."""
+
+    def __init__(self, model, formatted_messages, config, events):
+        self.model = model
+        self.usage = {}
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, args=(formatted_messages, config, events), daemon=True
         )
+        self.thread.start()
+
+    def _run(self, formatted_messages, config, events):
+        try:
+            stream = open_stream(self.model, formatted_messages, config, self.usage)
+            for content in stream:
+                if self.cancelled.is_set():
+                    stream.close()
+                    return
+                if content:
+                    events.put((self, "chunk", content))
+            events.put((self, "done", None))
+        except Exception as e:
+            events.put((self, "error", e))
+
+
+def _hedged_stream(model, formatted_messages, config, route, substitutes):
+    events = queue.Queue()
+    substitutes = list(substitutes)
+    active = [_Attempt(model, formatted_messages, config, events)]
+    hedge_at = time.monotonic() + float(config["hedge_after_seconds"])
+    winner = None
+
+    def start_next(reason):
+        attempt = _Attempt(substitutes.pop(0), formatted_messages, config, events)
+        route.events.append(f"{reason}; asked {attempt.model}")
+        active.append(attempt)
+
+    try:
+        while True:
+            timeout = None
+            if winner is None and hedge_at is not None:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            try:
+                attempt, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                hedge_at = None
+                if substitutes:
+                    start_next(f"no first token from {model} after {config['hedge_after_seconds']}s")
+                continue
+
+            if attempt.cancelled.is_set():
+                continue
+            if kind == "error":
+                active.remove(attempt)
+                if attempt is winner:
+                    raise payload
+                if active:
+                    continue  # another attempt may still answer
+                if config.get("fallback_on_error") and substitutes and is_transient_error(payload):
+                    hedge_at = None
+                    start_next(f"{attempt.model} failed ({payload})")
+                    continue
+                raise payload
+
+            if winner is None:
+                winner = attempt
+                route.model = attempt.model
+                for other in active:
+                    if other is not attempt:
+                        other.cancelled.set()
+            if kind == "done":
+                route.usage = attempt.usage
+                return
+            yield payload
+    finally:
+        for attempt in active:
+            attempt.cancelled.set()
+
+
+def observe_request(route, outcome, seconds, first_token_seconds=None):
+    """Record a finished LLM request ("ok" or "error") in the metrics, labelled by runtime and model."""
+    try:
+        meta = get_model_metadata(route.model)
+        provider = meta.get("runtime", meta["provider"])
+    except ValueError:
+        provider = "unknown"
+    labels = {"provider": provider, "model": route.model}
+    metrics.inc("llm_requests_total", outcome=outcome, **labels)
+    metrics.observe("llm_request_seconds", seconds, **labels)
+    if first_token_seconds is not None:
+        metrics.observe("llm_first_token_seconds", first_token_seconds, **labels)
+    if route.rerouted:
+        metrics.inc("llm_reroutes_total", **labels)
+
+
+def send_message_to_llm(model, messages, config, context="", console=None, route=None):
+    """
+    Send a message to the correct LLM (OpenAI or Anthropic) based on model.
+    Hedging and fallback follow the routing policy in ``config``; pass a
+    Route to learn which model actually answered.
+    """
+    formatted_messages = format_messages(messages)
+    route = route or Route(model)
+
+    parts = []
+    renderer = None
+    request_start = time.perf_counter()
+    first_token_at = None
+    outcome = "error"
+
+    try:
+        stream = routed_stream(model, formatted_messages, config, route)
 
         if console:
-            spinner_thread = threading.Thread(target=spinner_animation)
-            spinner_thread.start()
+            renderer = StreamRenderer(
+                console,
+                fps=config.get("render_fps", 30),
+                markdown=config.get("render_markdown", False),
+            ).start()
 
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                if not full_response and console:
-                    stop_spinner.set()
-                    if spinner_thread:
-                        spinner_thread.join()
-                    console.print("\r", end="")
-
-                content = chunk.choices[0].delta.content
-                full_response += content
-                if console:
-                    console.print(content, end="", highlight=False)
-                sys.stdout.flush()
+        for content in stream:
+            if not content:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                record("llm.first_token", request_start, first_token_at, model=model)
+            parts.append(content)
+            if renderer:
+                renderer.feed(content)
+        outcome = "ok"
+
+    except LLMError as e:
+        return str(e)
 
     except Exception as e:
         return f"Error during LLM call: {str(e)}"
 
     finally:
-        stop_spinner.set()
-        if spinner_thread and spinner_thread.is_alive():
-            spinner_thread.join()
+        if renderer:
+            renderer.close()
         if console:
             console.print()  # Final newline after response
+            for event in route.events:
+                console.print(f"[dim]({event})[/dim]")
+        if first_token_at is not None:
+            record("llm.stream", first_token_at, time.perf_counter(), model=model, chunks=len(parts),
+                   frames=renderer.frames if renderer else 0)
+        request_end = time.perf_counter()
+        record("llm.request", request_start, request_end, model=route.model, **route.usage)
+        observe_request(route, outcome, request_end - request_start,
+                        first_token_at - request_start if first_token_at is not None else None)
+
+    return "".join(parts)
+
+
+def generation_stats(start, first_token_at, end, text, usage=None):
+    """
+    Time to first token, total time, output tokens and tokens per second
+    (after the first token) of one streamed answer. Output tokens come from
+    the provider's usage when it reports them, else are estimated from the text.
+    """
+    tokens = (usage or {}).get("output_tokens")
+    stats = {
+        "ttft_s": round(first_token_at - start, 4) if first_token_at is not None else None,
+        "total_s": round(end - start, 4),
+        "output_tokens": tokens if tokens is not None else estimate_tokens(text),
+        "tokens_estimated": tokens is None,
+        "tokens_per_s": None,
+    }
+    if first_token_at is not None and end > first_token_at:
+        stats["tokens_per_s"] = round(stats["output_tokens"] / (end - first_token_at), 1)
+    return stats
+
+
+class ModelStream:
+    """One model's answer to a fanned-out prompt, streamed on its own thread under the routing policy."""
+
+    def __init__(self, model, formatted_messages, config):
+        self.route = Route(model)
+        self.chunks = []
+        self.error = None
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.end = None
+        self.thread = threading.Thread(target=self._run, args=(formatted_messages, config), daemon=True)
+        self.thread.start()
+
+    def _run(self, formatted_messages, config):
+        try:
+            for content in routed_stream(self.route.requested, formatted_messages, config, self.route):
+                if content:
+                    with self.lock:
+                        self.first_token_at = self.first_token_at or time.perf_counter()
+                        self.chunks.append(content)
+        except LLMError as e:
+            self.error = str(e)
+        except Exception as e:
+            self.error = f"Error during LLM call: {str(e)}"
+        finally:
+            self.end = time.perf_counter()
+            record("llm.request", self.start, self.end, model=self.route.model, **self.route.usage)
+            observe_request(self.route, "error" if self.error else "ok", self.end - self.start,
+                            self.first_token_at - self.start if self.first_token_at is not None else None)
+
+    @property
+    def title(self):
+        if self.route.rerouted:
+            return f"{self.route.requested} -> {self.route.model}"
+        return self.route.model
+
+    def text(self):
+        with self.lock:
+            return "".join(self.chunks)
+
+    def response(self):
+        """The answer, or the error string send_message_to_llm would have returned."""
+        return self.error or self.text()
+
+    def stats(self):
+        return generation_stats(self.start, self.first_token_at, self.end or time.perf_counter(),
+                                self.text(), self.route.usage)
+
+    def status(self):
+        if self.error:
+            return "error"
+        if self.first_token_at is None:
+            return "waiting..."
+        stats = self.stats()
+        tokens = f"{'~' if stats['tokens_estimated'] else ''}{stats['output_tokens']} tok"
+        rate = f"{stats['tokens_per_s']:.0f} tok/s" if stats["tokens_per_s"] else "-"
+        return f"TTFT {stats['ttft_s']:.2f}s, {rate}, {tokens}"
+
+
+def fan_out(models, messages, config, console=None):
+    """
+    Send the same messages to every model in ``models`` at once and wait for
+    all of them, so the wall-clock time is that of the slowest. With a
+    console the answers stream into side-by-side panes. Returns one
+    ModelStream per model, in order.
+    """
+    formatted_messages = format_messages(messages)
+    streams = [ModelStream(model, formatted_messages, config) for model in models]
+    panes = ComparePanes(console, streams, fps=config.get("render_fps", 30)).start() if console else None
+    try:
+        for stream in streams:
+            stream.thread.join()
+    finally:
+        if panes:
+            panes.close()
+    return streams
+
+
+def _openai_stream(client, model, formatted_messages, usage, include_usage=False):
+    """
+    Yield content chunks from an OpenAI-compatible streaming completion.
+    OpenAI caches repeated prompt prefixes automatically; with
+    ``include_usage`` the cached token count is read from the final chunk.
+    """
+    extra = {"stream_options": {"include_usage": True}} if include_usage else {}
+    response = client.chat.completions.create(
+        model=model,
+        messages=formatted_messages,
+        stream=True,
+        **extra
+    )
+    try:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None):
+                details = getattr(chunk.usage, "prompt_tokens_details", None)
+                usage.update(
+                    input_tokens=chunk.usage.prompt_tokens,
+                    cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+                    output_tokens=chunk.usage.completion_tokens,
+                )
+    finally:
+        # Release the HTTP connection when a hedged request is cancelled
+        response.close()
+
+
+def anthropic_messages(formatted_messages):
+    """
+    Convert OpenAI-style messages to Anthropic (system, messages). Cache
+    breakpoints go on the last system block and on the last message before
+    the current user turn, so instructions, summary and older turns are
+    served from the prompt cache and only the new turn is processed.
+    """
+    system = []
+    messages = []
+    for msg in formatted_messages:
+        if msg["role"] == "system":
+            system.append({"type": "text", "text": msg["content"]})
+            continue
+        if isinstance(msg["content"], str):
+            blocks = [{"type": "text", "text": msg["content"]}]
+        else:
+            blocks = []
+            for part in msg["content"]:
+                if part["type"] == "image_url":
+                    header, data = part["image_url"]["url"].split(",", 1)
+                    media_type = header[len("data:"):].split(";")[0]
+                    blocks.append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": data}})
+                else:
+                    blocks.append({"type": "text", "text": part["text"]})
+        messages.append({"role": msg["role"], "content": blocks})
+    if system:
+        system[-1]["cache_control"] = {"type": "ephemeral"}
+    if len(messages) > 1:
+        messages[-2]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+    return system, messages
+
+
+def _anthropic_stream(client, model, formatted_messages, config, usage):
+    """Yield text chunks from the Anthropic Messages API with prompt caching."""
+    system, messages = anthropic_messages(formatted_messages)
+    extra = {"system": system} if system else {}
+    with client.messages.stream(
+        model=model,
+        messages=messages,
+        max_tokens=config.get("max_output_tokens", 4096),
+        **extra
+    ) as stream:
+        for text in stream.text_stream:
+            yield text
+        final = stream.get_final_message()
+    usage.update(
+        input_tokens=final.usage.input_tokens,
+        cached_tokens=final.usage.cache_read_input_tokens or 0,
+        cache_write_tokens=final.usage.cache_creation_input_tokens or 0,
+        output_tokens=final.usage.output_tokens,
+    )
+
+
+def _ollama_stream(model, formatted_messages):
+    """Yield content chunks from a streaming Ollama chat."""
+    from ollama import chat as ollama_chat
+    response = ollama_chat(model=model, messages=formatted_messages, stream=True)
+    for chunk in response:
+        yield chunk["message"]["content"]
+
+
+def stub_stream(formatted_messages, config):
+    """
+    Offline stand-in for a streaming LLM. Waits ``stub_first_token_delay``
+    seconds, then yields ``stub_response_tokens`` word tokens at
+    ``stub_tokens_per_second`` (0 means as fast as possible).
+    """
+    first_token_delay = float(config.get("stub_first_token_delay") or 0)
+    tokens_per_second = float(config.get("stub_tokens_per_second") or 0)
+    response_tokens = int(config.get("stub_response_tokens") or 0)
+
+    prompt = ""
+    for msg in reversed(formatted_messages):
+        if msg["role"] == "user":
+            prompt = msg["content"] if isinstance(msg["content"], str) else msg["content"][0]["text"]
+            prompt = prompt.split("\n\n(Relevant context:")[0]
+            break
+    # Echo the tail of the prompt (the user's question) so replies differ per turn
+    words = ["Stub", "reply", "to:"] + prompt.split()[-12:] + ["lorem", "ipsum", "dolor", "sit", "amet"]
 
-    return full_response
+    time.sleep(first_token_delay)
+    interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+    next_at = time.perf_counter()
+    for i in range(response_tokens):
+        if interval:
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield words[i % len(words)] + " "
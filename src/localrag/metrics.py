@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+from .utils import atomic_write, atomic_write_json, file_lock
+
+METRICS_FILE = "metrics.json"
+# Upper bounds (seconds) of the latency histogram buckets; a last, unbounded
+# bucket catches everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Descriptions for the Prometheus exporter, by metric name (without the localrag_ prefix)
+HELP = {
+    "turn_seconds": "Chat turn from user input to indexed reply",
+    "embedding_model_load_seconds": "Loading the embedding model",
+    "vector_store_open_seconds": "Opening the vector store: manifest and startup consistency check",
+    "vector_partition_load_seconds": "Reading and verifying one partition's index and metadata",
+    "vector_embed_seconds": "Embedding one batch of texts",
+    "vector_search_seconds": "Searching the vector store for one batch of queries",
+    "vector_save_seconds": "Writing changed partitions and the manifest",
+    "vector_messages_added_total": "Messages added to the vector store",
+    "vector_duplicates_total": "Messages stored as aliases of an existing duplicate",
+    "vector_partitions_recovered_total": "Partitions repaired by the startup consistency check",
+    "chat_load_seconds": "Reading and parsing one chat JSON file",
+    "chat_archive_load_seconds": "Reading one chat out of an archive pack",
+    "chat_save_seconds": "Serializing and writing one chat JSON file",
+    "chat_list_seconds": "Reading and parsing every chat, archived ones included",
+    "llm_first_token_seconds": "LLM request start to first streamed token",
+    "llm_request_seconds": "LLM request start to end of stream",
+    "llm_requests_total": "LLM requests by outcome",
+    "llm_reroutes_total": "LLM requests answered by a hedged or fallback model",
+    "response_cache_lookups_total": "Response cache lookups by result",
+    "vectors": "Vectors in the active index",
+    "vector_partitions": "Partitions in the active index",
+    "chats": "Saved chats by storage tier",
+    "disk_bytes": "Bytes on disk by component",
+    "last_flush_timestamp_seconds": "When a localrag process last recorded metrics",
+}
+
+
+def _label_key(labels):
+    return ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+
+
+def _parse_labels(key):
+    return dict(part.split("=", 1) for part in key.split(",")) if key else {}
+
+
+def _new_histogram():
+    return {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0, "max": 0.0}
+
+
+class Metrics:
+    """
+    Counters and latency histograms recorded by this process, keyed by
+    metric name and then by labels ("provider=OpenAI,model=gpt-4.1").
+    take() hands them over for flush() to add to the totals on disk. While
+    ``enabled`` is False nothing is recorded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _new_histogram()
+            histogram["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            histogram["max"] = max(histogram["max"], seconds)
+
+    def take(self):
+        """The values recorded since the last take(); the registry starts over."""
+        with self.lock:
+            data = {"counters": self.counters, "histograms": self.histograms}
+            self.counters, self.histograms = {}, {}
+        return data
+
+
+_metrics = Metrics()
+
+
+def configure(enabled):
+    """Turn recording, and flush()'s writes, on or off for this process."""
+    _metrics.enabled = enabled
+
+
+def enabled():
+    return _metrics.enabled
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    _metrics.inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    """Record one duration in a histogram."""
+    _metrics.observe(name, seconds, **labels)
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Record how long the block takes in a histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.observe(name, time.perf_counter() - start, **labels)
+
+
+def load(path):
+    """Totals saved in ``path``; empty when there are none or they are unreadable."""
+    try:
+        with open(path, 'r') as f:
+            totals = json.load(f)
+    except (OSError, ValueError):
+        totals = {}
+    if totals.get("buckets") != list(BUCKETS):
+        totals["histograms"] = {}  # Recorded with other bucket bounds; can't be added to
+    totals["buckets"] = list(BUCKETS)
+    totals.setdefault("counters", {})
+    totals.setdefault("since", None)
+    totals.setdefault("updated_at", None)
+    return totals
+
+
+def merge(totals, data):
+    for name, series in data["counters"].items():
+        target = totals["counters"].setdefault(name, {})
+        for key, value in series.items():
+            target[key] = target.get(key, 0) + value
+    for name, series in data["histograms"].items():
+        target = totals["histograms"].setdefault(name, {})
+        for key, histogram in series.items():
+            total = target.setdefault(key, _new_histogram())
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+            total["max"] = max(total["max"], histogram["max"])
+    return totals
+
+
+def flush(path):
+    """
+    Add this process's metrics to the totals in ``path`` and return the
+    totals. Concurrent processes take turns through a lock file. With
+    metrics turned off, only reads the saved totals.
+    """
+    if not _metrics.enabled:
+        return load(path)
+    data = _metrics.take()
+    with file_lock(f"{path}.lock"):
+        totals = load(path)
+        if data["counters"] or data["histograms"]:
+            merge(totals, data)
+            now = time.time()
+            totals["since"] = totals["since"] or now
+            totals["updated_at"] = now
+            atomic_write_json(path, totals)
+    return totals
+
+
+def reset(path):
+    """Delete the saved totals, including anything recorded but not yet flushed."""
+    _metrics.take()
+    with file_lock(f"{path}.lock"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def quantile(histogram, q):
+    """
+    Estimate the ``q`` quantile (0-1) of a histogram by interpolating within
+    the bucket it falls in, as Prometheus' histogram_quantile does, capped
+    at the largest value seen. None when the histogram is empty.
+    """
+    count = histogram["count"]
+    if not count:
+        return None
+    rank = q * count
+    seen = 0
+    for i, n in enumerate(histogram["buckets"]):
+        if n and seen + n >= rank:
+            if i == len(BUCKETS):
+                return histogram["max"]  # Beyond the last bound
+            lower = BUCKETS[i - 1] if i else 0.0
+            return min(histogram["max"], lower + (BUCKETS[i] - lower) * (rank - seen) / n)
+        seen += n
+    return histogram["max"]
+
+
+def series(totals, kind, name):
+    """(labels dict, value) pairs of one counter or histogram in ``totals``."""
+    return [(_parse_labels(key), value) for key, value in sorted(totals[kind].get(name, {}).items())]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = {k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+def _header(lines, name, kind):
+    metric = f"localrag_{name}"
+    lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+    lines.append(f"# TYPE {metric} {kind}")
+    return metric
+
+
+def prometheus_text(totals, gauges=()):
+    """
+    The totals, plus ``gauges`` given as (name, labels, value) tuples, in the
+    Prometheus text exposition format.
+    """
+    lines = []
+    for name in sorted(totals["counters"]):
+        metric = _header(lines, name, "counter")
+        for labels, value in series(totals, "counters", name):
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+    for name in sorted(totals["histograms"]):
+        metric = _header(lines, name, "histogram")
+        for labels, histogram in series(totals, "histograms", name):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), histogram["buckets"]):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+    gauge_names = []
+    by_name = {}
+    for name, labels, value in gauges:
+        if name not in by_name:
+            gauge_names.append(name)
+            by_name[name] = []
+        by_name[name].append((labels, value))
+    if totals.get("updated_at"):
+        gauge_names.append("last_flush_timestamp_seconds")
+        by_name["last_flush_timestamp_seconds"] = [({}, f"{totals['updated_at']:.0f}")]
+    for name in gauge_names:
+        metric = _header(lines, name, "gauge")
+        for labels, value in by_name[name]:
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, totals, gauges=()):
+    """
+    Write prometheus_text() to ``path`` atomically, for node_exporter's
+    textfile collector (which reads *.prom files from its directory).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    atomic_write(path, prometheus_text(totals, gauges))
@@ -1,10 +1,13 @@
-# Structured metadata about supported models
+# Structured metadata about supported models. cost_tier ranks price per token
+# (0 = local/free, 4 = most expensive); vision = accepts image input.
 SUPPORTED_MODELS = {
     "gpt-4o-mini": {
         "full_name": "gpt-4o-mini",
         "display_name": "GPT-4o Mini",
         "provider": "OpenAI",
         "runtime": "OpenAI",
+        "cost_tier": 1,
+        "vision": True,
         "context_window": 128_000,
         "max_output_tokens": 16_384,
         "knowledge_cutoff": "September 2023"
@@ -14,6 +17,8 @@ SUPPORTED_MODELS = {
         "display_name": "GPT-4.1",
         "provider": "OpenAI",
         "runtime": "OpenAI",
+        "cost_tier": 3,
+        "vision": True,
         "context_window": 1_047_576,
         "max_output_tokens": 32_768,
         "knowledge_cutoff": "May 2024"    
@@ -23,6 +28,8 @@ SUPPORTED_MODELS = {
         "display_name": "o4 Mini",
         "provider": "OpenAI",
         "runtime": "OpenAI",
+        "cost_tier": 2,
+        "vision": True,
         "context_window": 200_000,
         "max_output_tokens": 100_000,
         "knowledge_cutoff": "May 2024"
@@ -32,6 +39,8 @@ SUPPORTED_MODELS = {
         "display_name": "o3",
         "provider": "OpenAI",
         "runtime": "OpenAI",
+        "cost_tier": 4,
+        "vision": True,
         "context_window": 200_000,
         "max_output_tokens": 100_000,
         "knowledge_cutoff": "May 2024"
@@ -41,6 +50,8 @@ SUPPORTED_MODELS = {
         "display_name": "Claude 3.7 Sonnet",
         "provider": "Anthropic",
         "runtime": "Anthropic",
+        "cost_tier": 3,
+        "vision": True,
         "context_window": 200_000,
         "max_output_tokens": 64_000,
         "knowledge_cutoff": "November 2024"
@@ -50,6 +61,8 @@ SUPPORTED_MODELS = {
         "display_name": "Claude 3.5 Haiku",
         "provider": "Anthropic",
         "runtime": "Anthropic",
+        "cost_tier": 2,
+        "vision": True,
         "context_window": 200_000,
         "max_output_tokens": 8_192,
         "knowledge_cutoff": "July 2024"
@@ -59,6 +72,8 @@ SUPPORTED_MODELS = {
         "display_name": "Gemini 2.5 Pro",
         "provider": "Google",
         "runtime": "Google",
+        "cost_tier": 3,
+        "vision": True,
         "context_window": 1_048_576,
         "max_output_tokens": 65_536,
         "knowledge_cutoff": "May 2025"
@@ -68,6 +83,8 @@ SUPPORTED_MODELS = {
         "display_name": "Gemini 2.5 Flash",
         "provider": "Google",
         "runtime": "Google",
+        "cost_tier": 1,
+        "vision": True,
         "context_window": 1_048_576,
         "max_output_tokens": 65_536,
         "knowledge_cutoff": "April 2025"
@@ -77,6 +94,8 @@ SUPPORTED_MODELS = {
         "display_name": "Gemini 2.0 Flash",
         "provider": "Google",
         "runtime": "Google",
+        "cost_tier": 1,
+        "vision": True,
         "context_window": 1_048_576,
         "max_output_tokens": 8_192,
         "knowledge_cutoff": "February 2025"
@@ -86,6 +105,8 @@ SUPPORTED_MODELS = {
         "display_name": "Grok 3",
         "provider": "xAI",
         "runtime": "xAI",
+        "cost_tier": 1,
+        "vision": False,
         "context_window": 131_072,
         "max_output_tokens": 131_072,
         "knowledge_cutoff": "November 2024"
@@ -95,6 +116,8 @@ SUPPORTED_MODELS = {
         "display_name": "Llama 4 Scout",
         "provider": "Meta",
         "runtime": "Ollama",
+        "cost_tier": 0,
+        "vision": True,
         "context_window": 10_000_000,
         "max_output_tokens": 8_192,
         "knowledge_cutoff": "August 2024"
@@ -104,6 +127,8 @@ SUPPORTED_MODELS = {
         "display_name": "Llama 4 Maverick",
         "provider": "Meta",
         "runtime": "Ollama",
+        "cost_tier": 0,
+        "vision": True,
         "context_window": 10_000_000,
         "max_output_tokens": 8_192,
         "knowledge_cutoff": "August 2024"
@@ -113,6 +138,8 @@ SUPPORTED_MODELS = {
         "display_name": "Llama 3.3",
         "provider": "Meta",
         "runtime": "Ollama",
+        "cost_tier": 0,
+        "vision": False,
         "context_window": 128_000,
         "max_output_tokens": 2_048,
         "knowledge_cutoff": "December 2023"
@@ -122,6 +149,8 @@ SUPPORTED_MODELS = {
         "display_name": "Gemma 3",
         "provider": "Google",
         "runtime": "Ollama",
+        "cost_tier": 0,
+        "vision": True,
         "context_window": 128_000,
         "max_output_tokens": 8_192,
         "knowledge_cutoff": "August 2024"
@@ -131,6 +160,8 @@ SUPPORTED_MODELS = {
         "display_name": "DeepSeek R1",
         "provider": "DeepSeek",
         "runtime": "Ollama",
+        "cost_tier": 0,
+        "vision": False,
         "context_window": 128_000,
         "max_output_tokens": 32_768,
         "knowledge_cutoff": "July 2024"
@@ -140,9 +171,22 @@ SUPPORTED_MODELS = {
         "display_name": "Phi-4 Mini",
         "provider": "Microsoft",
         "runtime": "Ollama",
+        "cost_tier": 0,
+        "vision": False,
         "context_window": 128_000,
         "max_output_tokens": 8_192,
         "knowledge_cutoff": "June 2024"
+    },
+    "local-stub": {
+        "full_name": "local-stub",
+        "display_name": "Local Stub (offline test runtime)",
+        "provider": "LocalRAG",
+        "runtime": "Stub",
+        "cost_tier": 0,
+        "vision": False,
+        "context_window": 1_000_000,
+        "max_output_tokens": 1_000_000,
+        "knowledge_cutoff": "N/A"
     }
 }
 
@@ -171,15 +215,40 @@ def get_model_metadata(alias_or_full: str) -> dict:
     else:
         raise ValueError(f"Model '{alias_or_full}' is not a supported model.")
 
+def get_substitute_models(alias_or_full: str, vision: bool = False) -> list:
+    """
+    Full names of models that can stand in for the given one when it fails,
+    best first. Only models on the same runtime qualify, so a local model
+    never hands a prompt to a cloud provider, and none pricier than the
+    given one; with ``vision``, only models that accept images. The closest
+    in price (and so in capability) comes first. The offline stub only
+    substitutes for itself.
+    """
+    meta = get_model_metadata(alias_or_full)
+    runtime = meta.get("runtime", meta["provider"])
+    if runtime == "Stub":
+        return []
+    candidates = [
+        (order, candidate) for order, candidate in enumerate(SUPPORTED_MODELS.values())
+        if candidate["full_name"] != meta["full_name"]
+        and candidate.get("runtime", candidate["provider"]) == runtime
+        and candidate["cost_tier"] <= meta["cost_tier"]
+        and (candidate["vision"] or not vision)
+    ]
+    return [candidate["full_name"] for _, candidate in sorted(candidates, key=lambda item: (-item[1]["cost_tier"], item[0]))]
+
 def list_supported_models() -> str:
     """Return a pretty list of supported models."""
     proprietary_models = []
     local_models = []
+    test_models = []
     
     for alias, meta in SUPPORTED_MODELS.items():
         model_info = f"- {alias} → {meta['display_name']} ({meta['provider']}, {meta['context_window']:,} ctx)"
         if meta['runtime'] == "Ollama":
             local_models.append(model_info)
+        elif meta['runtime'] == "Stub":
+            test_models.append(model_info)
         else:
             proprietary_models.append(model_info)
     
@@ -193,5 +262,11 @@ def list_supported_models() -> str:
             sections.append("")
         sections.append("[bold yellow]Local Models (requires Ollama)[/bold yellow]")
         sections.extend(local_models)
+
+    if test_models:
+        if sections:
+            sections.append("")
+        sections.append("[bold magenta]Testing (offline, no API calls)[/bold magenta]")
+        sections.extend(test_models)
     
     return "\n".join(sections)
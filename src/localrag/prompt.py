@@ -0,0 +1,58 @@
+from .vectorstore import text_hash
+
+
+def window_start(chat):
+    """Index of the first message sent verbatim; earlier ones are in the summary."""
+    summary = chat.get("summary")
+    if not summary or not summary.get("text"):
+        return 0
+    return min(summary.get("upto", 0), len(chat["messages"]))
+
+
+def window_message_ids(chat):
+    """Vector store ids of the messages sent verbatim in the next prompt."""
+    return {f"{chat['id']}:{i}" for i in range(window_start(chat), len(chat["messages"]))}
+
+
+def window_text_hashes(chat):
+    return {text_hash(m["content"]) for m in chat["messages"][window_start(chat):] if m.get("content")}
+
+
+def window_context_ids(chat):
+    """Context blocks already attached to a message in the prompt window."""
+    return {block_id for m in chat["messages"][window_start(chat):] for block_id in m.get("context_ids", ())}
+
+
+def message_context(chat, message):
+    """
+    Retrieved context for a user message: the blocks it references in
+    ``chat["context_blocks"]``, or the inline ``context`` of older chats.
+    """
+    if "context_ids" in message:
+        blocks = chat.get("context_blocks", {})
+        return "\n\n".join(blocks[block_id] for block_id in message["context_ids"] if block_id in blocks)
+    return message.get("context", "")
+
+
+def prompt_messages(chat, system_prompt=None):
+    """
+    Messages to send for ``chat``, ordered from most to least stable so
+    provider prompt caches can reuse the prefix: system instructions, the
+    running summary (if any), then the turns it doesn't cover yet. Each user
+    message carries its own context blocks, so earlier turns render the same
+    on every request and only the newest turn changes.
+    """
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    summary = chat.get("summary")
+    if summary and summary.get("text"):
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{summary['text']}",
+        })
+    messages.extend(
+        {**m, "context": message_context(chat, m)} if m["role"] == "user" else m
+        for m in chat["messages"][window_start(chat):]
+    )
+    return messages
@@ -0,0 +1,173 @@
+import textwrap
+import threading
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.panel import Panel
+from rich.table import Table
+from rich.text import Text
+
+SPINNER_FRAMES = "|/-\\"
+SPINNER_TEXT = " Generating..."
+
+
+class _MarkdownText:
+    """Renderable that parses the text received so far only when Live redraws."""
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def __rich_console__(self, console, options):
+        yield Markdown(self.renderer.text())
+
+
+class StreamRenderer:
+    """
+    Prints streamed chunks at most ``fps`` times per second. ``feed`` only
+    appends to a list; one render thread owns the terminal, drawing a spinner
+    until the first chunk and then writing whatever arrived since the last
+    frame in a single write. With ``markdown`` the response is re-rendered as
+    Markdown through rich's Live display at the same frame rate.
+    """
+
+    def __init__(self, console, fps=30, markdown=False, spinner=True):
+        self.console = console
+        self.interval = 1.0 / max(1, fps)
+        self.markdown = markdown
+        self.spinner = spinner and console.is_terminal
+        self.chunks = []
+        self.written = 0
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.first_chunk = threading.Event()
+        self.done = threading.Event()
+        self.thread = None
+        self.live = None
+
+    def text(self):
+        with self.lock:
+            return "".join(self.chunks)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def feed(self, chunk):
+        with self.lock:
+            self.chunks.append(chunk)
+        if not self.first_chunk.is_set():
+            self.first_chunk.set()
+
+    def close(self):
+        """Flush everything fed so far and stop the render thread."""
+        self.done.set()
+        self.first_chunk.set()
+        if self.thread:
+            self.thread.join()
+        if self.live:
+            self.live.stop()
+        elif not self.console.quiet:
+            self._flush()
+
+    def _run(self):
+        if self.console.quiet:
+            self.done.wait()
+            return
+        self._spin()
+        if self.markdown:
+            self.console.print()  # Live redraws whole lines; keep the prompt line intact
+            self.live = Live(_MarkdownText(self), console=self.console,
+                             refresh_per_second=1.0 / self.interval, vertical_overflow="visible")
+            self.live.start()
+            self.done.wait()
+            return
+        while not self.done.wait(self.interval):
+            self._flush()
+
+    def _spin(self):
+        """Draw the spinner in place after the prompt until the first chunk arrives."""
+        if not self.spinner:
+            self.first_chunk.wait()
+            return
+        out = self.console.file
+        frame = 0
+        width = 0
+        while not self.first_chunk.wait(0 if frame == 0 else 0.1):
+            text = SPINNER_FRAMES[frame % len(SPINNER_FRAMES)] + SPINNER_TEXT
+            out.write("\b" * width + text)
+            out.flush()
+            width = len(text)
+            frame += 1
+        if width:
+            out.write("\b" * width + " " * width + "\b" * width)
+            out.flush()
+
+    def _flush(self):
+        with self.lock:
+            if len(self.chunks) == self.written:
+                return
+            pending = self.chunks[self.written:]
+            self.written = len(self.chunks)
+        out = self.console.file
+        out.write("".join(pending))
+        out.flush()
+        self.frames += 1
+
+
+class _Panes:
+    """Renderable drawing every stream's pane when Live redraws."""
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def __rich_console__(self, console, options):
+        yield self.renderer.panes(tail_lines=max(3, options.max_height - 3), width=options.max_width)
+
+
+class ComparePanes:
+    """
+    Side-by-side panes for answers streaming from several models at once,
+    redrawn at most ``fps`` times per second. While streaming, each pane
+    shows the tail of its answer; close() prints the full answers. Streams
+    provide ``title``, ``response()`` and ``status()``.
+    """
+
+    def __init__(self, console, streams, fps=30):
+        self.console = console
+        self.streams = streams
+        self.fps = max(1, fps)
+        self.live = None
+
+    def start(self):
+        if not self.console.quiet:
+            self.live = Live(_Panes(self), console=self.console, refresh_per_second=self.fps, transient=True)
+            self.live.start()
+        return self
+
+    def close(self):
+        if self.live:
+            self.live.stop()
+        if not self.console.quiet:
+            self.console.print(self.panes())
+
+    def panes(self, tail_lines=None, width=None):
+        grid = Table.grid(expand=True, padding=(0, 1))
+        for _ in self.streams:
+            grid.add_column(ratio=1)
+        panels = []
+        for stream in self.streams:
+            text = stream.response()
+            if tail_lines is not None:
+                text = _tail(text, (width or self.console.width) // len(self.streams) - 5, tail_lines)
+            panels.append(Panel(Text(text), title=stream.title, subtitle=stream.status(),
+                                title_align="left", subtitle_align="left"))
+        grid.add_row(*panels)
+        return grid
+
+
+def _tail(text, width, lines):
+    """The last ``lines`` lines of ``text`` wrapped to ``width`` columns."""
+    wrapped = []
+    for line in text.splitlines():
+        wrapped.extend(textwrap.wrap(line, max(8, width)) or [""])
+    return "\n".join(wrapped[-lines:])
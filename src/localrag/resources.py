@@ -0,0 +1,100 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .tracing import span
+
+
+class ResourceGovernor:
+    """
+    Thread budgets for the CPU-heavy libraries, from config. Setting 0 means
+    one less than the core count, leaving a core for the main, streaming and
+    render threads:
+
+    - ``embedding_threads``: torch intra-op threads used by the embedding model
+    - ``faiss_threads``: FAISS OpenMP threads (batch searches and adds); the
+      same pool as ``embedding_threads`` when torch shares FAISS's OpenMP
+    - ``search_workers``: partitions searched in parallel by one query
+    - ``index_workers``: background threads embedding messages during streaming
+    - ``tokenizers_parallelism``: the Hugging Face tokenizers' own thread pool
+    """
+
+    def __init__(self, config, cpu_count=None):
+        self.cores = cpu_count or os.cpu_count() or 1
+        spare = max(1, self.cores - 1)
+        self.embedding_threads = config.get("embedding_threads") or spare
+        self.faiss_threads = config.get("faiss_threads") or spare
+        self.search_workers = config.get("search_workers") or spare
+        self.index_workers = max(1, config.get("index_workers") or 1)
+        self.tokenizers_parallelism = bool(config.get("tokenizers_parallelism", False))
+
+    def apply(self):
+        """
+        Set the thread counts through each library's own call. Call after the
+        embedding model is loaded, so torch is imported. OMP_NUM_THREADS and
+        MKL_NUM_THREADS are not used: the OpenMP runtime reads them once,
+        when FAISS is imported, before any config is read. When torch and
+        FAISS load the same OpenMP runtime the two counts are one setting;
+        faiss_threads is set last, so it is the one that holds (see applied()).
+        """
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if self.tokenizers_parallelism else "false"
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(self.embedding_threads)
+        import faiss
+        faiss.omp_set_num_threads(self.faiss_threads)
+        return self
+
+    def applied(self):
+        """Thread counts torch (None when not loaded) and FAISS report after apply()."""
+        import faiss
+        torch = sys.modules.get("torch")
+        return {
+            "embedding_threads": torch.get_num_threads() if torch else None,
+            "faiss_threads": faiss.omp_get_max_threads(),
+        }
+
+    def settings(self):
+        return {
+            "cores": self.cores,
+            "embedding_threads": self.embedding_threads,
+            "faiss_threads": self.faiss_threads,
+            "search_workers": self.search_workers,
+            "index_workers": self.index_workers,
+            "tokenizers_parallelism": self.tokenizers_parallelism,
+        }
+
+
+class BackgroundIndexer:
+    """
+    Adds messages to a vector store on a bounded pool of ``workers`` threads,
+    so embedding and indexing overlap LLM streaming instead of following it.
+    Embedding runs in parallel across workers; adds to the store are
+    serialized. Call wait() before the next search: it blocks until pending
+    adds are done and re-raises the first one that failed.
+    """
+
+    def __init__(self, workers=1):
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="localrag-index")
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def add(self, vector_store, message_id, text, model=None, embeddings=None, timestamp=None):
+        """Queue one message; ``embeddings`` (1 x dim) skips re-embedding text already embedded."""
+        self.pending.append(self.pool.submit(self._add, vector_store, message_id, text, model, embeddings, timestamp))
+
+    def _add(self, vector_store, message_id, text, model, embeddings, timestamp):
+        if embeddings is None:
+            embeddings = vector_store.embed([text])
+        with self.lock, span("vector.add", background=True):
+            vector_store.add_many([(message_id, text, model, timestamp)], embeddings=embeddings)
+
+    def wait(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
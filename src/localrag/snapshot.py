@@ -0,0 +1,354 @@
+import io
+import os
+import json
+import time
+import tarfile
+import datetime
+import zlib
+import faiss
+import numpy as np
+from .archive import ChatArchive
+from .chatstore import load_chat, save_chat, get_chat_path
+from .indexes import known_ids, index_name
+from .tracing import span
+from .utils import checksum
+from .vectorstore import VectorStore, read_manifest, partition_paths, index_type_of
+
+SNAPSHOT_FORMAT = "localrag-snapshot"
+SNAPSHOT_VERSION = 1
+# Vectors (and their metadata) per snapshot member; bounds memory on both ends
+CHUNK_ROWS = 4096
+# Each member's checksum goes in the standard pax "comment" header, which tar tools ignore
+CHECKSUM_PREFIX = "localrag-crc32:"
+
+
+class SnapshotError(Exception):
+    """A snapshot could not be written, or is damaged, truncated or not a snapshot."""
+
+
+class StoredVectors:
+    """
+    Stands in for the embedding model of a store that only receives vectors
+    read from a snapshot: it knows the dimension and refuses to embed.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kwargs):
+        raise SnapshotError("Importing a snapshot never embeds; this store needs repairing first. Run 'localrag stats' to open it.")
+
+
+def _json_bytes(value):
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _npy_bytes(vectors):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(vectors, dtype='float32'), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.pax_headers = {"comment": CHECKSUM_PREFIX + checksum(data)}
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _read_verified(path, expected):
+    """Bytes of ``path``, or of its .bak copy, matching the size and checksum the manifest recorded."""
+    for candidate in (path, f"{path}.bak"):
+        try:
+            with open(candidate, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        if expected is None or (len(data) == expected["size"] and checksum(data) == expected["crc32"]):
+            return data
+    return None
+
+
+def _partition_rows(vector_store_path, manifest, key):
+    """
+    (vectors, metadata) of one partition as ``manifest`` recorded it, with
+    full-precision vectors where the partition keeps them; None when its
+    files no longer match (a save is under way).
+    """
+    index_path, meta_path = partition_paths(vector_store_path, key)
+    files = (manifest["partitions"].get(key) or {}).get("files") or {}
+    index_data = _read_verified(index_path, files.get("index"))
+    meta_data = _read_verified(meta_path, files.get("meta"))
+    if index_data is None or meta_data is None:
+        return None
+    index = faiss.deserialize_index(np.frombuffer(index_data, dtype='uint8'))
+    meta = json.loads(meta_data)
+    count = len(meta["ids"])
+    if index.ntotal != count:
+        return None
+    vectors_path = os.path.splitext(index_path)[0] + ".f32"
+    if index_type_of(index) != "flat" and os.path.exists(vectors_path) and os.path.getsize(vectors_path) >= count * index.d * 4:
+        vectors = np.fromfile(vectors_path, dtype='float32', count=count * index.d).reshape(count, index.d)
+    else:
+        vectors = index.reconstruct_n(0, count) if count else np.empty((0, index.d), dtype='float32')
+    return vectors, meta
+
+
+def _index_chunks(vector_store_path):
+    """Chunks of up to CHUNK_ROWS rows of a vector store, partition by partition, as (metadata, vectors)."""
+    manifest = read_manifest(vector_store_path)
+    if manifest is None:
+        if os.path.isdir(vector_store_path) and any(n.endswith(".faiss") for n in os.listdir(vector_store_path)):
+            raise SnapshotError(f"Vector store '{vector_store_path}' has no readable manifest. Run 'localrag stats' to repair it, then export again.")
+        return
+    for key in sorted(manifest.get("partitions", {})):
+        for attempt in range(3):
+            rows = _partition_rows(vector_store_path, manifest, key)
+            if rows is not None:
+                break
+            # Written since the manifest was read; the next manifest describes it
+            time.sleep(0.1 * (attempt + 1))
+            manifest = read_manifest(vector_store_path) or manifest
+        else:
+            raise SnapshotError(f"Partition {key} of '{vector_store_path}' fails its checksum. Run 'localrag stats' to repair it, then export again.")
+        vectors, meta = rows
+        count = len(meta["ids"])
+        models = meta.get("models") or [None] * count
+        timestamps = meta.get("timestamps") or [None] * count
+        aliases = {int(pos): ids for pos, ids in meta.get("aliases", {}).items()}
+        for start in range(0, count, CHUNK_ROWS):
+            end = start + CHUNK_ROWS
+            yield {
+                "partition": key,
+                "ids": meta["ids"][start:end],
+                "texts": meta["texts"][start:end],
+                "models": models[start:end],
+                "timestamps": timestamps[start:end],
+                "aliases": {str(pos - start): ids for pos, ids in aliases.items() if start <= pos < end},
+            }, vectors[start:end]
+
+
+def export_snapshot(fileobj, indexes, chats_dir, active=None, progress=None):
+    """
+    Stream the vector indexes in ``indexes`` (name -> registry entry) and
+    every chat in ``chats_dir``, archived ones included, to ``fileobj`` as
+    a gzip-compressed tar. Vectors go out in CHUNK_ROWS chunks, each
+    partition exactly as its manifest recorded it, and chats after them, so
+    every exported vector's chat is in the snapshot too. Each member
+    carries a checksum; a closing end.json holds the totals. ``progress``
+    is called with the running totals.
+    """
+    totals = {"vectors": 0, "chats": 0, "members": 0}
+
+    def add(tar, name, data):
+        _add_member(tar, name, data)
+        totals["members"] += 1
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.datetime.now().isoformat(),
+        "indexes": {},
+    }
+    for name, entry in indexes.items():
+        manifest = read_manifest(entry["path"]) or {}
+        header["indexes"][name] = {
+            "embedding_model": entry["embedding_model"],
+            "embedding": manifest.get("embedding"),
+            "vectors": sum((s or {}).get("count", 0) for s in manifest.get("partitions", {}).values()),
+            "active": name == active,
+        }
+    with span("snapshot.export"), tarfile.open(fileobj=fileobj, mode="w|gz", format=tarfile.PAX_FORMAT) as tar:
+        add(tar, "snapshot.json", _json_bytes(header))
+        for name, entry in indexes.items():
+            for n, (chunk, vectors) in enumerate(_index_chunks(entry["path"])):
+                member = f"indexes/{name}/{chunk['partition']}-{n:05d}"
+                add(tar, f"{member}.json", _json_bytes(chunk))
+                add(tar, f"{member}.npy", _npy_bytes(vectors))
+                totals["vectors"] += len(chunk["ids"])
+                if progress:
+                    progress(totals)
+        hot = set()
+        if os.path.isdir(chats_dir):
+            for entry in sorted(os.scandir(chats_dir), key=lambda e: e.name):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    with open(entry.path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue  # Deleted since the listing
+                hot.add(entry.name[:-len(".json")])
+                add(tar, f"chats/{entry.name}", data)
+                totals["chats"] += 1
+                if progress and totals["chats"] % 100 == 0:
+                    progress(totals)
+        archive = ChatArchive(chats_dir)
+        try:
+            for chat in archive.chats(exclude=hot):
+                add(tar, f"chats/{chat['id']}.json", _json_bytes(chat))
+                totals["chats"] += 1
+                if progress and totals["chats"] % 100 == 0:
+                    progress(totals)
+        finally:
+            archive.close()
+        add(tar, "end.json", _json_bytes(totals))
+    if progress:
+        progress(totals)
+    return totals
+
+
+def read_snapshot(fileobj):
+    """(name, data) of each member of a snapshot stream, after checking its checksum."""
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                data = tar.extractfile(member).read()
+                if member.pax_headers.get("comment") != CHECKSUM_PREFIX + checksum(data):
+                    raise SnapshotError(f"Snapshot member {member.name} is damaged (checksum mismatch).")
+                yield member.name, data
+    except (tarfile.TarError, EOFError, zlib.error) as e:
+        raise SnapshotError(f"Snapshot is damaged or truncated: {e}") from e
+
+
+class SnapshotImport:
+    """
+    Merges a snapshot into the local stores. Each exported index is added to
+    the local index with the same embedding model, or registered as a new
+    index when there is none (and made active if the snapshot's active
+    index lands on an empty install). Vectors are added with their stored
+    embeddings under fresh positions, skipping message ids already present;
+    a chat replaces the local copy only if the snapshot's is newer.
+    Re-running an import is safe. With ``check``, only verifies.
+    """
+
+    def __init__(self, registry, chats_dir, dedup=True, check=False, progress=None):
+        self.registry = registry
+        self.chats_dir = chats_dir
+        self.dedup = dedup
+        self.check = check
+        self.progress = progress
+        self.header = None
+        self.targets = {}
+        self.report = {"vectors_imported": 0, "vectors_skipped": 0, "chats_imported": 0, "chats_skipped": 0,
+                       "vectors": 0, "chats": 0, "indexes": {}}
+
+    def run(self, fileobj):
+        pending = None
+        end = None
+        with span("snapshot.import", check=self.check):
+            for name, data in read_snapshot(fileobj):
+                if self.header is None:
+                    self._read_header(name, data)
+                elif name == "end.json":
+                    end = json.loads(data)
+                elif name.startswith("indexes/") and name.endswith(".json"):
+                    pending = json.loads(data)
+                elif name.startswith("indexes/") and name.endswith(".npy"):
+                    if pending is None:
+                        raise SnapshotError(f"Snapshot member {name} has no metadata before it.")
+                    vectors = np.load(io.BytesIO(data), allow_pickle=False)
+                    self._merge_chunk(name.split("/")[1], pending, vectors)
+                    pending = None
+                elif name.startswith("chats/"):
+                    self._merge_chat(json.loads(data))
+        if self.header is None or end is None:
+            raise SnapshotError("Snapshot is truncated: it has no end marker.")
+        if (end["vectors"], end["chats"]) != (self.report["vectors"], self.report["chats"]):
+            raise SnapshotError(f"Snapshot is incomplete: expected {end['vectors']} vectors and {end['chats']} chats, "
+                                f"read {self.report['vectors']} and {self.report['chats']}.")
+        return self.report
+
+    def _read_header(self, name, data):
+        header = json.loads(data) if name == "snapshot.json" else {}
+        if header.get("format") != SNAPSHOT_FORMAT:
+            raise SnapshotError("Not a localrag snapshot.")
+        if header.get("version", 0) > SNAPSHOT_VERSION:
+            raise SnapshotError(f"Snapshot format version {header['version']} is newer than this localrag supports. Run 'localrag update'.")
+        if not self.check and self.registry.load().migration():
+            raise SnapshotError("A 'localrag reindex' migration is running. Let it finish, or run 'localrag reindex --abort', then import.")
+        self.header = header
+
+    def _target(self, name, dim):
+        """The local store the snapshot's index ``name`` merges into, opened on first use."""
+        if name in self.targets:
+            return self.targets[name]
+        info = self.header["indexes"].get(name)
+        if info is None:
+            raise SnapshotError(f"Snapshot holds vectors of index '{name}' it does not describe.")
+        model = info["embedding_model"]
+        with self.registry.lock():
+            self.registry.load()
+            active_name, active_entry = self.registry.active()
+            local = active_name if active_entry["embedding_model"] == model else next(
+                (n for n, e in self.registry.data["indexes"].items() if e["embedding_model"] == model), None)
+            if local is None:
+                local = name if name not in self.registry.data["indexes"] else index_name(model)
+                self.registry.data["indexes"][local] = {
+                    "path": os.path.join(self.registry.root, "indexes", local),
+                    "embedding_model": model,
+                    "created_at": datetime.datetime.now().isoformat(),
+                }
+                active_manifest = read_manifest(active_entry["path"]) or {}
+                if info.get("active") and not any((s or {}).get("count") for s in active_manifest.get("partitions", {}).values()):
+                    self.registry.data["active"] = local
+                self.registry.save()
+        entry = self.registry.data["indexes"][local]
+        try:
+            store = VectorStore(entry["path"], model, embedding_model=StoredVectors(dim), dedup=self.dedup)
+        except ValueError as e:
+            raise SnapshotError(str(e)) from e
+        self.targets[name] = target = {"store": store, "known": known_ids(store), "name": local}
+        self.report["indexes"][local] = 0
+        return target
+
+    def _merge_chunk(self, name, chunk, vectors):
+        self.report["vectors"] += len(chunk["ids"])
+        if self.check:
+            return
+        target = self._target(name, vectors.shape[1])
+        entries, rows = [], []
+        for row, message_id in enumerate(chunk["ids"]):
+            # Duplicates go in with their canonical row's text and vector and are aliased again on add
+            for entry_id in [message_id] + chunk["aliases"].get(str(row), []):
+                if entry_id in target["known"]:
+                    self.report["vectors_skipped"] += 1
+                    continue
+                entries.append((entry_id, chunk["texts"][row], chunk["models"][row], chunk["timestamps"][row]))
+                rows.append(row)
+        if entries:
+            target["store"].add_many(entries, embeddings=vectors[rows])
+            target["known"].update(entry[0] for entry in entries)
+            self.report["vectors_imported"] += len(entries)
+            self.report["indexes"][target["name"]] += len(entries)
+        if self.progress:
+            self.progress(self.report)
+
+    def _merge_chat(self, chat):
+        chat_id = chat.get("id")
+        # The id names the chat's file; never let a snapshot write outside the chats directory
+        if not isinstance(chat_id, str) or not chat_id or os.path.basename(chat_id) != chat_id or chat_id.startswith("."):
+            raise SnapshotError(f"Snapshot holds a chat with an invalid id: {chat_id!r}")
+        self.report["chats"] += 1
+        if self.check:
+            return
+        local = load_chat(self.chats_dir, chat_id)
+        if local is not None and local.get("updated_at", "") >= chat.get("updated_at", ""):
+            self.report["chats_skipped"] += 1
+            return
+        save_chat(self.chats_dir, chat)
+        try:
+            # Keep the chat's age, so 'localrag archive' treats it as it would have on the old machine
+            updated = datetime.datetime.fromisoformat(chat["updated_at"]).timestamp()
+            os.utime(get_chat_path(self.chats_dir, chat_id), (updated, updated))
+        except (KeyError, TypeError, ValueError, OSError):
+            pass
+        self.report["chats_imported"] += 1
+        if self.progress and self.report["chats"] % 100 == 0:
+            self.progress(self.report)
@@ -0,0 +1,88 @@
+import datetime
+import threading
+from .llm import complete_with_utility_model
+from .utils import estimate_tokens
+from .tracing import span
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the existing summary with the new messages. Keep facts, decisions, names, code "
+    "identifiers and open questions; drop pleasantries. Respond with ONLY the updated summary."
+)
+
+
+class Summarizer:
+    """
+    Condenses older turns of a chat into ``chat["summary"]`` on a background
+    thread. Runs after a turn once the unsummarized messages, excluding the
+    ``keep_recent`` newest, exceed ``threshold_tokens``. The thread only
+    sees a copy of the messages; the main thread puts its result into the
+    chat with apply() at a turn boundary, so a save never races it.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = bool(config.get("summary_enabled", True))
+        self.threshold_tokens = config.get("summary_threshold_tokens", 3000)
+        self.keep_recent = config.get("summary_keep_recent_messages", 6)
+        self.max_tokens = config.get("summary_max_tokens", 400)
+        self.model = config.get("summary_model")
+        self.thread = None
+        self.result = None
+
+    def _pending(self, chat):
+        """(start, end) of messages to fold into the summary, or None."""
+        start = (chat.get("summary") or {}).get("upto", 0)
+        end = len(chat["messages"]) - self.keep_recent
+        if end <= start:
+            return None
+        tail_tokens = sum(estimate_tokens(m["content"]) for m in chat["messages"][start:end])
+        if tail_tokens < self.threshold_tokens:
+            return None
+        return start, end
+
+    def maybe_start(self, chat):
+        """Start a background summary update if one is due and none is running or waiting to be applied."""
+        if not self.enabled or (self.thread and self.thread.is_alive()) or self.result:
+            return False
+        pending = self._pending(chat)
+        if pending is None:
+            return False
+        start, end = pending
+        previous = (chat.get("summary") or {}).get("text", "")
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in chat["messages"][start:end])
+        # The last summarized message identifies this history when the result is applied
+        self.thread = threading.Thread(target=self._run, args=(previous, transcript, start, end, chat["messages"][end - 1]), daemon=True)
+        self.thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def apply(self, chat):
+        """Put a finished summary into ``chat``; dropped if the chat was cleared meanwhile. True if applied."""
+        result, self.result = self.result, None
+        if result is None:
+            return False
+        end, last_message, summary = result
+        if len(chat["messages"]) < end or chat["messages"][end - 1] is not last_message:
+            return False
+        chat["summary"] = summary
+        return True
+
+    def finish(self, chat):
+        """Wait for a running update and apply it, before a final save."""
+        self.wait()
+        return self.apply(chat)
+
+    def _run(self, previous, transcript, start, end, last_message):
+        content = f"Existing summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+        with span("llm.summary", messages=end - start):
+            text = complete_with_utility_model(SUMMARY_PROMPT, content, self.config, self.max_tokens, self.model)
+        if text:
+            self.result = (end, last_message, {
+                "text": text,
+                "upto": end,
+                "updated_at": datetime.datetime.now().isoformat(),
+            })
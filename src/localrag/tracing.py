@@ -0,0 +1,160 @@
+import json
+import time
+import threading
+from rich.table import Table
+
+# Process-wide tracer; None means tracing is disabled and span() is a no-op.
+_tracer = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.depth = 0
+
+    def __enter__(self):
+        self.depth = self.tracer._enter()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.tracer._exit()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.start, end, depth=self.depth, **self.attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """
+    Collects spans for the current chat turn. Spans may be recorded from any
+    thread; each turn's spans are optionally appended to a JSONL trace file.
+    """
+
+    def __init__(self, trace_file=None):
+        self.trace_file = trace_file
+        self.spans = []
+        self.turn = 0
+        self.turn_start = time.perf_counter()
+        self.turn_started_at = time.time()
+        self.turn_attrs = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        return depth
+
+    def _exit(self):
+        self._local.depth = getattr(self._local, "depth", 1) - 1
+
+    def span(self, name, attrs):
+        return Span(self, name, attrs)
+
+    def record(self, name, start, end, depth=None, **attrs):
+        """Record a span from perf_counter() timestamps."""
+        if depth is None:
+            depth = getattr(self._local, "depth", 0)
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": (start - self.turn_start) * 1000.0,
+                "duration_ms": (end - start) * 1000.0,
+                "depth": depth,
+                "thread": threading.current_thread().name,
+                **attrs,
+            })
+
+    def start_turn(self, **attrs):
+        with self._lock:
+            self.turn += 1
+            self.spans = []
+            self.turn_start = time.perf_counter()
+            self.turn_started_at = time.time()
+            self.turn_attrs = attrs
+
+    def end_turn(self):
+        """Finish the current turn, write it to the trace file and return its spans."""
+        total_ms = (time.perf_counter() - self.turn_start) * 1000.0
+        with self._lock:
+            spans = self.spans
+            self.spans = []
+        if self.trace_file:
+            wall = self.turn_started_at
+            with open(self.trace_file, "a") as f:
+                for s in spans:
+                    f.write(json.dumps({"turn": self.turn, "turn_started_at": wall, **self.turn_attrs, **s}, default=str) + "\n")
+                f.write(json.dumps({
+                    "turn": self.turn, "turn_started_at": wall, **self.turn_attrs,
+                    "name": "turn", "start_ms": 0.0, "duration_ms": total_ms, "depth": -1,
+                }) + "\n")
+        return spans, total_ms
+
+
+def enable(trace_file=None):
+    """Turn tracing on for this process and return the tracer."""
+    global _tracer
+    _tracer = Tracer(trace_file)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **attrs):
+    """Context manager timing a block; costs one global lookup when disabled."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, attrs)
+
+
+def record(name, start, end, **attrs):
+    """Record an already-measured interval (perf_counter() timestamps)."""
+    if _tracer is not None:
+        _tracer.record(name, start, end, **attrs)
+
+
+def profile_table(spans, total_ms, title="Turn profile"):
+    """Aggregate a turn's spans by name into a rich table."""
+    rows = {}
+    order = []
+    for s in sorted(spans, key=lambda s: s["start_ms"]):
+        if s["name"] not in rows:
+            rows[s["name"]] = {"count": 0, "total": 0.0, "depth": s["depth"]}
+            order.append(s["name"])
+        rows[s["name"]]["count"] += 1
+        rows[s["name"]]["total"] += s["duration_ms"]
+
+    table = Table(title=f"{title} ({total_ms:.0f} ms)", title_justify="left", show_edge=False)
+    table.add_column("span")
+    table.add_column("calls", justify="right")
+    table.add_column("ms", justify="right")
+    table.add_column("% turn", justify="right")
+    for name in order:
+        row = rows[name]
+        share = 100.0 * row["total"] / total_ms if total_ms else 0.0
+        table.add_row("  " * row["depth"] + name, str(row["count"]), f"{row['total']:.1f}", f"{share:.1f}")
+    return table
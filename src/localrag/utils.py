@@ -1,8 +1,13 @@
-import ollama
+import os
+import json
+import time
+import zlib
+import contextlib
 from rich.console import Console
 
 def ensure_ollama_model(model_name: str, console: Console) -> bool:
     """Ensure the Ollama model is pulled and available."""
+    import ollama
     try:
         models_info = ollama.ps()
         base_model = get_base_model_name(model_name)
@@ -26,3 +31,95 @@ def get_base_model_name(model_name: str) -> str:
     """
     return model_name.split(":")[0]
 
+
+def estimate_tokens(text) -> int:
+    """Rough token count (~4 characters per token) for budgeting prompts."""
+    return len(text or "") // 4
+
+def format_bytes(n: int) -> str:
+    """Human-readable size, e.g. 1536 -> '1.5 KB'."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def directory_bytes(path) -> int:
+    """Total size of the files under ``path`` (0 if it does not exist)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+def atomic_write(path, data, keep_backup=False):
+    """
+    Write ``data`` (str or bytes) to a temp file, fsync it and rename it over
+    ``path``, so readers and crash recovery see either the old or the new
+    file, never a partial one. With ``keep_backup`` the replaced file stays
+    reachable as ``path``.bak (a hard link, so nothing is copied).
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if keep_backup and os.path.exists(path):
+        backup_path = f"{path}.bak"
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        try:
+            os.link(path, backup_path)
+        except OSError:
+            os.replace(path, backup_path)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(path, data, keep_backup=False, **kwargs):
+    """Write JSON to a temp file and rename it over ``path`` so readers never see a partial file."""
+    atomic_write(path, json.dumps(data, **kwargs), keep_backup)
+
+
+def checksum(data) -> str:
+    """CRC-32 of bytes as hex; detects torn or corrupted files, not tampering."""
+    return f"{zlib.crc32(data):08x}"
+
+def file_checksum(path) -> str:
+    """checksum() of a file's contents, read in chunks."""
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+
+@contextlib.contextmanager
+def file_lock(path, timeout=10.0, stale_after=60.0):
+    """
+    Cross-process lock held by creating ``path`` exclusively. A lock file
+    older than ``stale_after`` seconds is assumed left behind by a crash.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for lock {path}")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
@@ -1,62 +1,947 @@
 import os
+import re
 import json
+import heapq
+import hashlib
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
 import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
 from rich.console import Console
+from .tracing import span
+from .metrics import timer, inc
+from .utils import atomic_write, atomic_write_json, checksum, file_checksum
+
+LEGACY_PARTITION = "legacy"
+MANIFEST_FILE = "partitions.json"
+HASHES_FILE = "hashes.tsv"
+# "flat" keeps float32 vectors (4 bytes/dim); "sq16" and "sq8" are FAISS
+# scalar quantizers at 2 and 1 byte/dim
+INDEX_TYPES = ("flat", "sq16", "sq8")
+DEFAULT_RERANK_FACTOR = 4
+# Candidates fetched per result when diversifying with MMR
+MMR_FETCH_FACTOR = 4
+PARTITION_KEY_RE = re.compile(r"^(\d{4}-\d{2})\.json$")
+# Temp files older than this are leftovers of an interrupted write
+STALE_TMP_SECONDS = 600
+
+
+def partition_key(timestamp):
+    """Month partition key ("YYYY-MM") for an ISO timestamp."""
+    return timestamp[:7]
+
+
+class Partition:
+    """
+    One month of vectors plus the metadata needed to filter it.
+    The summary (counts, chat ids, models, time range) lives in the store
+    manifest so partitions can be skipped without being read from disk,
+    together with the sizes and checksums of the files the last save wrote.
+    ``embed(texts)`` re-embeds rows lost by an interrupted save.
+    """
+
+    def __init__(self, key, index_path, meta_path, vector_dim, summary=None,
+                 index_type="flat", rerank_factor=0, embed=None):
+        self.key = key
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.vectors_path = os.path.splitext(index_path)[0] + ".f32"
+        self.vector_dim = vector_dim
+        self.index_type = index_type
+        # > 0 keeps full float32 vectors on disk (memory-mapped) and re-ranks
+        # rerank_factor * top_k compressed hits by exact distance
+        self.rerank_factor = rerank_factor
+        self.index = None
+        self.full_vectors = None
+        self.pending_vectors = []
+        self.ids = []
+        self.positions = None
+        # position -> ids of duplicate messages stored as references to it
+        self.aliases = {}
+        self.texts = []
+        self.models = []
+        self.timestamps = []
+        self.loaded = False
+        self.dirty = False
+        self.embed = embed
+        self.repairs = []
+
+        summary = summary or {}
+        self.files = summary.get("files")
+        self.count = summary.get("count", 0)
+        self.chat_ids = set(summary.get("chat_ids", []))
+        self.model_names = set(summary.get("models", []))
+        self.min_ts = summary.get("min_ts")
+        self.max_ts = summary.get("max_ts")
+
+    def load(self):
+        if self.loaded:
+            return
+        files = self.files or {}
+        intact = True
+        if any(os.path.exists(path) or os.path.exists(f"{path}.bak") for path in (self.index_path, self.meta_path)):
+            with span("vector.partition_load", partition=self.key), timer("vector_partition_load_seconds"):
+                self.index, index_intact, index_backup = read_checked(self.index_path, files.get("index"), faiss.read_index)
+                meta, meta_intact, meta_backup = read_checked(self.meta_path, files.get("meta"), read_json)
+            intact = index_intact and meta_intact
+            if index_intact is False and self.index is not None and not index_backup:
+                # Readable, but neither it nor its backup is the index the manifest recorded
+                self.index = None
+                self.repairs.append("index failed its checksum")
+            for path, from_backup in ((self.index_path, index_backup), (self.meta_path, meta_backup)):
+                if from_backup:
+                    # Set the rejected file aside so the next save keeps the good .bak
+                    if os.path.exists(path):
+                        os.replace(path, f"{path}.rejected")
+                    self.repairs.append(f"restored {os.path.basename(path)} from backup")
+            if meta is not None:
+                self.ids = meta["ids"]
+                self.texts = meta["texts"]
+                # Legacy stores only carry ids and texts
+                self.models = meta.get("models", [None] * len(self.ids))
+                self.timestamps = meta.get("timestamps", [None] * len(self.ids))
+                self.aliases = {int(pos): ids for pos, ids in meta.get("aliases", {}).items()}
+        if self.index is None:
+            self.index = new_index(self.vector_dim, self.index_type)
+        if not intact or not self.files_match():
+            with span("vector.recover", partition=self.key):
+                self.repairs += self.recover()
+            # Rewrite whatever was read from backup or repaired on the next save
+            self.dirty = bool(self.repairs)
+        self.count = len(self.ids)
+        self._open_full_vectors()
+        self.chat_ids = {message_chat_id(message_id) for message_id in self.ids}
+        self.chat_ids.update(message_chat_id(a) for ids in self.aliases.values() for a in ids)
+        self.model_names = {m for m in self.models if m}
+        known_ts = [ts for ts in self.timestamps if ts]
+        self.min_ts = min(known_ts) if known_ts else None
+        self.max_ts = max(known_ts) if known_ts else None
+        self.loaded = True
+
+    def recover(self):
+        """
+        Bring the index, metadata and full-vector file back in step after an
+        interrupted save. Work is proportional to the rows out of step:
+        vectors without metadata are dropped and metadata without vectors is
+        re-embedded from its stored text. Returns the repairs made.
+        """
+        repairs = []
+        n = len(self.ids)
+        if self.index.ntotal > n:
+            repairs.append(f"dropped {self.index.ntotal - n} vectors without metadata")
+            self.index.remove_ids(faiss.IDSelectorRange(n, self.index.ntotal))
+        elif self.index.ntotal < n:
+            missing = self.texts[self.index.ntotal:]
+            if self.embed is None:
+                n = self.index.ntotal
+                for name in ("ids", "texts", "models", "timestamps"):
+                    setattr(self, name, getattr(self, name)[:n])
+                repairs.append(f"dropped {len(missing)} entries without vectors")
+            else:
+                embeddings = self.embed(missing)
+                train_index(self.index, embeddings)
+                self.index.add(embeddings)
+                repairs.append(f"re-embedded {len(missing)} entries")
+        if any(pos >= n for pos in self.aliases):
+            self.aliases = {pos: ids for pos, ids in self.aliases.items() if pos < n}
+            repairs.append("dropped aliases of missing entries")
+
+        if self.rerank_factor and index_type_of(self.index) != "flat" and os.path.exists(self.vectors_path):
+            row_bytes = 4 * self.vector_dim
+            size = os.path.getsize(self.vectors_path)
+            rows = min(size // row_bytes, n)
+            if size != rows * row_bytes:
+                os.truncate(self.vectors_path, rows * row_bytes)
+                repairs.append(f"truncated full vectors to {rows} rows")
+            if rows < n and self.embed is not None:
+                self.pending_vectors.append(np.array(self.embed(self.texts[rows:]), dtype='float32'))
+                repairs.append(f"re-embedded {n - rows} full vectors")
+        if repairs:
+            self.dirty = True
+        return repairs
+
+    def files_match(self):
+        """Cheap startup check: do the files still have the sizes the last save recorded?"""
+        if not self.files:
+            return True  # Written before manifests recorded files; counts are checked on load
+        expected = [(self.index_path, self.files["index"]["size"]), (self.meta_path, self.files["meta"]["size"])]
+        if "vectors" in self.files:
+            expected.append((self.vectors_path, self.files["vectors"]["size"]))
+        for path, size in expected:
+            try:
+                if os.path.getsize(path) != size:
+                    return False
+            except OSError:
+                if size:
+                    return False
+        return True
+
+    @property
+    def reranking(self):
+        """True when this partition re-ranks over full vectors."""
+        return (self.rerank_factor > 0 and index_type_of(self.index) != "flat"
+                and (self.full_vectors is not None or self.count == self._pending_rows()))
+
+    def _pending_rows(self):
+        return sum(len(block) for block in self.pending_vectors)
+
+    def _open_full_vectors(self):
+        self.full_vectors = None
+        if not self.rerank_factor or not os.path.exists(self.vectors_path):
+            return
+        rows = os.path.getsize(self.vectors_path) // (4 * self.vector_dim)
+        if rows != self.count - self._pending_rows():
+            # Out of step with the index (e.g. interrupted save); search without re-rank
+            return
+        if rows:
+            self.full_vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(rows, self.vector_dim))
+        else:
+            self.full_vectors = np.empty((0, self.vector_dim), dtype='float32')
+
+    def _full_rows(self):
+        """Row-indexable full vectors: the memory-mapped file plus unsaved rows."""
+        if not self.pending_vectors:
+            return self.full_vectors
+        pending = np.vstack(self.pending_vectors)
+        if self.full_vectors is None or not len(self.full_vectors):
+            return pending
+        return np.vstack([self.full_vectors, pending])
+
+    def exact_vectors(self):
+        """All vectors at full precision, and whether they had to be decoded lossily."""
+        self.load()
+        if self.reranking:
+            return np.array(self._full_rows(), dtype='float32'), False
+        vectors = self.index.reconstruct_n(0, self.index.ntotal) if self.index.ntotal else np.empty((0, self.vector_dim), dtype='float32')
+        return vectors, index_type_of(self.index) != "flat"
+
+    def rebuild(self, index_type, rerank_factor, vectors):
+        """Replace the index with one of ``index_type`` holding ``vectors``."""
+        self.index_type = index_type
+        self.rerank_factor = rerank_factor
+        self.index = new_index(self.vector_dim, index_type)
+        train_index(self.index, vectors)
+        if len(vectors):
+            self.index.add(vectors)
+        self.full_vectors = None
+        self.pending_vectors = [vectors] if rerank_factor and index_type != "flat" else []
+        if os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
+        self.dirty = True
+
+    def save(self):
+        """
+        Write the full vectors (appended), then the index and metadata, each
+        atomically with the previous version kept as .bak. The store's
+        manifest, written afterwards, records their checksums.
+        """
+        if self.pending_vectors and self.reranking:
+            with open(self.vectors_path, 'ab') as f:
+                for block in self.pending_vectors:
+                    f.write(np.ascontiguousarray(block, dtype='float32').tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.pending_vectors = []
+        self._open_full_vectors()
+        index_data = faiss.serialize_index(self.index).tobytes()
+        meta_data = json.dumps({
+            "ids": self.ids,
+            "texts": self.texts,
+            "models": self.models,
+            "timestamps": self.timestamps,
+            "aliases": {str(pos): ids for pos, ids in self.aliases.items()},
+        }).encode()
+        atomic_write(self.index_path, index_data, keep_backup=True)
+        atomic_write(self.meta_path, meta_data, keep_backup=True)
+        self.files = {
+            "index": {"size": len(index_data), "crc32": checksum(index_data)},
+            "meta": {"size": len(meta_data), "crc32": checksum(meta_data)},
+        }
+        if os.path.exists(self.vectors_path):
+            self.files["vectors"] = {"size": os.path.getsize(self.vectors_path)}
+        self.dirty = False
+
+    def position(self, message_id):
+        """Index position of ``message_id``, or None."""
+        self.load()
+        if self.positions is None or len(self.positions) != len(self.ids):
+            self.positions = {m: i for i, m in enumerate(self.ids)}
+        return self.positions.get(message_id)
+
+    def add_alias(self, position, message_id):
+        """Record ``message_id`` as a duplicate of the entry at ``position``."""
+        self.aliases.setdefault(position, []).append(message_id)
+        self.chat_ids.add(message_chat_id(message_id))
+        self.dirty = True
+
+    def vectors_at(self, positions):
+        """Vectors for ``positions``: exact when re-ranking, else decoded from the index."""
+        if self.reranking:
+            return np.asarray(self._full_rows()[positions], dtype='float32')
+        return np.vstack([self.index.reconstruct(int(i)) for i in positions])
+
+    def summary(self):
+        summary = {
+            "count": self.count,
+            "chat_ids": sorted(self.chat_ids),
+            "models": sorted(self.model_names),
+            "min_ts": self.min_ts,
+            "max_ts": self.max_ts,
+        }
+        if self.files:
+            summary["files"] = self.files
+        return summary
+
+    def add_many(self, embeddings, entries):
+        """Append embeddings with their (message_id, text, model, timestamp) entries."""
+        self.load()
+        train_index(self.index, embeddings)
+        self.index.add(embeddings)
+        if self.rerank_factor and index_type_of(self.index) != "flat":
+            self.pending_vectors.append(np.array(embeddings, dtype='float32'))
+        for message_id, text, model, timestamp in entries:
+            self.ids.append(message_id)
+            self.texts.append(text)
+            self.models.append(model)
+            self.timestamps.append(timestamp)
+            self.chat_ids.add(message_chat_id(message_id))
+            if model:
+                self.model_names.add(model)
+            self.min_ts = timestamp if self.min_ts is None else min(self.min_ts, timestamp)
+            self.max_ts = timestamp if self.max_ts is None else max(self.max_ts, timestamp)
+        self.count = len(self.ids)
+        self.dirty = True
+
+    def may_match(self, chat_id=None, model=None, since=None, until=None):
+        """Cheap check against the summary; False means no entry can match."""
+        if self.count == 0:
+            return False
+        if chat_id is not None and chat_id not in self.chat_ids:
+            return False
+        if model is not None and model not in self.model_names:
+            return False
+        if since is not None and (self.max_ts is None or self.max_ts < since):
+            return False
+        if until is not None and (self.min_ts is None or self.min_ts > until):
+            return False
+        return True
+
+    def matching_positions(self, chat_id=None, model=None, since=None, until=None):
+        """Positions matching the filters, or None when every entry matches."""
+        if chat_id is None and model is None and since is None and until is None:
+            return None
+        positions = []
+        for i, message_id in enumerate(self.ids):
+            if chat_id is not None and message_chat_id(message_id) != chat_id and not any(
+                message_chat_id(a) == chat_id for a in self.aliases.get(i, ())
+            ):
+                continue
+            if model is not None and self.models[i] != model:
+                continue
+            ts = self.timestamps[i]
+            if since is not None and (ts is None or ts < since):
+                continue
+            if until is not None and (ts is None or ts > until):
+                continue
+            positions.append(i)
+        if len(positions) == len(self.ids):
+            return None
+        return positions
+
+    def search(self, query_embeddings, top_k, with_positions=False, **filters):
+        """
+        Search a (n, dim) query matrix; returns one list of (message_id, text,
+        distance) per query row, with the index position appended if asked.
+        """
+        self.load()
+        n_queries = len(query_embeddings)
+        if self.index.ntotal == 0:
+            return [[] for _ in range(n_queries)]
+        positions = self.matching_positions(**filters)
+        if positions is not None and not positions:
+            return [[] for _ in range(n_queries)]
+        reranking = self.reranking
+        fetch_k = top_k * self.rerank_factor if reranking else top_k
+        with span("vector.faiss_search", partition=self.key, queries=n_queries):
+            if positions is None:
+                distances, indices = self.index.search(query_embeddings, min(fetch_k, self.index.ntotal))
+            else:
+                subset = np.array(positions, dtype='int64')
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(len(subset), faiss.swig_ptr(subset)))
+                distances, indices = self.index.search(query_embeddings, min(fetch_k, len(positions)), params=params)
+        if reranking:
+            with span("vector.rerank", partition=self.key, candidates=indices.size):
+                vectors = self._full_rows()
+                reranked = [rerank(query_embeddings[row], indices[row][indices[row] >= 0], vectors, top_k)
+                            for row in range(n_queries)]
+            indices = [r[0] for r in reranked]
+            distances = [r[1] for r in reranked]
+        all_results = []
+        for row in range(n_queries):
+            results = []
+            for i, idx in enumerate(indices[row]):
+                if 0 <= idx < len(self.ids):
+                    result = (self.ids[idx], self.texts[idx], distances[row][i])
+                    results.append(result + (int(idx),) if with_positions else result)
+            all_results.append(results)
+        return all_results
+
+
+def read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def read_checked(path, expected, parse):
+    """
+    Parse ``path`` with ``parse(path)``, falling back to its .bak copy.
+    ``expected`` is the size and checksum the manifest recorded (None for
+    stores written before they were recorded). The first of these wins:
+    ``path`` matching it, the .bak matching it, then whichever parses.
+    Returns (value, intact, from_backup); intact is whether the file read
+    matched, or None when nothing was recorded. (None, False, False) when
+    neither copy can be read.
+    """
+    candidates = (path, f"{path}.bak")
+
+    def matches(candidate):
+        try:
+            return (expected is not None and os.path.getsize(candidate) == expected["size"]
+                    and file_checksum(candidate) == expected["crc32"])
+        except OSError:
+            return False
+
+    intact = next((candidate for candidate in candidates if matches(candidate)), None)
+    for candidate in ([intact] if intact else []) + [c for c in candidates if c != intact]:
+        try:
+            value = parse(candidate)
+        except (OSError, ValueError, KeyError, RuntimeError):
+            continue
+        return value, (candidate == intact) if expected is not None else None, candidate != path
+    return None, False, False
+
+
+def new_index(vector_dim, index_type="flat"):
+    """An empty index of ``index_type``. sq8 indexes are trained on first add."""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(vector_dim)
+    if index_type == "sq16":
+        return faiss.IndexScalarQuantizer(vector_dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(vector_dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    raise ValueError(f"Unknown index type '{index_type}'. Choose one of: {', '.join(INDEX_TYPES)}")
+
+
+def train_index(index, embeddings):
+    """
+    Train an untrained scalar quantizer on a fixed per-dimension range instead
+    of the data, so a month's first message doesn't fix the range for the rest.
+    Sentence embeddings are unit-normalized, so [-1, 1] covers them.
+    """
+    if index.is_trained:
+        return
+    bound = max(1.0, float(np.abs(embeddings).max())) if len(embeddings) else 1.0
+    dim = index.d
+    index.train(np.vstack([np.full((1, dim), -bound), np.full((1, dim), bound)]).astype('float32'))
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def index_bytes(index):
+    """Bytes held by the index's vector codes."""
+    return index.ntotal * index.sa_code_size()
+
+
+def rerank(query, candidates, vectors, top_k):
+    """
+    Re-order candidate positions by exact L2 distance to ``query`` using full
+    float32 ``vectors``; returns (positions, distances) for the ``top_k`` best.
+    """
+    if not len(candidates):
+        return candidates, np.empty(0, dtype='float32')
+    positions = np.sort(candidates)  # sorted reads are sequential on a memory map
+    exact = np.asarray(vectors[positions], dtype='float32')
+    distances = ((exact - query) ** 2).sum(axis=1)
+    best = np.argsort(distances, kind="stable")[:top_k]
+    return positions[best], distances[best]
+
+
+def text_hash(text):
+    """Hash of a message with case and whitespace normalized, for exact dedup."""
+    normalized = re.sub(r"\s+", " ", text.strip().lower())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def l2_to_cosine(distance):
+    """Cosine similarity from squared L2 distance between unit vectors."""
+    return 1.0 - float(distance) / 2.0
+
+
+def mmr(query, candidates, vectors, top_k, lambda_, max_similarity=None):
+    """
+    Maximal marginal relevance: pick ``top_k`` of ``candidates`` trading off
+    similarity to ``query`` against similarity to what is already picked.
+    Candidates at least ``max_similarity`` to a picked one are only used if
+    nothing else is left. ``vectors`` holds one row per candidate; returns
+    the chosen indices.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    relevance = vectors @ (query / (np.linalg.norm(query) or 1.0))
+    chosen = []
+    redundancy = np.full(len(candidates), -np.inf)
+    remaining = list(range(len(candidates)))
+    while remaining and len(chosen) < top_k:
+        pool = remaining
+        if max_similarity is not None:
+            pool = [i for i in remaining if redundancy[i] < max_similarity] or remaining
+        scores = [lambda_ * relevance[i] - (1 - lambda_) * max(redundancy[i], 0.0) for i in pool]
+        best = pool[int(np.argmax(scores))]
+        remaining.remove(best)
+        chosen.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return chosen
+
+
+def message_chat_id(message_id):
+    """Chat id part of a "<chat_id>:<message_index>" vector id."""
+    return message_id.split(":", 1)[0]
+
+
+def partition_paths(vector_store_path, key):
+    """(index path, metadata path) of a partition; the legacy one sits beside the store directory."""
+    if key == LEGACY_PARTITION:
+        return f"{vector_store_path}.faiss", f"{vector_store_path}.json"
+    return os.path.join(vector_store_path, f"{key}.faiss"), os.path.join(vector_store_path, f"{key}.json")
+
+
+def read_manifest(vector_store_path):
+    """
+    A store's manifest, or its .bak copy if it is unreadable or fails its
+    checksum; None if neither. Needs no embedding model.
+    """
+    manifest_path = os.path.join(vector_store_path, MANIFEST_FILE)
+    for path in (manifest_path, f"{manifest_path}.bak"):
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        expected = manifest.pop("checksum", None)
+        if expected is None or expected == checksum(json.dumps(manifest, sort_keys=True).encode()):
+            return manifest
+    return None
+
 
 class VectorStore:
-    def __init__(self, vector_store_path, embedding_model_name):
+    """
+    Message embeddings split into monthly partitions under ``vector_store_path``.
+    A pre-partitioning store (``vector_store_path``.faiss/.json) is kept as a
+    read-only "legacy" partition whose entries have no model or timestamp.
+    ``embedding_model`` may be any object with the SentenceTransformer
+    ``encode``/``get_sentence_embedding_dimension`` interface.
+
+    Adds skip messages whose normalized text was seen before or whose nearest
+    neighbour has cosine similarity >= ``dedup_similarity``; they are recorded
+    as aliases of the stored entry. Searches diversify results with MMR
+    weighted by ``mmr_lambda`` (1.0 = plain nearest neighbours). Up to
+    ``search_workers`` partitions are searched in parallel (default: all cores).
+    """
+
+    def __init__(self, vector_store_path, embedding_model_name, embedding_model=None,
+                 dedup=True, dedup_similarity=0.97, mmr_lambda=0.7, search_workers=None):
         self.vector_store_path = vector_store_path
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+        self.embedding_model_name = embedding_model_name
+        if embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            with timer("embedding_model_load_seconds"):
+                embedding_model = SentenceTransformer(embedding_model_name)
+        self.embedding_model = embedding_model
         self.vector_dim = self.embedding_model.get_sentence_embedding_dimension()
-        self.vector_index = None
-        self.vector_ids = []
-        self.vector_texts = []
+        self.normalized = None
+        self.index_type = "flat"
+        self.rerank_factor = 0
+        self.dedup = dedup
+        self.dedup_similarity = dedup_similarity
+        self.mmr_lambda = mmr_lambda
+        self.search_workers = search_workers or os.cpu_count() or 1
+        self.hashes = None
+        self.new_hashes = []
+        self.partitions = {}
         self.console = Console()
-        self._load_or_init()
-        
+        with timer("vector_store_open_seconds"):
+            self._load_or_init()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.vector_store_path, MANIFEST_FILE)
+
+    def _partition(self, key, summary=None):
+        index_path, meta_path = partition_paths(self.vector_store_path, key)
+        return Partition(key, index_path, meta_path, self.vector_dim, summary,
+                         index_type=self.index_type, rerank_factor=self.rerank_factor,
+                         embed=self.embed)
+
+    def _read_manifest(self):
+        return read_manifest(self.vector_store_path)
+
+    def _partition_keys_on_disk(self):
+        if not os.path.isdir(self.vector_store_path):
+            return []
+        keys = set()
+        for name in os.listdir(self.vector_store_path):
+            match = PARTITION_KEY_RE.match(name[:-4] if name.endswith(".bak") else name)
+            if match:
+                keys.add(match.group(1))
+            elif name.endswith(".tmp") and time.time() - os.path.getmtime(
+                    os.path.join(self.vector_store_path, name)) > STALE_TMP_SECONDS:
+                os.remove(os.path.join(self.vector_store_path, name))
+        return sorted(keys)
+
     def _load_or_init(self):
-        if os.path.exists(f"{self.vector_store_path}.faiss") and os.path.exists(f"{self.vector_store_path}.json"):
-            self.vector_index = faiss.read_index(f"{self.vector_store_path}.faiss")
-            with open(f"{self.vector_store_path}.json", 'r') as f:
-                vector_data = json.load(f)
-                self.vector_ids = vector_data["ids"]
-                self.vector_texts = vector_data["texts"]
-        else:
-            self.vector_index = faiss.IndexFlatL2(self.vector_dim)
-            self.vector_ids = []
-            self.vector_texts = []
-        
+        self.partitions = {}
+        summaries = {}
+        keys_on_disk = self._partition_keys_on_disk()
+        manifest = self._read_manifest()
+        if manifest is not None:
+            summaries = manifest.get("partitions", {})
+            self.index_type = manifest.get("index_type", "flat")
+            self.rerank_factor = manifest.get("rerank_factor", 0)
+            self._check_embedding(manifest.get("embedding"))
+        elif keys_on_disk:
+            # Manifest lost: rebuild summaries from the partition files themselves
+            self.console.print(f"[yellow]Vector store manifest missing or damaged; rebuilding it from {len(keys_on_disk)} partitions.[/yellow]")
+            summaries = {key: None for key in keys_on_disk}
+            if any(os.path.exists(os.path.join(self.vector_store_path, f"{key}.f32")) for key in keys_on_disk):
+                self.rerank_factor = DEFAULT_RERANK_FACTOR
+        for key, summary in summaries.items():
+            self.partitions[key] = self._partition(key, summary)
+        if manifest is None and keys_on_disk:
+            for partition in self.partitions.values():
+                partition.load()
+                self.index_type = index_type_of(partition.index)
+                partition.dirty = True
+        self.recover()
+
+        if LEGACY_PARTITION not in self.partitions and os.path.exists(f"{self.vector_store_path}.faiss"):
+            legacy = self._partition(LEGACY_PARTITION)
+            legacy.load()
+            if legacy.index.d != self.vector_dim:
+                self._check_embedding({"model": None, "dim": legacy.index.d})
+            self.partitions[LEGACY_PARTITION] = legacy
+            self._save_manifest()
+
+    def _check_embedding(self, embedding):
+        """Refuse to mix vectors from a different embedding model or dimension."""
+        if not embedding:
+            return  # Stores from before manifests recorded the model
+        model, dim = embedding.get("model"), embedding.get("dim")
+        if dim is not None and dim != self.vector_dim or (
+            model and self.embedding_model_name and model != self.embedding_model_name
+        ):
+            raise ValueError(
+                f"Vector store '{self.vector_store_path}' was built with {model} ({dim} dims), "
+                f"not {self.embedding_model_name} ({self.vector_dim} dims). "
+                f"Run 'localrag reindex {self.embedding_model_name}' to re-embed it."
+            )
+        self.normalized = embedding.get("normalized")
+
+    def recover(self):
+        """
+        Startup consistency check. Only partitions whose files no longer
+        match the sizes recorded in the manifest are read and repaired
+        (checksums are verified whenever a partition is loaded), so the cost
+        is proportional to the damage rather than to the store.
+        """
+        repaired = {}
+        for key, partition in sorted(self.partitions.items()):
+            if not partition.loaded and partition.files_match():
+                continue
+            partition.load()
+            if partition.repairs:
+                repaired[key] = partition.repairs
+        inc("vector_partitions_recovered_total", len(repaired))
+        for key, repairs in repaired.items():
+            self.console.print(f"[yellow]Recovered vector partition {key}: {'; '.join(repairs)}[/yellow]")
+        if repaired:
+            # Rows may have been dropped; rebuild the text hash index from the partitions
+            if os.path.exists(self.hashes_path):
+                os.remove(self.hashes_path)
+        if any(p.dirty for p in self.partitions.values()):
+            self.save()
+        return repaired
+
+    def embedding_info(self):
+        """Model, dimension and normalization recorded in the manifest."""
+        return {"model": self.embedding_model_name, "dim": self.vector_dim, "normalized": self.normalized}
+
+    def _save_manifest(self):
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        manifest = {
+            "version": 1,
+            "embedding": self.embedding_info(),
+            "index_type": self.index_type,
+            "rerank_factor": self.rerank_factor,
+            "partitions": {key: p.summary() for key, p in sorted(self.partitions.items())},
+        }
+        manifest["checksum"] = checksum(json.dumps(manifest, sort_keys=True).encode())
+        atomic_write_json(self.manifest_path, manifest, keep_backup=True)
+
+    @property
+    def hashes_path(self):
+        return os.path.join(self.vector_store_path, HASHES_FILE)
+
+    def _load_hashes(self):
+        """
+        Text hash -> stored message id, kept in an append-only "<hash>\t<id>"
+        file; built from every partition the first time.
+        """
+        if self.hashes is not None:
+            return self.hashes
+        self.hashes = {}
+        if os.path.exists(self.hashes_path):
+            with open(self.hashes_path, 'r') as f:
+                data = f.read()
+            if not data.endswith("\n") and data:
+                # Torn append; drop the partial line so the next append starts clean
+                data = data[:data.rfind("\n") + 1]
+                with open(self.hashes_path, 'r+') as f:
+                    f.truncate(len(data.encode()))
+            for line in data.splitlines():
+                digest, _, message_id = line.partition("\t")
+                if message_id:
+                    self.hashes.setdefault(digest, message_id)
+            return self.hashes
+        for partition in self.partitions.values():
+            partition.load()
+            for message_id, text in zip(partition.ids, partition.texts):
+                digest = text_hash(text)
+                if digest not in self.hashes:
+                    self.hashes[digest] = message_id
+                    self.new_hashes.append((digest, message_id))
+        return self.hashes
+
+    def _duplicates(self, batch, embeddings):
+        """
+        Split a batch into rows to index and (alias_id, canonical_id) pairs for
+        exact or near duplicates of stored entries or of earlier rows.
+        """
+        hashes = self._load_hashes()
+        near = None
+        if self.dedup_similarity and self.ntotal:
+            near = self.search_many([None] * len(batch), top_k=1, embeddings=embeddings, diversify=False)
+        kept, aliases = [], []
+        for row, (message_id, text, _, _) in enumerate(batch):
+            digest = text_hash(text)
+            canonical = hashes.get(digest)
+            if canonical is None and self.dedup_similarity:
+                if near and near[row] and l2_to_cosine(near[row][0][2]) >= self.dedup_similarity:
+                    canonical = near[row][0][0]
+                elif kept:
+                    similarities = embeddings[kept] @ embeddings[row]
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.dedup_similarity:
+                        canonical = batch[kept[best]][0]
+            if canonical is None:
+                kept.append(row)
+                canonical = message_id
+            else:
+                aliases.append((message_id, canonical))
+            if digest not in hashes:
+                hashes[digest] = canonical
+                self.new_hashes.append((digest, canonical))
+        return kept, aliases
+
+    def _add_alias(self, canonical_id, alias_id):
+        chat_id = message_chat_id(canonical_id)
+        for partition in self.partitions.values():
+            if chat_id in partition.chat_ids:
+                position = partition.position(canonical_id)
+                if position is not None:
+                    partition.add_alias(position, alias_id)
+                    return
+
+    @property
+    def ntotal(self):
+        return sum(p.count for p in self.partitions.values())
+
     def save(self):
-        os.makedirs(os.path.dirname(self.vector_store_path), exist_ok=True)
-        faiss.write_index(self.vector_index, f"{self.vector_store_path}.faiss")
-        with open(f"{self.vector_store_path}.json", 'w') as f:
-            json.dump({"ids": self.vector_ids, "texts": self.vector_texts}, f)
-    
-    def _get_embedding(self, text):
-        """Get embedding for text using sentence-transformers."""
-        # Always use sentence-transformers for embeddings
-        return self.embedding_model.encode([text])[0]
-        
-    def add(self, chat_id, text):
-        embedding = self._get_embedding(text)
-        embedding = embedding.reshape(1, -1).astype('float32')
-        self.vector_index.add(embedding)
-        self.vector_ids.append(chat_id)
-        self.vector_texts.append(text)
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        dirty = [p for p in self.partitions.values() if p.dirty]
+        if dirty:
+            with span("vector.save", partitions=len(dirty)), timer("vector_save_seconds"):
+                for partition in dirty:
+                    partition.save()
+                # The manifest is the commit point: it ties the files just written together
+                self._save_manifest()
+        if self.new_hashes:
+            # Appended after the partitions so hashes never name unsaved messages
+            with open(self.hashes_path, 'a') as f:
+                f.writelines(f"{digest}\t{message_id}\n" for digest, message_id in self.new_hashes)
+            self.new_hashes = []
+
+    def add(self, message_id, text, model=None, timestamp=None):
+        with span("vector.add"):
+            self.add_many([(message_id, text, model, timestamp)])
+
+    def add_many(self, entries, batch_size=256, embeddings=None):
+        """
+        Embed and add (message_id, text, model, timestamp) entries in batches,
+        saving once at the end. ``model`` and ``timestamp`` may be None.
+        ``embeddings`` skips embedding when the caller already has them.
+        """
+        now = datetime.datetime.now().isoformat()
+        all_embeddings = embeddings
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            if all_embeddings is None:
+                embeddings = self.embed([text for _, text, _, _ in batch])
+            else:
+                embeddings = np.asarray(all_embeddings[start:start + batch_size], dtype='float32')
+            kept, aliases = self._duplicates(batch, embeddings) if self.dedup else (range(len(batch)), [])
+            by_partition = {}
+            for row in kept:
+                message_id, text, model, timestamp = batch[row]
+                timestamp = timestamp or now
+                by_partition.setdefault(partition_key(timestamp), []).append(
+                    (row, message_id, text, model, timestamp)
+                )
+            for key, rows in by_partition.items():
+                if key not in self.partitions:
+                    self.partitions[key] = self._partition(key)
+                self.partitions[key].add_many(
+                    embeddings[[row for row, _, _, _, _ in rows]],
+                    [r[1:] for r in rows],
+                )
+            for alias_id, canonical_id in aliases:
+                self._add_alias(canonical_id, alias_id)
+            inc("vector_messages_added_total", len(batch))
+            inc("vector_duplicates_total", len(aliases))
         self.save()
-        
-    def search(self, query, top_k=5):
-        if self.vector_index.ntotal == 0:
-            return []
-        query_embedding = self._get_embedding(query)
-        query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        distances, indices = self.vector_index.search(query_embedding, min(top_k, self.vector_index.ntotal))
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.vector_ids) and idx >= 0:
-                chat_id = self.vector_ids[idx]
-                text = self.vector_texts[idx]
-                distance = distances[0][i]
-                results.append((chat_id, text, distance))
-        return results
\ No newline at end of file
+
+    def search(self, query, top_k=5, chat_id=None, model=None, since=None, until=None):
+        """
+        Return up to ``top_k`` (message_id, text, distance) tuples, nearest first.
+        Filters restrict results to one chat, one model and/or an ISO timestamp
+        range; partitions whose summary rules them out are never loaded.
+        """
+        return self.search_many([query], top_k, chat_id=chat_id, model=model, since=since, until=until)[0]
+
+    def embed(self, texts):
+        """Embed a list of texts into a (len(texts), vector_dim) float32 array."""
+        with span("vector.embed", texts=len(texts)), timer("vector_embed_seconds"):
+            embeddings = np.asarray(self.embedding_model.encode(list(texts)), dtype='float32').reshape(len(texts), -1)
+        if self.normalized is None and len(embeddings):
+            self.normalized = bool(np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-3))
+        return embeddings
+
+    def search_many(self, queries, top_k=5, chat_id=None, model=None, since=None, until=None, embeddings=None,
+                    diversify=True, exclude_ids=None):
+        """
+        Like search() for a list of queries, with one batched embedding call and
+        one FAISS call per partition. Returns one result list per query.
+        Pass ``embeddings`` (from embed()) to reuse already computed vectors,
+        and ``exclude_ids`` to leave out messages the caller already has.
+        """
+        filters = {"chat_id": chat_id, "model": model, "since": since, "until": until}
+        candidates = [p for p in self.partitions.values() if p.may_match(**filters)]
+        if not candidates or not queries:
+            return [[] for _ in queries]
+        with span("vector.search", partitions=len(candidates), queries=len(queries)), timer("vector_search_seconds"):
+            query_embeddings = embeddings if embeddings is not None else self.embed(queries)
+            diversify = diversify and self.mmr_lambda is not None and self.mmr_lambda < 1.0
+            fetch_k = top_k * MMR_FETCH_FACTOR if diversify else top_k
+            exclude_ids = exclude_ids or ()
+            fetch_k += len(exclude_ids)
+
+            def search_partition(partition):
+                return partition.search(query_embeddings, fetch_k, with_positions=diversify, **filters)
+
+            if len(candidates) == 1:
+                partial_results = [search_partition(candidates[0])]
+            else:
+                # FAISS releases the GIL while searching, so partitions scan in parallel
+                with ThreadPoolExecutor(max_workers=min(len(candidates), self.search_workers)) as pool:
+                    partial_results = list(pool.map(search_partition, candidates))
+            merged = []
+            for row in range(len(queries)):
+                row_results = ((result, partition) for partition, results in zip(candidates, partial_results)
+                               for result in results[row] if result[0] not in exclude_ids)
+                nearest = heapq.nsmallest(fetch_k, row_results, key=lambda r: r[0][2])
+                if diversify and len(nearest) > top_k:
+                    with span("vector.mmr", candidates=len(nearest)):
+                        vectors = np.vstack([partition.vectors_at([result[3]]) for result, partition in nearest])
+                        chosen = sorted(mmr(query_embeddings[row], nearest, vectors, top_k, self.mmr_lambda,
+                                                 self.dedup_similarity or None))
+                    nearest = [nearest[i] for i in chosen]
+                merged.append([result[:3] for result, _ in nearest[:top_k]])
+            return merged
+
+    def memory_report(self):
+        """Per-partition vector counts, index type and in-memory code bytes."""
+        rows = []
+        for key, partition in sorted(self.partitions.items()):
+            partition.load()
+            rows.append({
+                "partition": key,
+                "vectors": partition.index.ntotal,
+                "index_type": index_type_of(partition.index),
+                "index_bytes": index_bytes(partition.index),
+                "rerank": partition.reranking,
+            })
+        return rows
+
+    def migrate(self, index_type, rerank_factor=0, sample=200, top_k=10, seed=0):
+        """
+        Rebuild every partition as ``index_type`` (re-ranking over full vectors
+        when ``rerank_factor`` > 0). Recall@top_k of the new indexes is measured
+        against exact search on up to ``sample`` stored vectors used as queries.
+        Returns a report of index bytes before/after and recall.
+        """
+        new_index(self.vector_dim, index_type)  # validate before touching anything
+        rng = np.random.default_rng(seed)
+        total = max(1, self.ntotal)
+        report = {"index_type": index_type, "rerank_factor": rerank_factor, "vectors": 0,
+                  "before_bytes": 0, "after_bytes": 0, "full_vector_bytes": 0, "lossy_partitions": []}
+        hits = {"compressed": 0, "reranked": 0}
+        n_queries = 0
+        for key, partition in sorted(self.partitions.items()):
+            vectors, lossy = partition.exact_vectors()
+            if lossy:
+                report["lossy_partitions"].append(key)
+            report["before_bytes"] += index_bytes(partition.index)
+            partition.rebuild(index_type, rerank_factor, vectors)
+            report["after_bytes"] += index_bytes(partition.index)
+            report["vectors"] += len(vectors)
+            if partition.reranking:
+                report["full_vector_bytes"] += vectors.nbytes
+
+            k = min(top_k, len(vectors))
+            n_sample = min(len(vectors), int(np.ceil(sample * len(vectors) / total)))
+            if not k or not n_sample:
+                continue
+            queries = vectors[rng.choice(len(vectors), n_sample, replace=False)]
+            exact = faiss.IndexFlatL2(self.vector_dim)
+            exact.add(vectors)
+            _, truth = exact.search(queries, k)
+            _, found = partition.index.search(queries, k)
+            _, candidates = partition.index.search(queries, min(len(vectors), k * max(rerank_factor, 1)))
+            for row in range(n_sample):
+                expected = set(truth[row])
+                hits["compressed"] += len(expected & set(found[row]))
+                reranked, _ = rerank(queries[row], candidates[row][candidates[row] >= 0], vectors, k)
+                hits["reranked"] += len(expected & set(reranked))
+            n_queries += n_sample * k
+        self.index_type = index_type
+        self.rerank_factor = rerank_factor
+        self.save()
+        report["recall"] = hits["compressed"] / n_queries if n_queries else 1.0
+        report["recall_reranked"] = hits["reranked"] / n_queries if n_queries else 1.0
+        report["top_k"] = top_k
+        return report